@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from src.data import clean_dataset
+from src.data import data_dictionary
+from src.data import make_synthetic_dataset
+from src.data import storage
+from src.features import build_features
+from src.models import model_bundle
+from src.models import predict_model
+from src.models import train_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = os.path.join("reports", "benchmarks", "baseline.json")
+DEFAULT_ROWS = 100000
+# A benchmark regresses if its fastest run is this much slower than the baseline's fastest run.
+DEFAULT_TOLERANCE = 0.25
+# Benchmarks faster than this are too noisy to compare against the baseline.
+MIN_COMPARE_SECONDS = 0.05
+
+def time_call(func, setup = None, repeat = 3):
+    """
+    Times func over repeat runs. setup, if given, is called (untimed) before each run and its result
+    passed to func, eg. to give each run a fresh copy of a dataframe that func modifies in place.
+
+    Returns:
+    times (list): Wall time of each run in seconds.
+    result: The result of the last run.
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return times, result
+
+def summarise(times, result):
+    """
+    Returns the min and median time of a benchmark, and the number of rows of its result.
+    """
+    rows = len(result) if isinstance(result, (pd.DataFrame, np.ndarray)) else None
+    return {"min": min(times), "median": float(np.median(times)), "runs": len(times), "rows": rows}
+
+def run_function_benchmarks(raw_file, work_dir, repeat):
+    """
+    Benchmarks each step of the pipeline on its own, on the output of the step before it.
+
+    Parameters:
+    raw_file (string): Location of the raw (synthetic) CSV file.
+    work_dir (string): Directory for intermediate files.
+    repeat (int): Number of runs of each step.
+
+    Returns:
+    results (dict): summarise of each step, by name.
+    """
+    results = {}
+    def run(name, func, setup = None):
+        logger.info(f"Benchmarking {name}")
+        times, result = time_call(func, setup, repeat)
+        results[name] = summarise(times, result)
+        return result
+
+    settlement_cols = clean_dataset.settlement_columns()
+    options = clean_dataset.raw_read_options(raw_file, settlement_cols)
+    df = run("read_raw", lambda: clean_dataset.read_raw(raw_file, options))
+    df = run("add_target_variable", clean_dataset.add_target_variable, df.copy)
+    df = run("fix_missing_values", lambda x: clean_dataset.fix_missing_values(x, settlement_cols), df.copy)
+    df = run("remove_future_columns", clean_dataset.remove_future_columns, df.copy)
+    df = run("fix_dtypes", clean_dataset.fix_dtypes, df.copy)
+    df = run("add_features", build_features.add_features, df.copy)
+
+    processed_file = os.path.join(work_dir, "processed.parquet")
+    run("write_frame", lambda: storage.write_frame(df, processed_file))
+    results["write_frame"]["rows"] = len(df)
+    run("read_frame", lambda: storage.read_frame(processed_file))
+
+    X_train, X_test, y_train, y_test = train_model.data_from_dataset(processed_file)
+    X_train.fillna(0, inplace = True)
+    X_test.fillna(0, inplace = True)
+    X_train, y_train = train_model.undersample_dataset(X_train, y_train)
+    pipeline = model_bundle.make_pipeline(random_state = train_model.RANDOM_STATE)
+    run("fit", lambda: pipeline.fit(X_train, y_train))
+    results["fit"]["rows"] = len(X_train)
+    run("predict", lambda: pipeline.predict_proba(X_test))
+    return results
+
+def run_end_to_end_benchmarks(raw_file, work_dir, repeat):
+    """
+    Benchmarks each pipeline script end to end, as make runs them: cleaning, adding features,
+    training and predicting.
+
+    Parameters:
+    raw_file (string): Location of the raw (synthetic) CSV file.
+    work_dir (string): Directory for the files the scripts write.
+    repeat (int): Number of runs of each script.
+
+    Returns:
+    results (dict): summarise of each script, by name.
+    """
+    interim_file = os.path.join(work_dir, "interim.parquet")
+    processed_file = os.path.join(work_dir, "processed.parquet")
+    model_file = os.path.join(work_dir, "model.pickle")
+    predictions_file = os.path.join(work_dir, "predictions.csv")
+    scripts = {
+        "clean_dataset_main": lambda: clean_dataset.clean_dataset_main(raw_file, interim_file),
+        "build_features_main": lambda: build_features.build_features_main(interim_file, processed_file),
+        "train_model_main": lambda: train_model.main([processed_file, model_file], standalone_mode = False),
+        "predict_model_main": lambda: predict_model.main([model_file, processed_file, predictions_file],
+                                                         standalone_mode = False),
+    }
+    results = {}
+    for name, func in scripts.items():
+        logger.info(f"Benchmarking {name}")
+        times, _ = time_call(func, repeat = repeat)
+        results[name] = summarise(times, None)
+    results["clean_dataset_main"]["rows"] = len(storage.read_frame(interim_file, columns = ["target"]))
+    results["build_features_main"]["rows"] = len(storage.read_frame(processed_file, columns = ["target"]))
+    results["predict_model_main"]["rows"] = len(np.loadtxt(predictions_file, delimiter = ","))
+    return results
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Compares benchmark results to a baseline run.
+
+    Parameters:
+    results (dict): Results of this run (see run_benchmarks).
+    baseline (dict): Results of the baseline run.
+    tolerance (float): Fraction by which a benchmark may be slower than the baseline.
+
+    Returns:
+    comparison (pandas.DataFrame): Time of each benchmark in this run and the baseline, and whether
+                                   it regressed.
+    """
+    if baseline["rows"] != results["rows"]:
+        logger.warning(f"Baseline was run on {baseline['rows']} rows, this run on {results['rows']}: "
+                       "times are not comparable")
+    rows = []
+    for name, result in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        row = {"benchmark": name, "min": result["min"], "median": result["median"], "rows": result["rows"]}
+        if base:
+            row.update(baseline_min = base["min"], ratio = result["min"] / base["min"],
+                       regressed = (base["rows"] == result["rows"] and result["min"] >= MIN_COMPARE_SECONDS
+                                    and result["min"] > base["min"] * (1 + tolerance)))
+        rows.append(row)
+    comparison = pd.DataFrame(rows).set_index("benchmark")
+    if "regressed" not in comparison:
+        comparison["regressed"] = False
+    comparison["regressed"] = comparison["regressed"].fillna(False).astype(bool)
+    return comparison
+
+def run_benchmarks(n_rows, repeat, seed = 0, work_dir = None):
+    """
+    Generates a synthetic raw dataset (see make_synthetic_dataset) and benchmarks the pipeline on it,
+    step by step and end to end. The benchmarks run in work_dir, with the synthetic data dictionary
+    in place of references/LCDataDictionary.xlsx, so the real data is never needed.
+
+    Parameters:
+    n_rows (int): Number of rows of synthetic data.
+    repeat (int): Number of runs of each benchmark.
+    seed (int): Random seed of the synthetic data.
+    work_dir (string): Directory to run in. If None, a temporary directory is used and removed.
+
+    Returns:
+    results (dict): The size of the run, the versions of the libraries, and the min and median time
+                    and output rows of each benchmark.
+    """
+    cwd = os.getcwd()
+    temporary = work_dir is None
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix = "benchmarks-"))
+    os.makedirs(work_dir, exist_ok = True)
+    try:
+        os.chdir(work_dir)
+        raw_file = os.path.join("data", "raw", "loan.csv")
+        make_synthetic_dataset.make_synthetic_dataset(raw_file, n_rows, seed, data_dictionary.DATA_DICTIONARY)
+        results = {"rows": n_rows, "seed": seed, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "versions": {"python": platform.python_version(), "numpy": np.__version__,
+                                "pandas": pd.__version__, "sklearn": sklearn.__version__},
+                   "benchmarks": {}}
+        results["benchmarks"].update(run_function_benchmarks(raw_file, "data", repeat))
+        results["benchmarks"].update(run_end_to_end_benchmarks(raw_file, "data", repeat))
+    finally:
+        os.chdir(cwd)
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors = True)
+    return results
+
+@click.command()
+@click.option('--rows', type=click.INT, default=DEFAULT_ROWS, help='Rows of synthetic data to benchmark on.')
+@click.option('--repeat', type=click.INT, default=3, help='Runs of each benchmark; the fastest is compared.')
+@click.option('--seed', type=click.INT, default=0, help='Random seed of the synthetic data.')
+@click.option('--work-dir', type=click.Path(), default=None,
+              help='Directory to run in (kept afterwards); a temporary directory by default.')
+@click.option('--baseline', type=click.Path(), default=DEFAULT_BASELINE, help='Baseline results to compare to.')
+@click.option('--save-baseline', is_flag=True, help='Save this run as the baseline rather than comparing.')
+@click.option('--tolerance', type=click.FLOAT, default=DEFAULT_TOLERANCE,
+              help='Fraction by which a benchmark may be slower than the baseline.')
+@click.option('--output', type=click.Path(), default=None, help='Also save the results of this run here.')
+def main(rows, repeat, seed, work_dir, baseline, save_baseline, tolerance, output):
+    """
+    Benchmarks the pipeline on synthetic data, and compares the times to a stored baseline.
+    Exits with status 1 if any benchmark is more than tolerance slower than in the baseline, or if there
+    is no baseline (times depend on the machine, so one has to be saved there with save_baseline first).
+    """
+    baseline = os.path.abspath(baseline)
+    if not save_baseline and not os.path.exists(baseline):
+        raise click.ClickException(f"No baseline at {baseline}: run with --save-baseline on this machine first")
+    results = run_benchmarks(rows, repeat, seed, work_dir)
+
+    for path in [output, baseline if save_baseline else None]:
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+            with open(path, "w") as f:
+                json.dump(results, f, indent = 2)
+            logger.info(f"Saved benchmark results to {path}")
+
+    if save_baseline:
+        table = pd.DataFrame.from_dict(results["benchmarks"], orient = "index")
+        logger.info(f"Benchmark results: \n{table.to_string(float_format = '%.3f')}")
+        return
+
+    with open(baseline) as f:
+        comparison = compare_to_baseline(results, json.load(f), tolerance)
+    logger.info(f"Benchmark results against {baseline}: \n{comparison.to_string(float_format = '%.3f')}")
+    regressed = comparison.index[comparison["regressed"]]
+    if len(regressed):
+        logger.error(f"Slower than the baseline by more than {tolerance:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import contextlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data import clean_dataset
+from src.data import storage
+from src.features import build_features
+
+logger = logging.getLogger(__name__)
+
+# The manifest of an incrementally built dataset lists the part file of each issue month, the raw rows
+# it was built from, and the schema every part is cast to. Its name starts with "_" so that Parquet
+# readers skip it, as they skip the staging directory of raw rows.
+MANIFEST_FILE = "_manifest.json"
+STAGING_DIR = "_staging"
+# Raw rows are grouped by the month they were issued in, each month kept in its own part file. Loans
+# without a status in clean_dataset.DEFAULT_STATUSES or NON_DEFAULT_STATUSES (eg. Current) are dropped
+# by cleaning, and Late (31-120 days) loans may still be paid off, so a month is only complete once
+# every loan issued in it has one of these final statuses: complete months are skipped when reading
+# the raw file, and other months are rewritten whenever their raw rows change.
+FINAL_STATUSES = [x for x in clean_dataset.DEFAULT_STATUSES + clean_dataset.NON_DEFAULT_STATUSES
+                  if not x.startswith("Late")]
+ISSUE_DATE_COLUMN = "issue_d"
+ISSUE_DATE_FORMAT = "%b-%Y"
+STATUS_COLUMN = "loan_status"
+# Month of the rows whose issue date is missing or unreadable.
+UNKNOWN_MONTH = "unknown"
+DEFAULT_CHUNKSIZE = 100000
+
+def manifest_path(output_dir):
+    """
+    Location of the manifest of the incrementally built dataset at output_dir.
+    """
+    return os.path.join(output_dir, MANIFEST_FILE)
+
+def read_manifest(output_dir):
+    """
+    Reads the manifest of an incrementally built dataset.
+
+    Parameters:
+    output_dir (string): Location of the dataset, eg. data/processed/loan.parquet.
+
+    Returns:
+    manifest (dict): The frozen schema ("schema", as in clean_dataset.freeze_schema), the part file and
+                     raw rows of each issue month ("months", see append_dataset), and the index of the
+                     next part file ("next_part"); or None if no dataset has been built there yet.
+
+    Raises:
+    ValueError: If output_dir wasn't built incrementally, or by an older version without months.
+    """
+    path = manifest_path(output_dir)
+    if not os.path.exists(path):
+        if os.path.exists(output_dir):
+            raise ValueError(f"{output_dir} wasn't built incrementally (it has no {MANIFEST_FILE}): "
+                             "remove it to rebuild it from the full raw file")
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if "months" not in manifest:
+        raise ValueError(f"{output_dir} was built without a part file per issue month: remove it to "
+                         "rebuild it from the full raw file")
+    manifest["schema"]["dtypes"] = {col: pd.api.types.pandas_dtype(dtype)
+                                    for col, dtype in manifest["schema"]["dtypes"].items()}
+    return manifest
+
+def write_manifest(output_dir, manifest):
+    """
+    Saves the manifest of an incrementally built dataset. The manifest is replaced in one step, so a
+    run that fails part way leaves the previous manifest in place.
+    """
+    dtypes = {col: str(dtype) for col, dtype in manifest["schema"]["dtypes"].items()}
+    contents = dict(manifest, schema = {"columns": manifest["schema"]["columns"], "dtypes": dtypes})
+    path = manifest_path(output_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(contents, f, indent = 2)
+    os.replace(path + ".tmp", path)
+
+def issue_months(df):
+    """
+    Returns the month each raw row was issued in, as a string such as "2018-12" (UNKNOWN_MONTH if
+    unknown).
+    """
+    months = pd.to_datetime(df[ISSUE_DATE_COLUMN], format = ISSUE_DATE_FORMAT, errors = "coerce")
+    return months.dt.strftime("%Y-%m").fillna(UNKNOWN_MONTH)
+
+def staging_path(staging_dir, month):
+    """
+    Location of the staged raw rows of a month (see stage_months).
+    """
+    return os.path.join(staging_dir, f"{month}.parquet")
+
+def staging_schema(read_options):
+    """
+    Arrow schema of the staged raw rows: the raw text columns as strings, and the others as floats,
+    so that every chunk of a month is staged with the same types, even if a column is empty in one.
+    """
+    import pyarrow as pa
+    return pa.schema([(col, pa.string() if dtype in ("object", "category") else pa.float64())
+                      for col, dtype in read_options["dtype"].items()])
+
+def row_digests(df):
+    """
+    Hashes each raw row. The digest of a month is the sum of the hashes of its rows (modulo 2 ** 64),
+    which doesn't depend on the order of the rows.
+    """
+    return pd.util.hash_pandas_object(df, index = False).to_numpy()
+
+def stage_months(input_file, read_options, chunksize, staging_dir, skip_months):
+    """
+    Reads the raw file in chunks, and stages the rows of each month not in skip_months in a Parquet
+    file of its own, while counting its rows, its rows with a final status, and its digest.
+
+    Parameters:
+    input_file (string): Location of the raw CSV (or Parquet) file.
+    read_options (dict): Options from clean_dataset.raw_read_options.
+    chunksize (int): Number of raw rows to read per chunk.
+    staging_dir (string): Directory to stage the rows of each month in.
+    skip_months (set): Months whose rows are skipped.
+
+    Returns:
+    months (dict): Number of raw rows ("rows_read"), of rows with a final status ("final") and digest
+                   ("digest") of each month staged, by month.
+    n_rows (tuple): Number of rows read, and of rows skipped.
+    """
+    import pyarrow as pa
+    schema = staging_schema(read_options)
+    text_columns = [x.name for x in schema if x.type == pa.string()]
+    months, writers = {}, {}
+    n_rows_in, n_rows_skipped = 0, 0
+    with contextlib.ExitStack() as stack:
+        for chunk in clean_dataset.read_raw(input_file, read_options, chunksize):
+            n_rows_in += len(chunk)
+            keys = issue_months(chunk)
+            new_rows = (~keys.isin(skip_months)).to_numpy()
+            n_rows_skipped += int((~new_rows).sum())
+            chunk, keys = chunk[new_rows], keys[new_rows]
+            chunk = chunk.astype({col: object for col in text_columns})
+            digests = row_digests(chunk)
+            final = chunk[STATUS_COLUMN].isin(FINAL_STATUSES).to_numpy()
+            # Converted once, and split into months by row index, which is much cheaper per month.
+            table = pa.Table.from_pandas(chunk, schema = schema, preserve_index = False)
+            for month, rows in keys.groupby(keys).indices.items():
+                stats = months.setdefault(month, {"rows_read": 0, "final": 0, "digest": 0})
+                stats["rows_read"] += len(rows)
+                stats["final"] += int(final[rows].sum())
+                stats["digest"] = (stats["digest"] + int(digests[rows].sum(dtype = np.uint64))) % 2 ** 64
+                if month not in writers:
+                    writers[month] = stack.enter_context(storage.frame_writer(staging_path(staging_dir, month)))
+                writers[month](table.take(rows))
+    for stats in months.values():
+        stats["digest"] = f"{stats['digest']:016x}"
+    return months, (n_rows_in, n_rows_skipped)
+
+def staged_batches(staging_dir, months, chunksize):
+    """
+    Reads the staged rows of months (see stage_months), in batches of whole staged chunks of about
+    chunksize rows.
+    """
+    batch, n_rows = [], 0
+    for month in months:
+        for chunk in storage.iter_frame(staging_path(staging_dir, month), chunksize):
+            batch.append(chunk)
+            n_rows += len(chunk)
+            if n_rows >= chunksize:
+                yield pd.concat(batch, ignore_index = True)
+                batch, n_rows = [], 0
+    if batch:
+        yield pd.concat(batch, ignore_index = True)
+
+def append_dataset(input_file, output_dir, chunksize = DEFAULT_CHUNKSIZE):
+    """
+    Cleans and adds features to the raw rows that aren't yet in the processed dataset at output_dir,
+    and adds them to it. Each issue month is kept in a part file of its own. A month is complete once
+    every loan issued in it has a final status (see FINAL_STATUSES): the rows of complete months are
+    skipped when reading input_file. The rows of other months are staged by month, and only months
+    that are new, or whose raw rows changed since the last run (eg. as loans are paid off or charged
+    off), are cleaned and written, replacing their previous part file. A refresh costs one read of
+    input_file plus the cleaning of the new and changed months, and a second run on the same file
+    writes nothing. input_file must hold every loan of the months that aren't complete: pass the full,
+    updated raw file, rather than only the latest drop.
+    The first run processes every row, and freezes the schema of the processed data: later parts are
+    cast to it, so that all parts can be read as one dataset. The raw file is read, and the changed
+    months cleaned, in chunks, so memory use is bounded by chunksize.
+
+    Parameters:
+    input_file (string): Location of the raw CSV (or Parquet) file.
+    output_dir (string): Location of the processed dataset, eg. data/processed/loan.parquet: a directory
+                         of part files and a manifest (see MANIFEST_FILE). The format of the part files
+                         is taken from its extension.
+    chunksize (int): Number of raw rows to read per chunk.
+
+    Returns:
+    n_rows (int): Number of rows written.
+
+    Side effects:
+    Writes the part files of the new and changed months to output_dir, removes the part files they
+    replace, and updates its manifest, which records each month's rows and share of final statuses.
+    """
+    manifest = read_manifest(output_dir)
+    if manifest is None:
+        logger.info(f"Building {output_dir} from all of {input_file}")
+        manifest = {"key": ISSUE_DATE_COLUMN, "schema": None, "next_part": 0, "months": {}}
+        os.makedirs(output_dir)
+    complete = {month for month, x in manifest["months"].items() if x["complete"]}
+    logger.info(f"{output_dir} has {len(manifest['months'])} months, {len(complete)} complete: "
+                f"reading the loans of the others from {input_file}")
+    # Part files left by a run that failed before updating the manifest, or before removing the part
+    # files it replaced, would be read as part of the dataset.
+    listed = {x["file"] for x in manifest["months"].values()}
+    for path in storage.part_files(output_dir):
+        if os.path.basename(path) not in listed:
+            storage.remove_frame(path)
+    staging_dir = os.path.join(output_dir, STAGING_DIR)
+    storage.remove_frame(staging_dir)
+    os.makedirs(staging_dir)
+
+    settlement_cols = clean_dataset.settlement_columns()
+    read_options = clean_dataset.raw_read_options(input_file, settlement_cols)
+    staged, (n_rows_in, n_rows_skipped) = stage_months(input_file, read_options, chunksize, staging_dir, complete)
+    changed = sorted(month for month, stats in staged.items()
+                     if {k: manifest["months"].get(month, {}).get(k) for k in stats} != stats)
+
+    # Changed months are cleaned together, in batches of about chunksize rows, and split back into
+    # months by the issue date of their raw rows (cleaning keeps the index of the rows it keeps).
+    schema = manifest["schema"]
+    part_files, n_rows = {}, dict.fromkeys(changed, 0)
+    with contextlib.ExitStack() as stack:
+        writers = {}
+        for chunk in staged_batches(staging_dir, changed, chunksize):
+            chunk = clean_dataset.cast_raw_text(chunk, read_options["dtype"])
+            months = issue_months(chunk)
+            df = build_features.add_features(clean_dataset.clean_dataset(chunk, settlement_cols))
+            if not len(df):
+                continue
+            if schema is None:
+                schema = clean_dataset.freeze_schema(df)
+            df = clean_dataset.apply_schema(df, schema)
+            keys = months.loc[df.index]
+            for month, rows in keys.groupby(keys).indices.items():
+                if month not in writers:
+                    part_files[month] = storage.part_path(output_dir, manifest["next_part"])
+                    manifest["next_part"] += 1
+                    writers[month] = stack.enter_context(storage.frame_writer(part_files[month]))
+                writers[month](df.iloc[rows])
+                n_rows[month] += len(rows)
+
+    replaced = [manifest["months"][month]["file"] for month in changed if month in manifest["months"]]
+    created = time.strftime("%Y-%m-%dT%H:%M:%S")
+    for month in changed:
+        stats = staged[month]
+        file = os.path.basename(part_files[month]) if month in part_files else None
+        manifest["months"][month] = dict(stats, file = file, rows = n_rows[month], 
+                                         complete = stats["final"] == stats["rows_read"],
+                                         source = input_file, created = created)
+    n_rows_out = sum(n_rows.values())
+    storage.remove_frame(staging_dir)
+
+    if schema is None:
+        logger.info(f"No labelled loans in {input_file}: nothing to add to {output_dir}")
+        storage.remove_frame(output_dir)
+        return 0
+    manifest["schema"] = schema
+    write_manifest(output_dir, manifest)
+    for name in replaced:
+        if name:
+            storage.remove_frame(os.path.join(output_dir, name))
+
+    logger.info(f"{n_rows_in} rows read, {n_rows_skipped} of complete months skipped; {len(changed)} of "
+                f"{len(staged)} other months new or changed: {n_rows_out} rows written")
+    open_months = {month: x for month, x in manifest["months"].items() if not x["complete"]}
+    if open_months:
+        share = sum(x["final"] for x in open_months.values()) / sum(x["rows_read"] for x in open_months.values())
+        logger.info(f"{len(open_months)} months not complete ({min(open_months)} to {max(open_months)}): "
+                    f"{share:.1%} of their loans have a final status")
+    return n_rows_out
+
+@click.command()
+@click.argument('input_file', type=click.Path(exists=True))
+@click.argument('output_dir', type=click.Path())
+@click.option('--chunksize', type=click.INT, default=DEFAULT_CHUNKSIZE, help='Number of raw rows to read per chunk.')
+def main(input_file, output_dir, chunksize):
+    """
+    Adds the loans in the raw file at input_file of new months, or of months that changed since the
+    last run, to the processed dataset at output_dir (see append_dataset).
+    """
+    append_dataset(input_file, output_dir, chunksize)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -4,10 +4,62 @@ import logging
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 
+import numpy as np
 import pandas as pd
 
+from src import profiling
+from src.data import data_dictionary
+from src.data import storage
+
 logger = logging.getLogger(__name__)
+
+# Families of count columns. Those that are zero-filled by fix_missing_values hold whole numbers only,
+# so are stored as the smallest integer type that fits. 
+COUNT_COLUMN_PREFIXES = ("num_", "open_", "inq_", "mths_since_", "mo_sin_")
+# Columns converted to integers by fix_dtypes. 
+INTEGER_COLUMNS = ["emp_length", "term_months"]
+# Columns converted to integers are stored as this type, whatever the values of a given chunk. 
+INTEGER_DTYPE = np.int16
+# Other numeric columns are stored as float32, which changes no value of below about 131,000 by more 
+# than this (ie. amounts are kept to the cent), except these amounts, which can be larger. The type of 
+# each column is fixed, rather than chosen from its values, so that every chunk of a file, and every 
+# file, is stored with the same types. 
+FLOAT32_TOLERANCE = 0.005
+FLOAT64_COLUMNS = ["annual_inc", "revol_bal", "tot_coll_amt", "tot_cur_bal", "total_bal_il", "max_bal_bc", 
+                   "total_rev_hi_lim", "avg_cur_bal", "bc_open_to_buy", "delinq_amnt", "tot_hi_cred_lim", 
+                   "total_bal_ex_mort", "total_bc_limit", "total_il_high_credit_limit"]
+
+# Raw columns that cleaning drops without looking at. Together with the joint application, settlement and
+# future columns (see data_dictionary), these are left out when reading the raw file, so they are never parsed. 
+UNUSED_RAW_COLUMNS = ["id", "member_id", "url", "emp_title", "desc", "title", "zip_code", 
+                      "next_pymnt_d", "last_pymnt_d", "last_pymnt_amnt", "last_credit_pull_d", 
+                      "mths_since_rcnt_il"]
+# Types of the raw text columns; all other raw columns are read as float64. 
+RAW_TEXT_DTYPES = {"term": "object", "emp_length": "object", "issue_d": "object", "earliest_cr_line": "object",
+                   "grade": "category", "sub_grade": "category", "home_ownership": "category", 
+                   "verification_status": "category", "loan_status": "category", "pymnt_plan": "category", 
+                   "purpose": "category", "addr_state": "category", "initial_list_status": "category",
+                   "application_type": "category", "disbursement_method": "category"}
+CSV_ENGINES = ["c", "pyarrow"]
+# Loan statuses labelled by add_target_variable, as a default or not; loans with any other status (eg. 
+# Current) have no outcome yet, and are dropped. 
+DEFAULT_STATUSES = ["Charged Off", "Default", "Does not meet the credit policy. Status:Charged Off", 
+                    "Late (31-120 days)"]
+NON_DEFAULT_STATUSES = ["Fully Paid", "Does not meet the credit policy. Status:Fully Paid"]
+# Columns of months since an event, which are missing if the event never happened: fix_missing_values
+# replaces each with a flag of whether it happened. 
+HAS_EVENT_COLUMNS = {"mths_since_last_record": "has_public_record", "mths_since_recent_bc_dlq": "has_recent_bc_dlq",
+                     "mths_since_last_major_derog": "has_major_derog", 
+                     "mths_since_recent_revol_delinq": "has_recent_revol_delinq",
+                     "mths_since_last_delinq": "has_recent_delinq"}
+
+def memory_usage_mb(df):
+    """
+    Returns the memory used by a dataframe, including the contents of string columns, in MB. 
+    """
+    return df.memory_usage(deep = True).sum() / 1024 ** 2
     
+@profiling.profiled
 def add_target_variable(df):
     """
     Adds the target variable (1 if loan is defaulted, 0 if not), and removes the loan_status column.
@@ -18,13 +70,11 @@ def add_target_variable(df):
     Returns:
     df (pandas.DataFrame): The input dataframe with an added "target" column and with "loan_status" dropped.
     """
-    default_client_values = ["Charged Off", "Default", "Does not meet the credit policy. Status:Charged Off", 
-                             "Late (31-120 days)"]
-    non_default_client_values = ["Fully Paid", "Does not meet the credit policy. Status:Fully Paid"]
-    target_values = default_client_values + non_default_client_values
-    df["target"] = df["loan_status"].isin(default_client_values)
+    target_values = DEFAULT_STATUSES + NON_DEFAULT_STATUSES
+    df["target"] = df["loan_status"].isin(DEFAULT_STATUSES)
     return df[df["loan_status"].isin(target_values)].drop(columns=["loan_status"])
 
+@profiling.profiled
 def fix_dtypes(df):
     """
     Converts columns to their appropriate types (booleans, dates, categories). 
@@ -61,64 +111,106 @@ def fix_dtypes(df):
     df["emp_length"] = df["emp_length"].str[:2].astype(int)
 
     # Drop uninformative columns
-    df.drop(columns = ["emp_title", "desc", "title", "zip_code"], inplace = True)
+    df.drop(columns = ["emp_title", "desc", "title", "zip_code"], inplace = True, errors = 'ignore')
+
+    df = downcast_dtypes(df)
 
     return df
 
-def fix_missing_values(df):
+def check_dtypes(df, dtypes):
     """
-    Deals with missing values in columns.
+    Checks that the values of each column fit the type it is to be stored as: whole numbers within 
+    the range of integer types, and floats within FLOAT32_TOLERANCE of their float32 value. 
 
     Parameters:
-    df (pandas.DataFrame): The input dataframe.
+    df (pandas.DataFrame): Dataframe of values. 
+    dtypes (dict): Type to store each column as. 
 
-    Returns:
-    df (pandas.DataFrame): The input dataframe with missing value columns either removed or cleaned. 
+    Raises:
+    ValueError: If a column's values don't fit its type. 
+    """
+    if not len(df):
+        return
+    # The columns of each type are checked as one 2-D block, rather than one at a time. 
+    blocks = {}
+    for col, dtype in dtypes.items():
+        if not pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]):
+            continue
+        if pd.api.types.is_integer_dtype(dtype) or dtype == np.float32:
+            blocks.setdefault(np.dtype(dtype), []).append(col)
+    for dtype, cols in blocks.items():
+        values = df[cols].to_numpy(dtype = np.float64)
+        if dtype == np.float32:
+            # Missing values compare as False, so pass. 
+            bad = np.abs(values.astype(np.float32) - values) > FLOAT32_TOLERANCE
+        else:
+            info = np.iinfo(dtype)
+            bad = (values % 1 != 0) | (values < info.min) | (values > info.max)
+        if bad.any():
+            col = cols[bad.any(axis = 0).argmax()]
+            if dtype == np.float32:
+                raise ValueError(f"Values of {col} would change by more than {FLOAT32_TOLERANCE} as float32: "
+                                 "add it to FLOAT64_COLUMNS")
+            raise ValueError(f"Values of {col} aren't whole numbers that fit in {dtype}")
+
+def downcast_dtypes(df):
     """
-    logger.info(f"Columns with missing values before cleaning: {len(df.columns[df.isna().any()])}")
+    Converts numeric columns to smaller types, by a fixed rule per column: whole-number columns 
+    (zero-filled counts, and INTEGER_COLUMNS) to INTEGER_DTYPE, and other numeric columns but the
+    FLOAT64_COLUMNS to float32. 
 
-    # These columns have all values missing, so we just drop them. 
-    all_values_missing = ["id", "member_id", "url"]
-    df.drop(columns = all_values_missing, inplace = True)
+    Parameters:
+    df (pandas.DataFrame): Dataframe of values, after fix_missing_values. 
 
-    # If employment length is not known, fill with zero. 
-    df["emp_length"] = df["emp_length"].fillna("0 years")
+    Returns:
+    df (pandas.DataFrame): The input dataframe with downcast numeric columns. 
 
-    # Use the data dictionary to drop hardship and settlement fields.
-    # These columns a) have missing values, b) don't have values set until after the loan is issued. 
-    df_data_dictionary = pd.read_excel("references/LCDataDictionary.xlsx").dropna()
-    is_settlement_or_hardship = df_data_dictionary["Description"].str.contains("settle|hardship",
-                                                                               regex=True, case=False)
-    settlement_cols = df_data_dictionary[is_settlement_or_hardship].LoanStatNew.values
-    try:
-        df.drop(columns = settlement_cols, inplace = True)
-    except ValueError:
-        df.drop(columns = settlement_cols, inplace = True, errors = 'ignore')
+    Raises:
+    ValueError: If a column's values don't fit its type (see check_dtypes). 
+    """
+    zero_filled = set(zero_fill_columns(df.columns))
+    integer_cols = INTEGER_COLUMNS + [x for x in df.columns 
+                                      if x.startswith(COUNT_COLUMN_PREFIXES) and x in zero_filled]
+    mem_before = memory_usage_mb(df)
+    dtypes = {}
+    for col in df.columns:
+        if pd.api.types.is_bool_dtype(df[col]) or not pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        if col in integer_cols:
+            dtypes[col] = INTEGER_DTYPE
+        elif col not in FLOAT64_COLUMNS:
+            dtypes[col] = np.float32
+    check_dtypes(df, dtypes)
+    df = df.astype(dtypes)
+    logger.info(f"Downcast {len(dtypes)} numeric columns: {mem_before:.1f} MB -> {memory_usage_mb(df):.1f} MB")
+    return df
 
-    # Drop all columns and rows relating to joint applications. 
-    joint_columns = [x for x in df.columns if ('joint' in x or 'sec_app' in x)]
-    df.drop(columns = joint_columns, inplace = True)
-    df.drop(df[df["application_type"] != "Individual"].index, inplace = True)
+def settlement_columns():
+    """
+    Returns the names of the hardship and settlement columns (see data_dictionary.column_groups). 
+    """
+    return sorted(data_dictionary.column_groups()["settlement"])
 
-    # Now we work through the remaining columns. 
-    columns_remaining = df.columns[df.isna().any()]
+def zero_fill_columns(columns):
+    """
+    Lists the columns whose missing values are set to zero by fix_missing_values. 
+    Filling a column with no missing values is a no-op, so these are selected by name rather than by
+    df.isna().any(): this way every chunk of a streamed file is cleaned the same way. 
 
-    cols_to_drop = []
-    cols_to_set_zero = []
+    Parameters:
+    columns (list): The columns of the dataframe being cleaned. 
 
-    cols_to_drop += ["next_pymnt_d", "last_pymnt_d", "last_pymnt_amnt",
-                "last_credit_pull_d"]
+    Returns:
+    cols_to_set_zero (list): The columns to fill with zero. 
+    """
+    cols_to_set_zero = []
 
-    num_cols = [x for x in columns_remaining if x.startswith("num_")]
+    num_cols = [x for x in columns if x.startswith("num_")]
     cols_to_set_zero += num_cols
 
-
-    util_cols = [x for x in columns_remaining if "_util" in x]
+    util_cols = [x for x in columns if "_util" in x]
     cols_to_set_zero += util_cols
 
-    # Drop date columns as uninformative. 
-    date_cols = [x for x in columns_remaining if "_d" in x]
-
     flag_cols = ["max_bal_bc", "open_acc_6m", "open_act_il", "open_il_12m", 
                  "open_il_24m", "total_bal_il", "open_rv_24m", "open_rv_12m", 
                  "inq_last_12m", "inq_fi", "total_cu_tl"]
@@ -131,29 +223,66 @@ def fix_missing_values(df):
                      "pub_rec_bankruptcies", "collections_12_mths_ex_med", "chargeoff_within_12_mths"]
     cols_to_set_zero += low_freq_cols
 
-    cols_to_drop += ["mths_since_rcnt_il", "mths_since_last_record",
-                     "mths_since_recent_bc_dlq", "mths_since_last_major_derog",
-                     "mths_since_recent_revol_delinq", "mths_since_last_delinq"]
-
-    # If value is missing here, we assume the event has never happened, so set a boolean flag. 
-    df["has_public_record"] = ~df["mths_since_last_record"].isna()
-    df["has_recent_bc_dlq"] = ~df["mths_since_recent_bc_dlq"].isna()
-    df["has_major_derog"] = ~df["mths_since_last_major_derog"].isna()
-    df["has_recent_revol_delinq"] = ~df["mths_since_recent_revol_delinq"].isna()
-    df["has_recent_delinq"] = ~df["mths_since_last_delinq"].isna()
-
     cols_to_set_zero += ["mo_sin_rcnt_rev_tl_op", "mo_sin_rcnt_tl", 
                          "mths_since_recent_inq", "mo_sin_old_rev_tl_op",
                          "mo_sin_old_il_acct",  "mths_since_recent_bc"]
-    
-    df[cols_to_set_zero] = df[cols_to_set_zero].fillna(0)
+    return cols_to_set_zero
+
+@profiling.profiled
+def fix_missing_values(df, settlement_cols = None):
+    """
+    Deals with missing values in columns.
+    The columns and rows to drop are collected first and dropped in one go, so that the dataframe is 
+    copied once rather than once per drop. 
+
+    Parameters:
+    df (pandas.DataFrame): The input dataframe.
+    settlement_cols (list): Hardship and settlement columns to drop. If None, these are read from the 
+                            data dictionary. 
+
+    Returns:
+    df (pandas.DataFrame): The input dataframe with missing value columns either removed or cleaned. 
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Columns with missing values before cleaning: {df.isna().any().sum()}")
+
+    # These columns have all values missing, so we just drop them. 
+    # (They may already have been left out when reading the file, see raw_read_options.)
+    cols_to_drop = ["id", "member_id", "url"]
+
+    # Use the data dictionary to drop hardship and settlement fields.
+    # These columns a) have missing values, b) don't have values set until after the loan is issued. 
+    if settlement_cols is None:
+        settlement_cols = settlement_columns()
+    cols_to_drop += settlement_cols
+
+    # Drop all columns and rows relating to joint applications. 
+    cols_to_drop += [x for x in df.columns if ('joint' in x or 'sec_app' in x)]
+    individual = (df["application_type"] == "Individual").to_numpy()
+
+    # Now we work through the remaining columns. 
+    cols_to_drop += ["next_pymnt_d", "last_pymnt_d", "last_pymnt_amnt", "last_credit_pull_d"]
+    cols_to_drop += ["mths_since_rcnt_il"] + list(HAS_EVENT_COLUMNS)
 
-    df.drop(columns = cols_to_drop, inplace = True)
+    # If value is missing here, we assume the event has never happened, so set a boolean flag. 
+    has_event = df[list(HAS_EVENT_COLUMNS)].notna().to_numpy()[individual]
 
-    logger.info(f"Columns with missing values after cleaning: {len(df.columns[df.isna().any()])}")
+    cols_to_drop = set(cols_to_drop)
+    df = df.loc[individual, [x for x in df.columns if x not in cols_to_drop]]
+
+    # If employment length is not known, fill with zero. 
+    df["emp_length"] = df["emp_length"].fillna("0 years")
+    for i, flag in enumerate(HAS_EVENT_COLUMNS.values()):
+        df[flag] = has_event[:, i]
+
+    df.fillna(dict.fromkeys(zero_fill_columns(df.columns), 0), inplace = True)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Columns with missing values after cleaning: {df.isna().any().sum()}")
     
     return df
 
+@profiling.profiled
 def remove_future_columns(df):
     """
     Removes columns that relate to future events, ie. columns whose values are only set
@@ -165,14 +294,12 @@ def remove_future_columns(df):
     Returns:
     df (pandas.DataFrame): The input dataframe with future columns dropped. 
     """
-    cols = ["collection_recovery_fee", "funded_amnt", "funded_amnt_inv", "out_prncp", "out_prncp_inv",
-            "recoveries", "total_pymnt", "total_pymnt_inv", "total_rec_int", "total_rec_late_fee",
-            "total_rec_prncp"]
-    logger.info(f"Removing {len(cols)} columns")
-    df.drop(columns = cols, inplace = True)
+    future_cols = sorted(data_dictionary.column_groups()["future"])
+    logger.info(f"Removing {len(future_cols)} columns")
+    df.drop(columns = future_cols, inplace = True, errors = 'ignore')
     return df
 
-def clean_dataset(df):
+def clean_dataset(df, settlement_cols = None):
     """
     Cleans the dataset by:
     1. Adding the target variable
@@ -181,32 +308,171 @@ def clean_dataset(df):
 
     Parameters:
     df (pandas.DataFrame): The input dataframe
+    settlement_cols (list): Hardship and settlement columns to drop. If None, these are read from the 
+                            data dictionary. 
     
     Returns:
     df (pandas.DataFrame): The cleaned input dataframe. 
     """
+    logger.info(f"Dataframe memory before cleaning: {memory_usage_mb(df):.1f} MB")
+
     # Add target variable
     logger.info("Adding target column")
     df = add_target_variable(df)
     logger.info(f"Target variable counts: \n{df.target.value_counts()}")
-    logger.info(f"Dataframe shape after adding target column: {df.shape}")
+    logger.info(f"Dataframe shape after adding target column: {df.shape}, {memory_usage_mb(df):.1f} MB")
     
     # Missing values
     logger.info("Fixing missing values")
-    df = fix_missing_values(df)
-    logger.info(f"Dataframe shape after fixing missing values: {df.shape}")
+    df = fix_missing_values(df, settlement_cols)
+    logger.info(f"Dataframe shape after fixing missing values: {df.shape}, {memory_usage_mb(df):.1f} MB")
 
     # Remove columns that we won't know about when the loan is issued
     df = remove_future_columns(df)
-    logger.info(f"Dataframe shape after removing future columns: {df.shape}")    
+    logger.info(f"Dataframe shape after removing future columns: {df.shape}, {memory_usage_mb(df):.1f} MB")    
     # Fix dtypes
     logger.info("Fixing dtypes")
     df = fix_dtypes(df)
-    logger.info(f"Dataframe shape after fixing dtypes: {df.shape}")
+    logger.info(f"Dataframe shape after fixing dtypes: {df.shape}, {memory_usage_mb(df):.1f} MB")
     
     return df
 
-def clean_dataset_main(input_file, output_file):
+def freeze_schema(df):
+    """
+    Records the column order and dtypes of a cleaned dataframe, so that later chunks of the same
+    file can be made to match it. 
+    int64 columns (as inferred by read_csv) are recorded as floats: a column with no missing values in 
+    one chunk may have missing values in the next. The types set by downcast_dtypes are kept: they are 
+    fixed per column, so don't depend on the values of the first chunk. 
+    Categorical columns are recorded without their categories, which later chunks may add to. 
+
+    Parameters:
+    df (pandas.DataFrame): A cleaned dataframe (usually the first chunk). 
+
+    Returns:
+    schema (dict): The column order ("columns") and dtype per column ("dtypes"). 
+    """
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if dtype == np.int64:
+            dtype = np.dtype(np.float64)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            dtype = pd.CategoricalDtype()
+        dtypes[col] = dtype
+    return {"columns": list(df.columns), "dtypes": dtypes}
+
+def apply_schema(df, schema):
+    """
+    Reorders and casts the columns of a cleaned dataframe to match a frozen schema. Values must fit the
+    frozen types, as when downcast_dtypes casts them (see check_dtypes). 
+
+    Parameters:
+    df (pandas.DataFrame): A cleaned dataframe. 
+    schema (dict): Schema as returned by freeze_schema. 
+
+    Returns:
+    df (pandas.DataFrame): The input dataframe with the schema's columns and dtypes. 
+
+    Raises:
+    ValueError: If a column's values don't fit its frozen type. 
+    """
+    df = df.reindex(columns = schema["columns"])
+    check_dtypes(df, schema["dtypes"])
+    return df.astype(schema["dtypes"])
+
+def raw_read_options(input_file, settlement_cols, engine = "c"):
+    """
+    Works out the read_csv options for the raw file: only the columns cleaning uses are read, with
+    declared types, so that the columns we throw away are never parsed. 
+
+    Parameters:
+    input_file (string): The location of the input (raw) dataframe. 
+    settlement_cols (list): Hardship and settlement columns, which are dropped. 
+    engine (string): The read_csv engine: "c", or "pyarrow" for multithreaded parsing. 
+
+    Returns:
+    options (dict): Keyword arguments for pandas.read_csv (see also read_raw). 
+    """
+    header = storage.frame_columns(input_file)
+    groups = data_dictionary.column_groups()
+    unused = set(UNUSED_RAW_COLUMNS) | set(settlement_cols) | groups["joint"] | groups["future"]
+    usecols = [x for x in header if x not in unused and not ('joint' in x or 'sec_app' in x)]
+    dtype = {x: RAW_TEXT_DTYPES.get(x, "float64") for x in usecols}
+    logger.info(f"Reading {len(usecols)} of {len(header)} raw columns")
+    options = {"usecols": usecols, "dtype": dtype, "engine": engine}
+    if engine == "c":
+        options["low_memory"] = False
+    return options
+
+def cast_raw_text(df, dtype):
+    """
+    Applies the declared raw column types to a dataframe read from a text-only sample (see sample_dataset).
+    Missing values are read from Parquet as pd.NA: they are made NaN, as read_csv does. 
+    """
+    df = df.astype(object)
+    return df.where(df.notna(), np.nan).astype(dtype)
+
+@profiling.profiled
+def read_raw(input_file, read_options, chunksize = None):
+    """
+    Reads the raw data with the options from raw_read_options. 
+    The raw data is usually the Lending Club CSV file, but may also be a Parquet sample written by 
+    sample_dataset, which holds the text of each raw field: the declared types are applied after reading. 
+
+    Parameters:
+    input_file (string): The location of the input (raw) dataframe. 
+    read_options (dict): Options from raw_read_options. 
+    chunksize (int): If set, read the input in chunks of this many rows. 
+
+    Returns:
+    df (pandas.DataFrame): The raw dataframe, or if chunksize is set, a generator of chunks of it. 
+    """
+    if storage.frame_format(input_file) == "parquet":
+        if chunksize:
+            return (cast_raw_text(chunk, read_options["dtype"]) 
+                    for chunk in storage.iter_frame(input_file, chunksize, read_options["usecols"]))
+        return cast_raw_text(storage.read_frame(input_file, columns = read_options["usecols"]), read_options["dtype"])
+
+    if chunksize:
+        return pd.read_csv(input_file, chunksize = chunksize, **read_options)
+    df = pd.read_csv(input_file, **read_options)
+    if read_options["engine"] == "pyarrow":
+        # The pyarrow engine reads empty text fields as "" rather than as missing values. 
+        text_cols = df.select_dtypes(["object", "category"]).columns
+        df[text_cols] = df[text_cols].replace("", np.nan)
+    return df
+
+def clean_dataset_chunked(input_file, output_file, chunksize):
+    """
+    Cleans the dataset chunk by chunk, appending each cleaned chunk to output_file, so that memory 
+    use is bounded by chunksize rather than by the size of the input. 
+    Decisions that would otherwise depend on the whole dataset are made once: the settlement columns
+    are read once, and every chunk is cast to the schema of the first cleaned chunk. 
+
+    Parameters:
+    input_file (string): The location of the input (raw) dataframe. 
+    output_file (string): The location to save the intermediate cleaned dataframe. 
+    chunksize (int): Number of rows to read per chunk. 
+
+    Side effects:
+    Saves cleaned dataframe at output_file location, in the format given by its extension. 
+    """
+    settlement_cols = settlement_columns()
+    read_options = raw_read_options(input_file, settlement_cols)
+    schema = None
+    n_rows_in, n_rows_out = 0, 0
+    with storage.frame_writer(output_file) as write:
+        for i, chunk in enumerate(read_raw(input_file, read_options, chunksize)):
+            n_rows_in += len(chunk)
+            chunk = clean_dataset(chunk, settlement_cols)
+            if schema is None:
+                schema = freeze_schema(chunk)
+            chunk = apply_schema(chunk, schema)
+            n_rows_out += len(chunk)
+            logger.info(f"Chunk {i}: {n_rows_in} rows read, {n_rows_out} rows written")
+            write(chunk)
+
+def clean_dataset_main(input_file, output_file, chunksize = None, engine = "c"):
     """ 
     Runs data processing scripts to prepare and clean dataset.
     Placing this separately to the main function allows us to call the main function from the command
@@ -215,22 +481,37 @@ def clean_dataset_main(input_file, output_file):
     Parameters:
     input_file (string): The location of the input (raw) dataframe. 
     output_file (string): The location to save the intermediate cleaned dataframe. 
+    chunksize (int): If set, stream the input in chunks of this many rows (see clean_dataset_chunked). 
+    engine (string): The read_csv engine: "c", or "pyarrow" for multithreaded parsing. The pyarrow 
+                     engine can't stream, so can't be used with chunksize. 
 
     Side effects:
-    Saves cleaned dataframe to CSV at output_file location. 
+    Saves cleaned dataframe at output_file location, in the format given by its extension 
+    (see src.data.storage). 
     """
     logger.info('Preparing and cleaning dataset')
-    df = pd.read_csv(input_file, low_memory = False)
+    if chunksize:
+        if engine != "c":
+            raise ValueError(f"The {engine} CSV engine can't read in chunks: use the c engine with chunksize")
+        logger.info(f"Streaming input in chunks of {chunksize} rows")
+        clean_dataset_chunked(input_file, output_file, chunksize)
+        return
+    settlement_cols = settlement_columns()
+    df = read_raw(input_file, raw_read_options(input_file, settlement_cols, engine))
     logger.info(f"Input dataframe shape: {df.shape}")
-    df = clean_dataset(df)
+    df = clean_dataset(df, settlement_cols)
     logger.info(f"Saving cleaned dataframe to {output_file}")
-    df.to_csv(output_file, index = False)
+    storage.write_frame(df, output_file)
     
 @click.command()
 @click.argument('input_file', type=click.Path(exists=True))
 @click.argument('output_file', type=click.Path())
-def main(input_file, output_file):
-    clean_dataset_main(input_file, output_file)
+@click.option('--chunksize', type=click.INT, default=None, 
+              help='Stream the input in chunks of this many rows to bound memory use.')
+@click.option('--engine', type=click.Choice(CSV_ENGINES), default='c', 
+              help='CSV parser for the raw file; pyarrow parses with multiple threads.')
+def main(input_file, output_file, chunksize, engine):
+    clean_dataset_main(input_file, output_file, chunksize, engine)
     
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import functools
+import json
+import logging
+import os
+
+import pandas as pd
+
+from src import profiling
+
+logger = logging.getLogger(__name__)
+
+DATA_DICTIONARY = "references/LCDataDictionary.xlsx"
+# Bump this whenever the contents of the cached column groups change.
+CACHE_VERSION = 1
+
+# Columns whose values are only set after the loan is issued. The data dictionary doesn't say which
+# these are, so they are listed by hand.
+FUTURE_COLUMNS = ["collection_recovery_fee", "funded_amnt", "funded_amnt_inv", "out_prncp", "out_prncp_inv",
+                  "recoveries", "total_pymnt", "total_pymnt_inv", "total_rec_int", "total_rec_late_fee",
+                  "total_rec_prncp"]
+
+def cache_path(path):
+    """
+    Location of the parsed copy of the data dictionary at path.
+    """
+    return os.path.splitext(path)[0] + ".json"
+
+@profiling.profiled
+def parse_data_dictionary(path):
+    """
+    Parses the data dictionary workbook into groups of column names.
+
+    Parameters:
+    path (string): Location of the data dictionary workbook.
+
+    Returns:
+    groups (dict): Lists of column names, keyed by group:
+                   "settlement": columns whose description mentions settlements or hardship,
+                   "joint": columns relating to joint applications,
+                   "future": columns only set after the loan is issued.
+    """
+    logger.info(f"Parsing data dictionary {path}")
+    df_data_dictionary = pd.read_excel(path).dropna()
+    is_settlement_or_hardship = df_data_dictionary["Description"].str.contains("settle|hardship",
+                                                                               regex=True, case=False)
+    names = df_data_dictionary["LoanStatNew"]
+    return {"settlement": list(names[is_settlement_or_hardship]),
+            "joint": [x for x in names if ('joint' in x or 'sec_app' in x)],
+            "future": FUTURE_COLUMNS}
+
+@functools.lru_cache(maxsize = None)
+def column_groups(path = DATA_DICTIONARY):
+    """
+    Loads the column groups of the data dictionary (see parse_data_dictionary).
+    The workbook is slow to parse, so the groups are cached in a JSON file next to it, which is
+    reparsed only when the workbook's size or modification time changes, and in memory for the life
+    of the process.
+
+    Parameters:
+    path (string): Location of the data dictionary workbook.
+
+    Returns:
+    groups (dict): Frozensets of column names, keyed by group, for constant time lookups.
+    """
+    stat = os.stat(path)
+    source = {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    cached = cache_path(path)
+    groups = None
+    if os.path.exists(cached):
+        with open(cached) as f:
+            contents = json.load(f)
+        if contents.get("source") == source:
+            groups = contents["groups"]
+
+    if groups is None:
+        groups = parse_data_dictionary(path)
+        try:
+            with open(cached, 'w') as f:
+                json.dump({"source": source, "groups": groups}, f)
+        except OSError as e:
+            logger.warning(f"Couldn't cache parsed data dictionary at {cached}: {e}")
+
+    return {group: frozenset(cols) for group, cols in groups.items()}
@@ -4,42 +4,165 @@ import logging
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 import os
+from src import profiling
+from src.data import append_dataset
 from src.data import clean_dataset
+from src.data import data_dictionary
+from src.data import partition_dataset
+from src.data import sample_dataset
+from src.data import stage_cache
+from src.data import storage
+from src.data import validate_dataset
 from src.features import build_features
-import subprocess
+from src.features import feature_store
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
 @click.argument('n_samples', type=click.INT)
-def main(input_filepath, output_filepath, n_samples):
+@click.option('--chunksize', type=click.INT, default=None, 
+              help='Clean the raw data in chunks of this many rows to bound memory use.')
+@click.option('--engine', type=click.Choice(clean_dataset.CSV_ENGINES), default='c', 
+              help='CSV parser for the raw file; pyarrow parses with multiple threads (not with --chunksize).')
+@click.option('--workers', type=click.INT, default=1, 
+              help='Clean and add features to row partitions of the raw data in this many processes.')
+@click.option('--format', 'fmt', type=click.Choice(sorted(set(storage.FORMATS.values()))), 
+              default=storage.DEFAULT_FORMAT, help='Format of the interim and processed files.')
+@click.option('--seed', type=click.INT, default=10, help='Random seed for sampling.')
+@click.option('--sample-method', type=click.Choice(sample_dataset.SAMPLE_METHODS), default='reservoir',
+              help='reservoir: uniform random sample; hash: deterministic sample by hashing each loan.')
+@click.option('--sample-fraction', type=click.FLOAT, default=None, 
+              help='Sample this fraction of the rows (eg. 0.01) instead of n_samples rows.')
+@click.option('--stratify', default=None, help='Column to stratify the sample by, eg. loan_status.')
+@click.option('--append', is_flag=True, 
+              help='Only process loans of new issue months, or of months that changed since the last --append run.')
+@click.option('--feature-store', 'store', is_flag=True, 
+              help='Also save the processed dataset as a memory-mapped feature store for train_model.')
+@click.option('--validate/--no-validate', default=True, 
+              help='Check a sample of the raw data against references/raw_schema.json before cleaning it.')
+@click.option('--cache/--no-cache', default=True, 
+              help='Skip stages whose input, code and parameters are unchanged since a previous run.')
+@click.option('--cache-max-gb', type=click.FLOAT, default=stage_cache.DEFAULT_MAX_BYTES / 1024 ** 3,
+              help='Maximum size of the stage cache.')
+@click.option('--cache-max-age-days', type=click.FLOAT, default=stage_cache.DEFAULT_MAX_AGE_DAYS,
+              help='Evict stage cache entries unused for this long.')
+@click.option('--profile', is_flag=True, 
+              help='Record the time and memory of each step, and write a report to reports/profiles.')
+@click.option('--profile-stage', default=None, 
+              help='With --profile, also run this step (eg. fix_dtypes) under a profiler.')
+@click.option('--profiler', type=click.Choice(profiling.PROFILERS), default='cprofile', 
+              help='Profiler for --profile-stage.')
+def main(input_filepath, output_filepath, n_samples, chunksize, engine, workers, fmt, seed, sample_method, 
+         sample_fraction, stratify, append, store, validate, cache, cache_max_gb, cache_max_age_days, profile, profile_stage, 
+         profiler):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
+        Each stage's output is cached in ../interim/cache, keyed by its input, code and parameters. 
+        With more than one worker, cleaning and adding features are done together on row partitions
+        in parallel, and the processed dataset is a directory of part files. 
+        With --append, only loans of new issue months, or of months whose loans changed since the last
+        run, are cleaned and written to the processed dataset, one part file per month (see append_dataset). 
+        Unless --no-validate is given, a sample of the raw data is first checked for the columns, types
+        and formats cleaning expects (see validate_dataset), so a bad file fails in seconds. 
+        With --feature-store, the processed dataset is also saved as a feature store (see feature_store),
+        eg. data/processed/loan.features, which train_model and evaluate_model memory-map. 
+        With --profile, the time and memory of each stage and step are written to reports/profiles.
     """
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
+    cache_dir = os.path.join(os.path.dirname(input_filepath), 'interim', 'cache')
+    if profile:
+        profiling.enable(profile_stage = profile_stage, profiler = profiler)
 
-    sample_data = (n_samples > 0)
+    def run_stage(stage_name, run, input_path, output_path, code_files, params):
+        with profiling.stage(stage_name):
+            if not cache:
+                run()
+                return
+            stage_cache.cached_stage(stage_name, run, input_path, output_path, code_files, params,
+                                     cache_dir = cache_dir, max_bytes = cache_max_gb * 1024 ** 3, 
+                                     max_age_days = cache_max_age_days)
+
+    def validate_raw(raw_in):
+        if not validate:
+            return
+        logger.info(f'Validating: {raw_in}')
+        with profiling.stage('validate'):
+            try:
+                validate_dataset.check_raw(raw_in)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+
+    sample_data = (n_samples > 0 or sample_fraction is not None)
+
+    if append:
+        if sample_data:
+            raise click.UsageError("--append processes every new loan: set n_samples to 0, without --sample-fraction")
+        append_in = os.path.join(input_filepath, 'loan.csv')
+        append_out = os.path.join(os.path.dirname(input_filepath), 'processed', f'loan.{fmt}')
+        validate_raw(append_in)
+        logger.info(f'Appending new loans: {append_in} -> {append_out}')
+        with profiling.stage('append'):
+            append_dataset.append_dataset(append_in, append_out, chunksize or append_dataset.DEFAULT_CHUNKSIZE)
+        if store:
+            # The whole store is rewritten: its rows are in the order of the part files. 
+            store_out = feature_store.feature_store_path(append_out)
+            logger.info(f'Feature store: {append_out} -> {store_out}')
+            with profiling.stage('feature_store'):
+                feature_store.build_feature_store(append_out, store_out)
+        profiling.write_report('make_dataset')
+        return
 
     fname = 'loan'
+    clean_in = os.path.join(input_filepath, f'{fname}.csv')
+    validate_raw(clean_in)
     if sample_data:
         logger.info('Sampling data')
-        fname = f'loan_sampled_{n_samples}'
-        sample_in = os.path.join(input_filepath, "loan.csv")
-        sample_out = os.path.join(os.path.dirname(input_filepath), 'interim', f'{fname}.csv')
+        n_samples = None if sample_fraction is not None else n_samples
+        fname = f'loan_sampled_{n_samples or sample_fraction}'
+        sample_in = clean_in
+        sample_out = os.path.join(os.path.dirname(input_filepath), 'interim', f'{fname}.{fmt}')
         logger.info(f'Sampling: {sample_in} -> {sample_out}')
-        subprocess.call(['src/data/sample_dataset.sh', str(n_samples), sample_in, sample_out])
+        run_stage('sample', 
+                  lambda: sample_dataset.sample_dataset(sample_in, sample_out, n_samples, sample_fraction, 
+                                                        sample_method, seed, stratify),
+                  sample_in, sample_out, [sample_dataset.__file__, storage.__file__], 
+                  {'n_samples': n_samples, 'fraction': sample_fraction, 'method': sample_method, 
+                   'seed': seed, 'stratify': stratify})
         input_filepath = os.path.dirname(sample_out)
+        clean_in = sample_out
 
-    clean_in = os.path.join(input_filepath, f'{fname}.csv')
-    clean_out = os.path.join(os.path.dirname(input_filepath), 'interim', f'{fname}-cleaned.csv')
-    logger.info(f'Cleaning: {clean_in} -> {clean_out}')
-    clean_dataset.clean_dataset_main(clean_in, clean_out)
-
-    features_in = clean_out
-    features_out = os.path.join(os.path.dirname(input_filepath), 'processed', f'{fname}.csv')
-    logger.info(f'Features: {features_in} -> {features_out}')
-    build_features.build_features_main(features_in, features_out)
+    clean_code_files = [clean_dataset.__file__, data_dictionary.__file__, storage.__file__, 
+                        data_dictionary.DATA_DICTIONARY]
+    if workers > 1:
+        features_out = os.path.join(os.path.dirname(input_filepath), 'processed', f'{fname}.{fmt}')
+        logger.info(f'Cleaning and features with {workers} workers: {clean_in} -> {features_out}')
+        try:
+            run_stage('clean_features', 
+                      lambda: partition_dataset.make_dataset_parallel(clean_in, features_out, workers),
+                      clean_in, features_out, 
+                      clean_code_files + [build_features.__file__, partition_dataset.__file__], {'workers': workers})
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    else:
+        clean_out = os.path.join(os.path.dirname(input_filepath), 'interim', f'{fname}-cleaned.{fmt}')
+        logger.info(f'Cleaning: {clean_in} -> {clean_out}')
+        run_stage('clean', lambda: clean_dataset.clean_dataset_main(clean_in, clean_out, chunksize, engine),
+                  clean_in, clean_out, clean_code_files, {'chunksize': chunksize, 'engine': engine})
+
+        features_in = clean_out
+        features_out = os.path.join(os.path.dirname(input_filepath), 'processed', f'{fname}.{fmt}')
+        logger.info(f'Features: {features_in} -> {features_out}')
+        run_stage('features', lambda: build_features.build_features_main(features_in, features_out),
+                  features_in, features_out, [build_features.__file__, storage.__file__], {})
+
+    if store:
+        store_out = feature_store.feature_store_path(features_out)
+        logger.info(f'Feature store: {features_out} -> {store_out}')
+        run_stage('feature_store', lambda: feature_store.build_feature_store(features_out, store_out),
+                  features_out, store_out, [feature_store.__file__, build_features.__file__, storage.__file__], {})
+
+    profiling.write_report('make_dataset')
     return
 
 if __name__ == '__main__':
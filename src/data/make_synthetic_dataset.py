@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.data import clean_dataset
+from src.data import data_dictionary
+from src.data import storage
+
+logger = logging.getLogger(__name__)
+
+# Columns of the Lending Club loan.csv file (2007-2018), in order.
+RAW_COLUMNS = """id member_id loan_amnt funded_amnt funded_amnt_inv term int_rate installment grade sub_grade
+emp_title emp_length home_ownership annual_inc verification_status issue_d loan_status pymnt_plan url desc purpose
+title zip_code addr_state dti delinq_2yrs earliest_cr_line inq_last_6mths mths_since_last_delinq
+mths_since_last_record open_acc pub_rec revol_bal revol_util total_acc initial_list_status out_prncp out_prncp_inv
+total_pymnt total_pymnt_inv total_rec_prncp total_rec_int total_rec_late_fee recoveries collection_recovery_fee
+last_pymnt_d last_pymnt_amnt next_pymnt_d last_credit_pull_d collections_12_mths_ex_med mths_since_last_major_derog
+policy_code application_type annual_inc_joint dti_joint verification_status_joint acc_now_delinq tot_coll_amt
+tot_cur_bal open_acc_6m open_act_il open_il_12m open_il_24m mths_since_rcnt_il total_bal_il il_util open_rv_12m
+open_rv_24m max_bal_bc all_util total_rev_hi_lim inq_fi total_cu_tl inq_last_12m acc_open_past_24mths avg_cur_bal
+bc_open_to_buy bc_util chargeoff_within_12_mths delinq_amnt mo_sin_old_il_acct mo_sin_old_rev_tl_op
+mo_sin_rcnt_rev_tl_op mo_sin_rcnt_tl mort_acc mths_since_recent_bc mths_since_recent_bc_dlq mths_since_recent_inq
+mths_since_recent_revol_delinq num_accts_ever_120_pd num_actv_bc_tl num_actv_rev_tl num_bc_sats num_bc_tl num_il_tl
+num_op_rev_tl num_rev_accts num_rev_tl_bal_gt_0 num_sats num_tl_120dpd_2m num_tl_30dpd num_tl_90g_dpd_24m
+num_tl_op_past_12m pct_tl_nvr_dlq percent_bc_gt_75 pub_rec_bankruptcies tax_liens tot_hi_cred_lim total_bal_ex_mort
+total_bc_limit total_il_high_credit_limit revol_bal_joint sec_app_earliest_cr_line sec_app_inq_last_6mths
+sec_app_mort_acc sec_app_open_acc sec_app_revol_util sec_app_open_act_il sec_app_num_rev_accts
+sec_app_chargeoff_within_12_mths sec_app_collections_12_mths_ex_med sec_app_mths_since_last_major_derog
+hardship_flag hardship_type hardship_reason hardship_status deferral_term hardship_amount hardship_start_date
+hardship_end_date payment_plan_start_date hardship_length hardship_dpd hardship_loan_status
+orig_projected_additional_accrued_interest hardship_payoff_balance_amount hardship_last_payment_amount
+disbursement_method debt_settlement_flag debt_settlement_flag_date settlement_status settlement_date
+settlement_amount settlement_percentage settlement_term""".split()
+
+# Values and frequencies of the text columns, roughly as in the real file.
+CATEGORIES = {
+    "loan_status": {"Fully Paid": 0.4607, "Current": 0.3878, "Charged Off": 0.1162, "Late (31-120 days)": 0.0095,
+                    "In Grace Period": 0.0037, "Late (16-30 days)": 0.0016,
+                    "Does not meet the credit policy. Status:Fully Paid": 0.0009,
+                    "Does not meet the credit policy. Status:Charged Off": 0.0003, "Default": 0.0003},
+    "term": {" 36 months": 0.71, " 60 months": 0.29},
+    "grade": {"A": 0.19, "B": 0.29, "C": 0.29, "D": 0.14, "E": 0.06, "F": 0.02, "G": 0.01},
+    "emp_length": {"10+ years": 0.35, "2 years": 0.1, "< 1 year": 0.09, "3 years": 0.09, "1 year": 0.07,
+                   "5 years": 0.07, "4 years": 0.06, "6 years": 0.05, "7 years": 0.04, "8 years": 0.04,
+                   "9 years": 0.04},
+    "home_ownership": {"MORTGAGE": 0.49, "RENT": 0.4, "OWN": 0.11},
+    "verification_status": {"Source Verified": 0.39, "Not Verified": 0.33, "Verified": 0.28},
+    "pymnt_plan": {"n": 0.9997, "y": 0.0003},
+    "purpose": {"debt_consolidation": 0.57, "credit_card": 0.23, "home_improvement": 0.07, "other": 0.06,
+                "major_purchase": 0.02, "medical": 0.02, "small_business": 0.01, "car": 0.02},
+    "addr_state": {"CA": 0.14, "TX": 0.08, "NY": 0.08, "FL": 0.07, "IL": 0.04, "NJ": 0.04, "PA": 0.03,
+                   "OH": 0.03, "GA": 0.03, "VA": 0.03, "NC": 0.03, "MI": 0.03, "other": 0.37},
+    "initial_list_status": {"w": 0.68, "f": 0.32},
+    "application_type": {"Individual": 0.95, "Joint App": 0.05},
+    "verification_status_joint": {"Not Verified": 0.5, "Source Verified": 0.3, "Verified": 0.2},
+    "hardship_flag": {"N": 0.9995, "Y": 0.0005},
+    "hardship_type": {"INTEREST ONLY-3 MONTHS DEFERRAL": 1.0},
+    "hardship_reason": {"NATURAL_DISASTER": 0.3, "EXCESSIVE_OBLIGATIONS": 0.3, "UNEMPLOYMENT": 0.4},
+    "hardship_status": {"COMPLETED": 0.5, "BROKEN": 0.3, "ACTIVE": 0.2},
+    "hardship_loan_status": {"Late (16-30 days)": 0.5, "In Grace Period": 0.3, "Current": 0.2},
+    "disbursement_method": {"Cash": 0.97, "DirectPay": 0.03},
+    "debt_settlement_flag": {"N": 0.985, "Y": 0.015},
+    "settlement_status": {"ACTIVE": 0.5, "COMPLETE": 0.3, "BROKEN": 0.2},
+    "emp_title": {"Teacher": 0.3, "Manager": 0.3, "Owner": 0.2, "Registered Nurse": 0.2},
+    "title": {"Debt consolidation": 0.6, "Credit card refinancing": 0.3, "Home improvement": 0.1},
+    "desc": {"Borrower added on 01/01/13 > Consolidating debt": 1.0},
+    "zip_code": {"945xx": 0.2, "112xx": 0.2, "750xx": 0.2, "606xx": 0.2, "331xx": 0.2},
+}
+# Month-year date columns, and the range of years they are drawn from.
+DATE_COLUMNS = {"issue_d": (2007, 2018), "earliest_cr_line": (1960, 2015), "last_pymnt_d": (2008, 2019),
+                "next_pymnt_d": (2019, 2019), "last_credit_pull_d": (2010, 2019),
+                "sec_app_earliest_cr_line": (1960, 2015), "hardship_start_date": (2017, 2019),
+                "hardship_end_date": (2017, 2019), "payment_plan_start_date": (2017, 2019),
+                "debt_settlement_flag_date": (2015, 2019), "settlement_date": (2015, 2019)}
+# Typical values of the amount and rate columns; other numeric columns are small counts.
+NUMERIC_MEANS = {"loan_amnt": 15000, "funded_amnt": 15000, "funded_amnt_inv": 15000, "int_rate": 13.1,
+                 "installment": 446, "annual_inc": 78000, "dti": 18.8, "revol_bal": 16700, "revol_util": 50.3,
+                 "out_prncp": 4200, "out_prncp_inv": 4200, "total_pymnt": 11800, "total_pymnt_inv": 11800,
+                 "total_rec_prncp": 9300, "total_rec_int": 2400, "total_rec_late_fee": 1.5, "recoveries": 140,
+                 "collection_recovery_fee": 23, "last_pymnt_amnt": 3300, "annual_inc_joint": 124000,
+                 "dti_joint": 19.3, "tot_coll_amt": 230, "tot_cur_bal": 142000, "total_bal_il": 35500,
+                 "il_util": 69, "max_bal_bc": 5800, "all_util": 57, "total_rev_hi_lim": 34500,
+                 "avg_cur_bal": 13500, "bc_open_to_buy": 11400, "bc_util": 57.9, "delinq_amnt": 12,
+                 "mo_sin_old_il_acct": 126, "mo_sin_old_rev_tl_op": 182, "mo_sin_rcnt_rev_tl_op": 14,
+                 "mo_sin_rcnt_tl": 8, "mths_since_last_delinq": 34, "mths_since_last_record": 72,
+                 "mths_since_last_major_derog": 44, "mths_since_rcnt_il": 21, "mths_since_recent_bc": 24,
+                 "mths_since_recent_bc_dlq": 39, "mths_since_recent_inq": 7, "mths_since_recent_revol_delinq": 35,
+                 "pct_tl_nvr_dlq": 94, "percent_bc_gt_75": 42, "tot_hi_cred_lim": 178000,
+                 "total_bal_ex_mort": 51000, "total_bc_limit": 23000, "total_il_high_credit_limit": 43700,
+                 "revol_bal_joint": 33600, "sec_app_revol_util": 58, "open_acc": 11.6, "total_acc": 24.2,
+                 "sec_app_open_acc": 11.5, "sec_app_num_rev_accts": 12.5, "num_rev_accts": 14,
+                 "num_sats": 11.6, "num_op_rev_tl": 8.2, "num_bc_tl": 7.7, "num_il_tl": 8.4,
+                 "deferral_term": 3, "hardship_amount": 155, "hardship_length": 3, "hardship_dpd": 14,
+                 "orig_projected_additional_accrued_interest": 455, "hardship_payoff_balance_amount": 11600,
+                 "hardship_last_payment_amount": 190, "settlement_amount": 5000, "settlement_percentage": 47.8,
+                 "settlement_term": 13}
+CONSTANT_COLUMNS = {"policy_code": 1.0}
+# Fraction of missing values of each column, roughly as in the real file. Joint application columns
+# are missing for individual applications, and hardship and settlement columns for loans without one.
+MISSING_RATES = {"id": 1.0, "member_id": 1.0, "url": 1.0, "desc": 0.94, "emp_title": 0.074, "emp_length": 0.065,
+                 "title": 0.01, "mths_since_last_delinq": 0.51, "mths_since_last_record": 0.84,
+                 "mths_since_last_major_derog": 0.74, "mths_since_recent_bc_dlq": 0.77,
+                 "mths_since_recent_revol_delinq": 0.67, "mths_since_recent_inq": 0.13, "mths_since_rcnt_il": 0.4,
+                 "mths_since_recent_bc": 0.03, "il_util": 0.47, "next_pymnt_d": 0.6, "open_acc_6m": 0.38,
+                 "open_act_il": 0.38, "open_il_12m": 0.38, "open_il_24m": 0.38, "total_bal_il": 0.38,
+                 "open_rv_12m": 0.38, "open_rv_24m": 0.38, "max_bal_bc": 0.38, "all_util": 0.38, "inq_fi": 0.38,
+                 "total_cu_tl": 0.38, "inq_last_12m": 0.38, "mo_sin_old_il_acct": 0.06, "num_tl_120dpd_2m": 0.07,
+                 "bc_util": 0.03, "percent_bc_gt_75": 0.03, "bc_open_to_buy": 0.03, "revol_util": 0.001,
+                 "dti": 0.001}
+# Missing rate of all other numeric columns (eg. the tot_* columns, missing for the oldest loans).
+DEFAULT_MISSING_RATE = 0.03
+GENERATE_CHUNKSIZE = 100000
+
+def column_kind(col):
+    """
+    Returns how a raw column is generated: "joint", "hardship", "settlement" (only set for joint
+    applications, hardship plans and debt settlements respectively), "category", "date", "constant" or
+    "numeric".
+    """
+    if "joint" in col or col.startswith("sec_app"):
+        return "joint"
+    if (col.startswith("hardship_") and col != "hardship_flag") or col in (
+            "deferral_term", "payment_plan_start_date", "orig_projected_additional_accrued_interest"):
+        return "hardship"
+    if col.startswith("settlement_") or col == "debt_settlement_flag_date":
+        return "settlement"
+    if col in DATE_COLUMNS:
+        return "date"
+    if col in CATEGORIES or col == "sub_grade":
+        return "category"
+    if col in CONSTANT_COLUMNS:
+        return "constant"
+    return "numeric"
+
+def random_dates(rng, n, first_year, last_year):
+    """
+    Draws n month-year dates, formatted as in the raw file (eg. "Dec-2015").
+    """
+    months = np.array(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
+                      dtype = object)
+    years = rng.integers(first_year, last_year + 1, n).astype(str).astype(object)
+    return months[rng.integers(0, 12, n)] + "-" + years
+
+def random_values(rng, col, n):
+    """
+    Draws n values of a raw column, ignoring missing values.
+    """
+    if col == "sub_grade":
+        raise ValueError("sub_grade is drawn from grade")
+    if col in DATE_COLUMNS:
+        return random_dates(rng, n, *DATE_COLUMNS[col])
+    if col in CATEGORIES:
+        values, probs = zip(*CATEGORIES[col].items())
+        probs = np.array(probs) / sum(probs)
+        return np.array(values, dtype = object)[rng.choice(len(values), n, p = probs)]
+    if col in CONSTANT_COLUMNS:
+        return np.full(n, CONSTANT_COLUMNS[col])
+    mean = NUMERIC_MEANS.get(col)
+    if mean is None:
+        # Counts of accounts, inquiries, delinquencies etc.: mostly small whole numbers.
+        return rng.poisson(2.0, n).astype(float)
+    values = rng.gamma(2.0, mean / 2.0, n)
+    # Counts and months since an event are whole numbers, as cleaning expects (see clean_dataset.downcast_dtypes).
+    whole = mean >= 1000 or col.startswith(clean_dataset.COUNT_COLUMN_PREFIXES)
+    return np.round(values) if whole else np.round(values, 2)
+
+def synthetic_chunk(n_rows, seed, chunk_index):
+    """
+    Generates one chunk of synthetic raw data. Each chunk has its own random stream, seeded by the seed
+    and the chunk's index, so any number of rows can be generated reproducibly in bounded memory.
+
+    Parameters:
+    n_rows (int): Number of rows in the chunk.
+    seed (int): Random seed of the whole file.
+    chunk_index (int): Index of the chunk in the file.
+
+    Returns:
+    df (pandas.DataFrame): Raw data with the columns of the real file (RAW_COLUMNS).
+    """
+    rng = np.random.default_rng([seed, chunk_index])
+    data = {}
+    # Columns whose values are only set when another column has a given value. Every such column comes
+    # after the column it depends on in RAW_COLUMNS.
+    depends_on = {"joint": ("application_type", "Joint App"), "hardship": ("hardship_flag", "Y"),
+                  "settlement": ("debt_settlement_flag", "Y")}
+    for col in RAW_COLUMNS:
+        if col == "sub_grade":
+            data[col] = data["grade"] + rng.integers(1, 6, n_rows).astype(str).astype(object)
+            continue
+        values = random_values(rng, col, n_rows)
+        kind = column_kind(col)
+        if kind in depends_on:
+            parent, value = depends_on[kind]
+            missing = data[parent] != value
+        else:
+            rate = MISSING_RATES.get(col, DEFAULT_MISSING_RATE if kind == "numeric" else 0.0)
+            missing = rng.random(n_rows) < rate
+        values = values.astype(object) if values.dtype == object else values.astype(float)
+        values[missing] = np.nan
+        data[col] = values
+    return pd.DataFrame(data, columns = RAW_COLUMNS)
+
+def write_data_dictionary(path):
+    """
+    Writes a data dictionary workbook for the synthetic data, in the format of LCDataDictionary.xlsx:
+    the hardship and settlement columns are described as such, so that data_dictionary groups them
+    as in the real dictionary.
+
+    Side effects:
+    Writes the workbook to path, and removes any parsed copy of an older one.
+    """
+    is_settlement = [column_kind(col) in ("hardship", "settlement") or col in ("hardship_flag", "debt_settlement_flag")
+                     for col in RAW_COLUMNS]
+    descriptions = [f"Synthetic hardship or settlement field {col}" if x else f"Synthetic field {col}"
+                    for col, x in zip(RAW_COLUMNS, is_settlement)]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    pd.DataFrame({"LoanStatNew": RAW_COLUMNS, "Description": descriptions}).to_excel(path, index = False)
+    if os.path.exists(data_dictionary.cache_path(path)):
+        os.remove(data_dictionary.cache_path(path))
+    logger.info(f"Wrote synthetic data dictionary to {path}")
+
+def make_synthetic_dataset(output_file, n_rows, seed = 0, data_dictionary_file = None):
+    """
+    Writes a synthetic raw file with the schema of loan.csv, and the missing value rates and mix of
+    loan_status of the real file, in chunks of GENERATE_CHUNKSIZE rows.
+
+    Parameters:
+    output_file (string): Location of the raw CSV file to write.
+    n_rows (int): Number of rows.
+    seed (int): Random seed: the same seed always generates the same file.
+    data_dictionary_file (string): If set, also write a matching data dictionary workbook there.
+
+    Side effects:
+    Writes output_file (and data_dictionary_file).
+    """
+    if storage.frame_format(output_file) != "csv":
+        raise ValueError(f"Raw files are CSV: {output_file} should end in .csv")
+    logger.info(f"Generating {n_rows} synthetic rows with seed {seed}")
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok = True)
+    with storage.frame_writer(output_file) as write:
+        for i, start in enumerate(range(0, n_rows, GENERATE_CHUNKSIZE)):
+            df = synthetic_chunk(min(GENERATE_CHUNKSIZE, n_rows - start), seed, i)
+            write(pa.Table.from_pandas(df, preserve_index = False))
+    if data_dictionary_file:
+        write_data_dictionary(data_dictionary_file)
+
+@click.command()
+@click.argument('output_filepath', type=click.Path())
+@click.argument('n_rows', type=click.INT)
+@click.option('--seed', type=click.INT, default=0, help='Random seed.')
+@click.option('--data-dictionary', 'data_dictionary_file', type=click.Path(), default=None,
+              help='Also write a matching data dictionary, eg. to references/LCDataDictionary.xlsx.')
+def main(output_filepath, n_rows, seed, data_dictionary_file):
+    """
+    Writes a synthetic raw dataset shaped like the Lending Club loan.csv file, eg. for benchmarks and
+    for running the pipeline without the real data.
+
+    Parameters:
+    output_filepath (string): Filepath of the raw CSV file to write, eg. data/raw/loan.csv.
+    n_rows (int): Number of rows to generate.
+    """
+    make_synthetic_dataset(output_filepath, n_rows, seed, data_dictionary_file)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from src.data import clean_dataset
+from src.data import storage
+from src.features import build_features
+
+logger = logging.getLogger(__name__)
+
+# Target size of each row partition of the raw file. There are at least as many partitions as workers;
+# keeping partitions small bounds the memory used by each worker.
+PARTITION_BYTES = 128 * 1024 ** 2
+# Number of rows at the start of the raw file used to freeze the cleaned schema shared by all partitions.
+SCHEMA_SAMPLE_ROWS = 100000
+# Number of lines from each split point of the raw file searched for the start of a record.
+SYNC_LINES = 1000
+
+def starts_record(line, n_fields):
+    """
+    Checks whether a line of a CSV file is a whole record, rather than the rest of a quoted field with
+    a line break in it (eg. a multi-line desc): it must have balanced quotes and n_fields fields.
+    """
+    text = line.decode("utf-8", errors = "replace").rstrip("\r\n")
+    if text.count('"') % 2:
+        return False
+    return len(next(csv.reader([text]), [])) == n_fields
+
+def byte_ranges(input_file, n_partitions):
+    """
+    Splits a CSV file into byte ranges of whole records, skipping the header.
+    Quoted fields may contain line breaks (eg. the free text desc column), so each range starts at the
+    first line from its split point that is a whole record (see starts_record), rather than just the
+    next line.
+
+    Parameters:
+    input_file (string): Location of the CSV file.
+    n_partitions (int): Number of ranges to split the file into.
+
+    Returns:
+    ranges (list): (start, end) byte offsets of each non-empty range.
+
+    Raises:
+    ValueError: If no whole record is found within SYNC_LINES lines of a split point.
+    """
+    size = os.path.getsize(input_file)
+    with open(input_file, 'rb') as f:
+        n_fields = len(next(csv.reader([f.readline().decode("utf-8", errors = "replace")])))
+        header_end = f.tell()
+        bounds = [header_end]
+        for i in range(1, n_partitions):
+            f.seek(max(header_end + (size - header_end) * i // n_partitions, bounds[-1]))
+            # Move on to the start of the next line, then on to the next line that starts a record.
+            f.readline()
+            for _ in range(SYNC_LINES):
+                start = f.tell()
+                line = f.readline()
+                if not line or starts_record(line, n_fields):
+                    break
+            else:
+                raise ValueError(f"No whole CSV record within {SYNC_LINES} lines of byte {start} of {input_file}: "
+                                 "it can't be split into partitions, process it with a single worker")
+            bounds.append(min(start, size))
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def read_byte_range(input_file, start, end, read_options):
+    """
+    Reads the rows of a CSV file in a byte range returned by byte_ranges.
+
+    Parameters:
+    input_file (string): Location of the CSV file.
+    start (int): Offset of the first byte of the range.
+    end (int): Offset of the byte after the range.
+    read_options (dict): Options for pandas.read_csv, including usecols (see raw_read_options).
+
+    Returns:
+    df (pandas.DataFrame): The rows in the range.
+    """
+    header = pd.read_csv(input_file, nrows = 0).columns
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(data), header = None, names = header, **read_options)
+
+def row_group_ranges(input_file, n_partitions):
+    """
+    Splits the row groups of a Parquet file (eg. a sample written by sample_dataset) into ranges.
+
+    Parameters:
+    input_file (string): Location of the Parquet file.
+    n_partitions (int): Number of ranges to split the file into.
+
+    Returns:
+    ranges (list): (start, end) row group indices of each non-empty range.
+    """
+    import pyarrow.parquet as pq
+    n_row_groups = pq.ParquetFile(input_file).num_row_groups
+    bounds = [n_row_groups * i // n_partitions for i in range(n_partitions + 1)]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def read_partition(input_file, start, end, read_options):
+    """
+    Reads one range returned by byte_ranges (CSV) or row_group_ranges (Parquet), and applies the
+    raw column types.
+    """
+    if storage.frame_format(input_file) == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.ParquetFile(input_file).read_row_groups(range(start, end), columns = read_options["usecols"])
+        return clean_dataset.cast_raw_text(table.to_pandas(), read_options["dtype"])
+    return read_byte_range(input_file, start, end, read_options)
+
+def process_partition(input_file, start, end, read_options, settlement_cols, schema, output_file):
+    """
+    Cleans and adds features to one range of the raw file, and writes it as a part file.
+    Runs in a worker process.
+
+    Parameters:
+    input_file (string): Location of the raw file.
+    start (int): Start of the range (see read_partition).
+    end (int): End of the range (see read_partition).
+    read_options (dict): Options for pandas.read_csv (see raw_read_options).
+    settlement_cols (list): Hardship and settlement columns to drop.
+    schema (dict): Frozen schema of the cleaned data (see freeze_schema).
+    output_file (string): Location of the part file to write.
+
+    Returns:
+    n_rows (tuple): Number of rows read and written.
+    """
+    df = read_partition(input_file, start, end, read_options)
+    n_rows_in = len(df)
+    df = clean_dataset.clean_dataset(df, settlement_cols)
+    df = clean_dataset.apply_schema(df, schema)
+    df = build_features.add_features(df)
+    storage.write_frame(df, output_file)
+    return n_rows_in, len(df)
+
+def make_dataset_parallel(input_file, output_dir, workers):
+    """
+    Cleans and adds features to the raw file in parallel: the file is split by byte range (or by row 
+    group, for a Parquet sample) into row partitions, which are processed in a pool of worker processes 
+    against a schema frozen from the start of the file. Each partition is written as a part file of 
+    output_dir.
+
+    Parameters:
+    input_file (string): Location of the raw CSV (or Parquet) file.
+    output_dir (string): Location of the processed dataset, eg. data/processed/loan.parquet. The format
+                         of the part files is taken from its extension.
+    workers (int): Number of worker processes.
+
+    Side effects:
+    Writes the part files of output_dir, replacing anything already there.
+
+    Raises:
+    ValueError: If the raw file can't be split into partitions, or a partition fails (eg. values that
+                don't fit the frozen schema), naming the partition.
+    """
+    settlement_cols = clean_dataset.settlement_columns()
+    read_options = clean_dataset.raw_read_options(input_file, settlement_cols)
+
+    logger.info(f"Freezing cleaned schema from the first {SCHEMA_SAMPLE_ROWS} rows")
+    sample = next(iter(clean_dataset.read_raw(input_file, read_options, chunksize = SCHEMA_SAMPLE_ROWS)))
+    schema = clean_dataset.freeze_schema(clean_dataset.clean_dataset(sample, settlement_cols))
+    del sample
+
+    n_partitions = max(workers, math.ceil(os.path.getsize(input_file) / PARTITION_BYTES))
+    if storage.frame_format(input_file) == "parquet":
+        ranges = row_group_ranges(input_file, n_partitions)
+    else:
+        ranges = byte_ranges(input_file, n_partitions)
+    logger.info(f"Processing {len(ranges)} partitions of {input_file} with {workers} workers")
+
+    storage.remove_frame(output_dir)
+    os.makedirs(output_dir)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(process_partition, input_file, start, end, read_options, settlement_cols,
+                               schema, storage.part_path(output_dir, i))
+                   for i, (start, end) in enumerate(ranges)]
+        n_rows_in, n_rows_out = 0, 0
+        for i, (future, (start, end)) in enumerate(zip(futures, ranges)):
+            try:
+                rows_in, rows_out = future.result()
+            except Exception as e:
+                # The worker's traceback is logged for debugging; the error names the partition.
+                logger.debug(f"Partition {i} failed", exc_info = e)
+                raise ValueError(f"Partition {i} of {input_file} (range {start} to {end}) failed: "
+                                 f"{type(e).__name__}: {e}") from None
+            n_rows_in += rows_in
+            n_rows_out += rows_out
+            logger.info(f"Partition {i}: {rows_in} rows read, {rows_out} rows written")
+    logger.info(f"{n_rows_in} rows read, {n_rows_out} rows written to {output_dir}")
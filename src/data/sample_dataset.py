@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import os
+import numpy as np
+import pandas as pd
+
+from src import profiling
+from src.data import storage
+
+logger = logging.getLogger(__name__)
+
+# reservoir: each row gets a key drawn from a seeded random stream, and the rows with the smallest keys
+#            are kept, which is a uniform sample of the file read in one pass.
+# hash: each row's key is a seeded hash of its key columns, so the same loan is always in or out of
+#       the sample, whatever else is in the file (eg. after new loans have been appended to it).
+SAMPLE_METHODS = ["reservoir", "hash"]
+# Rows of a Parquet input to read at a time.
+READ_CHUNKSIZE = 100000
+# Bytes of a CSV input to read at a time.
+READ_BLOCK_BYTES = 64 * 1024 ** 2
+# With stratify, every stratum keeps at least this many rows (or all of its rows, if it has fewer),
+# so that rare classes such as "Default" aren't lost from small samples.
+MIN_STRATUM_ROWS = 100
+KEY_SPACE = 2 ** 64
+
+def iter_batches(input_file, chunksize = READ_CHUNKSIZE):
+    """
+    Reads the raw file in chunks, with every field as text, so that every chunk has the same schema.
+    Chunks are pyarrow Tables rather than dataframes: only the columns needed for sampling are ever
+    converted to Python objects.
+
+    Parameters:
+    input_file (string): Location of the raw file, CSV or Parquet.
+    chunksize (int): For Parquet files, the number of rows per chunk. CSV files are read in blocks of
+                     READ_BLOCK_BYTES.
+
+    Returns:
+    chunks (generator): Generator of pyarrow.Table.
+    """
+    import pyarrow as pa
+    columns = storage.frame_columns(input_file)
+    schema = pa.schema([(c, pa.string()) for c in columns])
+    if storage.frame_format(input_file) == "parquet":
+        import pyarrow.parquet as pq
+        paths = storage.part_files(input_file) if os.path.isdir(input_file) else [input_file]
+        for path in paths:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size = chunksize):
+                yield pa.Table.from_batches([batch]).cast(schema)
+        return
+
+    import pyarrow.csv as pv
+    reader = pv.open_csv(input_file, read_options = pv.ReadOptions(block_size = READ_BLOCK_BYTES),
+                         convert_options = pv.ConvertOptions(column_types = schema, strings_can_be_null = True))
+    for batch in reader:
+        yield pa.Table.from_batches([batch])
+
+def sample_keys(table, method, seed, rng = None, key_columns = None):
+    """
+    Computes the sampling key of each row of a chunk of the raw file.
+
+    Parameters:
+    table (pyarrow.Table): A chunk of the raw file.
+    method (string): One of SAMPLE_METHODS.
+    seed (int): Random seed.
+    rng (numpy.random.Generator): For the reservoir method, the random stream shared by all chunks.
+    key_columns (list): For the hash method, the columns identifying a loan. If not set, the whole row
+                        is hashed (the id columns are empty in the public Lending Club file), which is slower.
+
+    Returns:
+    keys (numpy.ndarray): uint64 key of each row, uniformly distributed.
+    """
+    if method == "reservoir":
+        return rng.integers(0, KEY_SPACE, size = table.num_rows, dtype = np.uint64)
+    if method == "hash":
+        df = table.select(key_columns or table.column_names).to_pandas()
+        return pd.util.hash_pandas_object(df, index = False, hash_key = f"{seed:016d}"[-16:]).to_numpy()
+    raise ValueError(f"Unknown sample method {method}, expected one of {SAMPLE_METHODS}")
+
+def strata(table, stratify):
+    """
+    Returns the stratum of each row of a chunk: the value of the stratify column, with missing values
+    as a stratum of their own, or a single stratum if stratify isn't set.
+    """
+    if stratify is None:
+        return np.full(table.num_rows, "all", dtype = object)
+    return table.column(stratify).to_pandas().fillna("<missing>").to_numpy()
+
+def smallest_keys(keys, stratum, n):
+    """
+    Finds the n rows of each stratum with the smallest keys.
+
+    Parameters:
+    keys (numpy.ndarray): Key of each row.
+    stratum (numpy.ndarray): Stratum of each row.
+    n (int or pandas.Series): Number of rows to keep, or number to keep of each stratum.
+
+    Returns:
+    rows (numpy.ndarray): Positions of the rows kept, sorted by key.
+    """
+    df = pd.DataFrame({"key": keys, "stratum": stratum}).sort_values("key", kind = "stable")
+    rank = df.groupby("stratum", sort = False).cumcount()
+    limit = df["stratum"].map(n).fillna(0) if isinstance(n, pd.Series) else n
+    return df.index[rank < limit].to_numpy()
+
+def stratum_sizes(counts, n_samples):
+    """
+    Allocates a sample of n_samples rows to strata in proportion to their size, keeping at least
+    MIN_STRATUM_ROWS of each stratum (or all of its rows, if it has fewer). The rows added to small
+    strata are taken from the largest strata, so the sizes add up to n_samples (or to every row, if
+    there are fewer than n_samples).
+
+    Parameters:
+    counts (pandas.Series): Number of rows of each stratum.
+    n_samples (int): Total sample size.
+
+    Returns:
+    sizes (pandas.Series): Number of rows to sample from each stratum.
+
+    Raises:
+    ValueError: If n_samples is too small to keep MIN_STRATUM_ROWS of each stratum.
+    """
+    total = min(n_samples, int(counts.sum()))
+    floor = np.minimum(counts, MIN_STRATUM_ROWS)
+    if floor.sum() > total:
+        raise ValueError(f"A stratified sample of {n_samples} rows can't keep {MIN_STRATUM_ROWS} rows of each of "
+                         f"{len(counts)} strata ({int(floor.sum())} rows): sample more rows")
+    proportional = (counts * total / counts.sum()).round().astype(int)
+    sizes = np.maximum(proportional, floor).clip(upper = counts)
+    # Take the excess from (or, after rounding, give the shortfall to) the largest strata first.
+    excess = int(sizes.sum()) - total
+    for stratum in sizes.sort_values(ascending = False).index:
+        if excess == 0:
+            break
+        if excess > 0:
+            change = min(excess, sizes[stratum] - floor[stratum])
+        else:
+            change = max(excess, sizes[stratum] - counts[stratum])
+        sizes[stratum] -= change
+        excess -= change
+    return sizes
+
+@profiling.profiled
+def sample_dataset(input_file, output_file, n_samples = None, fraction = None, method = "reservoir", seed = 10,
+                   stratify = None, key_columns = None, chunksize = READ_CHUNKSIZE):
+    """
+    Samples rows from the raw file in a single pass over it, reading it in chunks.
+    Either n_samples rows are sampled, holding only the sample in memory, or each row is kept with
+    probability fraction, streaming the sample straight to output_file.
+    Fields are kept as text, as in the raw file: cleaning applies the column types (see read_raw).
+
+    Parameters:
+    input_file (string): Location of the raw file.
+    output_file (string): Location of the sample. The format is taken from the extension.
+    n_samples (int): Number of rows to sample.
+    fraction (float): Fraction of rows to sample, if n_samples isn't set.
+    method (string): One of SAMPLE_METHODS.
+    seed (int): Random seed: the same seed always draws the same sample.
+    stratify (string): If set, sample each value of this column (eg. loan_status) separately, in
+                       proportion to its size but keeping at least MIN_STRATUM_ROWS rows of each. With
+                       n_samples, the sample still has n_samples rows (see stratum_sizes); with
+                       fraction, rows added to small strata are on top of the fraction.
+    key_columns (list): For the hash method, the columns identifying a loan (see sample_keys).
+    chunksize (int): Number of rows of a Parquet input to read at a time.
+
+    Side effects:
+    Writes the sample to output_file. With n_samples, rows are in the order of the raw file; with
+    fraction, any rows added to reach MIN_STRATUM_ROWS in a stratum come last.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if (n_samples is None) == (fraction is None):
+        raise ValueError("Exactly one of n_samples and fraction must be set")
+    logger.info(f"Sampling {n_samples or fraction} rows of {input_file} by {method} with seed {seed}"
+                + (f", stratified by {stratify}" if stratify else ""))
+    rng = np.random.default_rng(seed)
+    counts = pd.Series(dtype = int)
+    kept, kept_keys, kept_strata = None, None, None
+    n_rows, n_written = 0, 0
+
+    with storage.frame_writer(output_file) as write:
+        threshold = np.uint64(min(fraction, 1.0) * (KEY_SPACE - 1)) if fraction is not None else None
+        written = pd.Series(dtype = int)
+        for table in iter_batches(input_file, chunksize):
+            keys = sample_keys(table, method, seed, rng, key_columns)
+            stratum = strata(table, stratify)
+            counts = counts.add(pd.Series(stratum).value_counts(), fill_value = 0)
+            n_rows += table.num_rows
+            if threshold is not None:
+                in_sample = keys < threshold
+                write(table.filter(pa.array(in_sample)))
+                n_written += int(in_sample.sum())
+                if not stratify:
+                    continue
+                written = written.add(pd.Series(stratum[in_sample]).value_counts(), fill_value = 0)
+                # Keep the smallest keys not in the sample, to top up strata that are too small.
+                table, keys, stratum = table.filter(pa.array(~in_sample)), keys[~in_sample], stratum[~in_sample]
+            else:
+                table = table.append_column("_row", pa.array(np.arange(n_rows - table.num_rows, n_rows)))
+
+            if kept is not None:
+                table = pa.concat_tables([kept, table])
+                keys = np.concatenate([kept_keys, keys])
+                stratum = np.concatenate([kept_strata, stratum])
+            rows = smallest_keys(keys, stratum, n_samples if threshold is None else MIN_STRATUM_ROWS)
+            kept, kept_keys, kept_strata = table.take(rows), keys[rows], stratum[rows]
+
+        if threshold is None:
+            if stratify:
+                rows = smallest_keys(kept_keys, kept_strata, stratum_sizes(counts.astype(int), n_samples))
+                kept = kept.take(rows)
+            sample = kept.take(pc.sort_indices(kept, [("_row", "ascending")])).drop(["_row"])
+            write(sample)
+            n_written = sample.num_rows
+        elif stratify and kept is not None:
+            shortfall = np.minimum(counts, MIN_STRATUM_ROWS) - written.reindex(counts.index, fill_value = 0)
+            top_up = kept.take(smallest_keys(kept_keys, kept_strata, shortfall.clip(lower = 0)))
+            if top_up.num_rows:
+                logger.info(f"Adding {top_up.num_rows} rows to reach {MIN_STRATUM_ROWS} rows of each {stratify}")
+                write(top_up)
+                n_written += top_up.num_rows
+    logger.info(f"Sampled {n_written} of {n_rows} rows")
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--n-samples', type=click.INT, default=None, help='Number of rows to sample.')
+@click.option('--fraction', type=click.FLOAT, default=None, help='Fraction of rows to sample, eg. 0.01.')
+@click.option('--method', type=click.Choice(SAMPLE_METHODS), default='reservoir',
+              help='reservoir: uniform random sample; hash: deterministic sample by hashing each loan.')
+@click.option('--seed', type=click.INT, default=10, help='Random seed.')
+@click.option('--stratify', default=None, help='Column to stratify the sample by, eg. loan_status.')
+@click.option('--key-column', 'key_columns', multiple=True,
+              help='Column identifying a loan, for --method hash (default: the whole row).')
+def main(input_filepath, output_filepath, n_samples, fraction, method, seed, stratify, key_columns):
+    """
+    Samples rows of the raw data, eg. to make a development dataset that fits in memory.
+
+    Parameters:
+    input_filepath (string): Filepath of raw data, eg. data/raw/loan.csv.
+    output_filepath (string): Filepath to save the sample to, eg. data/interim/loan_sampled_50000.parquet.
+    """
+    sample_dataset(input_filepath, output_filepath, n_samples, fraction, method, seed, stratify,
+                   list(key_columns) or None)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from src.data import storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join("data", "interim", "cache")
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+DEFAULT_MAX_AGE_DAYS = 30
+
+# Digests of large input files are remembered by path, size and modification time, so that
+# an unchanged multi-GB raw file is only read once to hash it.
+DIGESTS_FILE = "digests.json"
+# Files are written with this suffix and the writer's process id, then renamed to their final name.
+TMP_SUFFIX = ".tmp-"
+
+def file_digest(path, cache_dir = None):
+    """
+    Hashes the contents of a file, or of the files in a directory (eg. a partitioned dataset).
+
+    Parameters:
+    path (string): Location of the file or directory.
+    cache_dir (string): If set, remember the digest in cache_dir and reuse it while the file's size
+                        and modification time are unchanged.
+
+    Returns:
+    digest (string): Hex digest of the file contents.
+    """
+    if os.path.isdir(path):
+        h = hashlib.blake2b(digest_size = 16)
+        for name in sorted(os.listdir(path)):
+            h.update(name.encode())
+            h.update(file_digest(os.path.join(path, name), cache_dir).encode())
+        return h.hexdigest()
+
+    stat = os.stat(path)
+    memo_key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    memo_file = os.path.join(cache_dir, DIGESTS_FILE) if cache_dir else None
+    memo = {}
+    if memo_file and os.path.exists(memo_file):
+        with open(memo_file) as f:
+            try:
+                memo = json.load(f)
+            except ValueError:
+                logger.warning(f"Ignoring unreadable {memo_file}")
+        if memo_key in memo:
+            return memo[memo_key]
+
+    h = hashlib.blake2b(digest_size = 16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    digest = h.hexdigest()
+
+    if memo_file:
+        # Drop entries for older versions of the same file.
+        memo = {k: v for k, v in memo.items() if not k.startswith(f"{os.path.abspath(path)}:")}
+        memo[memo_key] = digest
+        # Written to a temporary file and moved into place, so that a concurrent or interrupted run
+        # never leaves a partly written memo.
+        tmp_file = temporary_path(memo_file)
+        with open(tmp_file, 'w') as f:
+            json.dump(memo, f)
+        os.replace(tmp_file, memo_file)
+    return digest
+
+def stage_key(input_path, code_files, params, cache_dir = None):
+    """
+    Computes the cache key of a pipeline stage.
+
+    Parameters:
+    input_path (string): Location of the stage's input file or directory.
+    code_files (list): Locations of the source code (and any reference files) the stage depends on.
+    params (dict): JSON-serializable parameters of the stage, eg. n_samples or the random seed.
+    cache_dir (string): Cache directory, used to remember digests of large input files.
+
+    Returns:
+    key (string): Hex digest identifying the stage's output.
+    """
+    h = hashlib.blake2b(digest_size = 16)
+    h.update(file_digest(input_path, cache_dir).encode())
+    for path in code_files:
+        h.update(file_digest(path).encode())
+    h.update(json.dumps(params, sort_keys = True, default = str).encode())
+    return h.hexdigest()
+
+def dataset_size(path):
+    """
+    Returns the size in bytes of a file, or of all the files in a directory.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def temporary_path(path):
+    """
+    Location to write path to before moving it into place: unique to this process, so that concurrent
+    runs don't write to the same file.
+    """
+    return f"{path}{TMP_SUFFIX}{os.getpid()}"
+
+def copy_dataset(src, dst):
+    """
+    Copies a file or directory from src to dst, replacing whatever is at dst. The copy is made next to
+    dst and then moved into place, so that dst is never left partly copied, eg. by an interrupted run.
+    """
+    tmp = temporary_path(dst)
+    storage.remove_frame(tmp)
+    if os.path.isdir(src):
+        shutil.copytree(src, tmp)
+        # A directory can only be moved onto an empty one.
+        storage.remove_frame(dst)
+    else:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def evict(cache_dir, max_bytes = DEFAULT_MAX_BYTES, max_age_days = DEFAULT_MAX_AGE_DAYS):
+    """
+    Deletes cache entries that haven't been used for max_age_days, then the least recently used
+    entries until the cache is no bigger than max_bytes. Copies left by interrupted runs are deleted
+    once they are max_age_days old; until then, they may still be being written.
+
+    Side effects:
+    Deletes files from cache_dir.
+    """
+    cutoff = time.time() - max_age_days * 24 * 3600
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name == DIGESTS_FILE:
+            continue
+        if TMP_SUFFIX in name:
+            if os.stat(path).st_mtime < cutoff:
+                logger.info(f"Removing {path}, left by an interrupted run")
+                storage.remove_frame(path)
+            continue
+        entries.append((os.stat(path).st_mtime, dataset_size(path), path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        logger.info(f"Evicting {path} from stage cache")
+        storage.remove_frame(path)
+        total -= size
+
+def cached_stage(stage_name, run, input_path, output_path, code_files, params,
+                 cache_dir = DEFAULT_CACHE_DIR, max_bytes = DEFAULT_MAX_BYTES,
+                 max_age_days = DEFAULT_MAX_AGE_DAYS):
+    """
+    Runs a pipeline stage, unless a stage with the same input, code and parameters has already been
+    run, in which case its stored output is copied to output_path instead.
+
+    Parameters:
+    stage_name (string): Name of the stage, used to name cache entries.
+    run (function): Runs the stage: called with no arguments, must write output_path.
+    input_path (string): Location of the stage's input file or directory.
+    output_path (string): Location the stage writes its output (a file or directory) to.
+    code_files (list): Locations of the source code (and any reference files) the stage depends on.
+    params (dict): JSON-serializable parameters of the stage.
+    cache_dir (string): Directory to store stage outputs in.
+    max_bytes (int): Maximum total size of the cache.
+    max_age_days (float): Entries unused for longer than this are evicted.
+
+    Side effects:
+    Writes output_path, and stores a copy in cache_dir. Entries are moved into place once fully
+    copied, so only complete outputs are ever reused.
+    """
+    os.makedirs(cache_dir, exist_ok = True)
+    params = dict(params, output_ext = os.path.splitext(output_path)[1])
+    key = stage_key(input_path, code_files, params, cache_dir)
+    entry = os.path.join(cache_dir, f"{stage_name}-{key}{os.path.splitext(output_path)[1]}")
+
+    if os.path.exists(entry):
+        logger.info(f"Stage {stage_name} unchanged, reusing {entry}")
+        # Touch the entry, so that eviction is least recently used first.
+        os.utime(entry)
+        copy_dataset(entry, output_path)
+        return
+
+    run()
+    copy_dataset(output_path, entry)
+    evict(cache_dir, max_bytes, max_age_days)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import glob
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+
+import pandas as pd
+
+from src import profiling
+
+logger = logging.getLogger(__name__)
+
+# Formats for the intermediate files passed between pipeline stages, keyed by file extension.
+# Parquet keeps dtypes (categories, datetimes, booleans) between stages and allows reading a subset
+# of columns without parsing the rest of the file; CSV is kept for inspecting files by hand.
+FORMATS = {".parquet": "parquet", ".csv": "csv"}
+DEFAULT_FORMAT = "parquet"
+
+# A dataset may also be a directory of part files (eg. loan.parquet/part-00000.parquet), as written by
+# stages that process row partitions in parallel. The directory's extension gives the format. 
+PART_FILE = "part-{:05d}"
+
+def frame_format(path):
+    """
+    Works out the storage format of a file from its extension.
+
+    Parameters:
+    path (string): Location of the file.
+
+    Returns:
+    fmt (string): One of the values of FORMATS.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown storage format for {path}: expected one of {', '.join(FORMATS)}")
+    return FORMATS[ext]
+
+@profiling.profiled
+def read_frame(path, columns = None):
+    """
+    Reads a dataframe written by write_frame, or a directory of part files.
+
+    Parameters:
+    path (string): Location of the file or directory. The format is taken from the extension.
+    columns (list): If set, only read these columns.
+
+    Returns:
+    df (pandas.DataFrame): The stored dataframe.
+    """
+    logger.info(f"Reading {path}")
+    fmt = frame_format(path)
+    if fmt == "parquet":
+        return pd.read_parquet(path, columns = columns, engine = "pyarrow")
+    if os.path.isdir(path):
+        return pd.concat([pd.read_csv(part, usecols = columns, low_memory = False) for part in part_files(path)],
+                         ignore_index = True)
+    return pd.read_csv(path, usecols = columns, low_memory = False)
+
+def frame_columns(path):
+    """
+    Lists the columns of a stored dataframe without reading its rows.
+    """
+    paths = part_files(path) if os.path.isdir(path) else [path]
+    if frame_format(path) == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(paths[0]).names
+    return list(pd.read_csv(paths[0], nrows = 0).columns)
+
+def iter_frame(path, chunksize, columns = None, **csv_options):
+    """
+    Reads a stored dataframe in chunks, so that it never has to fit in memory at once.
+
+    Parameters:
+    path (string): Location of the file or directory. The format is taken from the extension.
+    chunksize (int): Maximum number of rows per chunk.
+    columns (list): If set, only read these columns.
+    csv_options: Extra options for pandas.read_csv, when reading CSV files. 
+
+    Returns:
+    chunks (generator): Generator of dataframes. 
+    """
+    logger.info(f"Reading {path} in chunks of {chunksize} rows")
+    paths = part_files(path) if os.path.isdir(path) else [path]
+    for part in paths:
+        if frame_format(path) == "parquet":
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(part).iter_batches(batch_size = chunksize, columns = columns):
+                yield batch.to_pandas()
+        else:
+            csv_options.setdefault("low_memory", False)
+            yield from pd.read_csv(part, usecols = columns, chunksize = chunksize, **csv_options)
+
+def part_path(path, i):
+    """
+    Location of the i-th part file of the partitioned dataset at path.
+    """
+    return os.path.join(path, PART_FILE.format(i) + os.path.splitext(path)[1])
+
+def part_files(path):
+    """
+    Lists the part files of the partitioned dataset at path, in order.
+    """
+    return sorted(glob.glob(os.path.join(path, "part-*" + os.path.splitext(path)[1])))
+
+def remove_frame(path):
+    """
+    Deletes the dataset at path, whether it is a single file or a directory of part files.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+@profiling.profiled
+def write_frame(df, path):
+    """
+    Writes a dataframe in the format given by the extension of path.
+
+    Parameters:
+    df (pandas.DataFrame): The dataframe to save.
+    path (string): Location to save the dataframe to.
+
+    Side effects:
+    Saves dataframe to path.
+    """
+    logger.info(f"Writing {path}")
+    remove_frame(path)
+    if frame_format(path) == "parquet":
+        df.to_parquet(path, index = False, engine = "pyarrow")
+    else:
+        df.to_csv(path, index = False)
+
+@contextmanager
+def frame_writer(path):
+    """
+    Opens path for writing a dataframe in chunks, eg. when streaming a file through a pipeline stage.
+    Every chunk must have the same columns and dtypes as the first one. Chunks may also be pyarrow Tables.
+
+    Parameters:
+    path (string): Location to save the dataframe to. The format is taken from the extension.
+
+    Returns:
+    write (function): Context manager yielding a function that appends a dataframe chunk to path.
+    """
+    fmt = frame_format(path)
+    remove_frame(path)
+    state = {"writer": None, "n_chunks": 0}
+
+    def write(df):
+        if fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if isinstance(df, pa.Table):
+                table = df if state["writer"] is None else df.cast(state["writer"].schema)
+            elif state["writer"] is None:
+                table = pa.Table.from_pandas(df, preserve_index = False)
+            else:
+                table = pa.Table.from_pandas(df, schema = state["writer"].schema, preserve_index = False)
+            if state["writer"] is None:
+                state["writer"] = pq.ParquetWriter(path, table.schema)
+            state["writer"].write_table(table)
+        elif not isinstance(df, pd.DataFrame):
+            # pyarrow writes CSV several times faster than pandas.
+            import pyarrow.csv as pv
+            first = state["n_chunks"] == 0
+            with open(path, 'wb' if first else 'ab') as f:
+                pv.write_csv(df, f, write_options = pv.WriteOptions(include_header = first))
+        else:
+            first = state["n_chunks"] == 0
+            df.to_csv(path, index = False, mode = 'w' if first else 'a', header = first)
+        state["n_chunks"] += 1
+
+    logger.info(f"Writing {path} in chunks")
+    try:
+        yield write
+    finally:
+        if state["writer"] is not None:
+            state["writer"].close()
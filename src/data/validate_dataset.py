@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import json
+import os
+
+import pandas as pd
+
+from src.data import clean_dataset
+from src.data import storage
+
+logger = logging.getLogger(__name__)
+
+# The reference schema of the raw file: its columns, and the values of its low-cardinality text columns.
+# Saved from a raw file known to clean correctly (see --save-schema).
+DEFAULT_SCHEMA = os.path.join("references", "raw_schema.json")
+DEFAULT_SAMPLE_ROWS = 100000
+DEFAULT_CHUNKSIZE = 100000
+# Text columns with at most this many distinct values have them recorded as the column's domain.
+MAX_DOMAIN_VALUES = 100
+# Formats of the raw text fields that cleaning parses by position (see clean_dataset.fix_dtypes):
+# a value that doesn't match would make cleaning fail part way through, or parse to the wrong number.
+RAW_FORMATS = {"term": r"^ \d{2} months$", "emp_length": r"^(< 1 year|10\+ years|\d years?)$",
+               "issue_d": r"^[A-Z][a-z]{2}-\d{4}$", "earliest_cr_line": r"^[A-Z][a-z]{2}-\d{4}$"}
+# Number of offending values quoted in each problem.
+N_EXAMPLES = 5
+
+def iter_raw(input_file, dtype, sample_rows = DEFAULT_SAMPLE_ROWS, chunksize = DEFAULT_CHUNKSIZE):
+    """
+    Reads columns of the raw file in chunks, stopping after sample_rows rows. 
+
+    Parameters:
+    input_file (string): Location of the raw CSV (or Parquet sample) file.
+    dtype (dict): Type to read each column as ("object" for text, or eg. "float64").
+    sample_rows (int): Stop after this many rows, or 0 to read the whole file.
+    chunksize (int): Number of rows per chunk.
+
+    Returns:
+    chunks (generator): Generator of dataframes (missing values are NaN).
+    """
+    chunksize = min(chunksize, sample_rows) if sample_rows else chunksize
+    if storage.frame_format(input_file) == "parquet":
+        chunks = (clean_dataset.cast_raw_text(x, dtype) for x in storage.iter_frame(input_file, chunksize, list(dtype)))
+    else:
+        chunks = pd.read_csv(input_file, usecols = list(dtype), dtype = dtype, chunksize = chunksize, low_memory = False)
+    n_rows = 0
+    for chunk in chunks:
+        yield chunk
+        n_rows += len(chunk)
+        if sample_rows and n_rows >= sample_rows:
+            return
+
+def non_numeric(values):
+    """
+    Returns the distinct non-missing values of a text column that don't parse as numbers.
+    """
+    values = pd.Series(values.dropna().unique())
+    return list(values[pd.to_numeric(values, errors = "coerce").isna()])
+
+def infer_schema(input_file, sample_rows = DEFAULT_SAMPLE_ROWS):
+    """
+    Records the schema of a raw file that is known to clean correctly, to check later files against.
+
+    Parameters:
+    input_file (string): Location of the raw file.
+    sample_rows (int): Number of rows to read (0 for all of them).
+
+    Returns:
+    schema (dict): The raw columns ("columns"), and the values of each categorical column (see
+                   clean_dataset.RAW_TEXT_DTYPES) with at most MAX_DOMAIN_VALUES of them ("domains").
+    """
+    columns = storage.frame_columns(input_file)
+    categorical = [x for x, dtype in clean_dataset.RAW_TEXT_DTYPES.items() if dtype == "category" and x in columns]
+    domains = {}
+    for chunk in iter_raw(input_file, dict.fromkeys(categorical, "object"), sample_rows):
+        for col in categorical:
+            if domains.get(col, set()) is not None:
+                values = domains.get(col, set()) | set(chunk[col].dropna().unique())
+                domains[col] = values if len(values) <= MAX_DOMAIN_VALUES else None
+    return {"columns": columns,
+            "domains": {col: sorted(values) for col, values in domains.items() if values is not None}}
+
+def sample_problems(input_file, dtype, formats, domains, sample_rows, chunksize, numbers_as_text = False):
+    """
+    Reads a sample of the raw file, and finds the values of each column that fail its check.
+
+    Parameters:
+    input_file (string): Location of the raw file.
+    dtype (dict): Type to read each column as: the float64 columns are checked to parse as numbers.
+    formats (dict): Pattern the values of each text column must match (see RAW_FORMATS).
+    domains (dict): Set of values each text column may have.
+    sample_rows (int): Number of rows to check, or 0 for all of them.
+    chunksize (int): Number of rows per chunk.
+    numbers_as_text (bool): Read the float64 columns as text, and list their values that don't parse,
+                            rather than letting the first of them raise a ValueError.
+
+    Returns:
+    bad (dict): Up to N_EXAMPLES failing values of each check ("numbers", "format" or "domain") and column.
+    """
+    numeric = [col for col, t in dtype.items() if t == "float64"]
+    if numbers_as_text:
+        dtype = {col: "object" for col in dtype}
+    bad = {}
+    for chunk in iter_raw(input_file, dtype, sample_rows, chunksize):
+        for col in numeric if numbers_as_text else []:
+            found = non_numeric(chunk[col])
+            if found:
+                bad.setdefault(("numbers", col), []).extend(found[:N_EXAMPLES])
+        for col, pattern in formats.items():
+            values = pd.Series(chunk[col].dropna().unique(), dtype = object)
+            found = values[~values.str.match(pattern)]
+            if len(found):
+                bad.setdefault(("format", col), []).extend(found[:N_EXAMPLES])
+        for col, values in domains.items():
+            found = set(chunk[col].dropna().unique()) - values
+            if found:
+                bad.setdefault(("domain", col), []).extend(sorted(found)[:N_EXAMPLES])
+    return bad
+
+def validate_raw(input_file, schema = None, sample_rows = DEFAULT_SAMPLE_ROWS, chunksize = DEFAULT_CHUNKSIZE):
+    """
+    Checks a raw file before cleaning it, on a sample (or all) of its rows. Errors are problems that
+    would make cleaning fail or silently misread values: missing columns, values that don't parse in
+    the columns cleaning reads as numbers, and text fields parsed by position that don't match
+    RAW_FORMATS. Warnings are differences from the reference schema that cleaning survives: new
+    columns, and categorical values it didn't have (eg. a new loan_status).
+    The sample is read with the types cleaning reads it with, which is fast; only if that fails is it
+    read again as text, to find the values that don't parse.
+
+    Parameters:
+    input_file (string): Location of the raw file.
+    schema (dict): Reference schema (see infer_schema), or None to run only the checks that don't need one.
+    sample_rows (int): Number of rows to check, or 0 to check the whole file in chunks.
+    chunksize (int): Number of rows per chunk.
+
+    Returns:
+    errors (list): Descriptions of the errors found.
+    warnings (list): Descriptions of the warnings found.
+    """
+    errors, warnings = [], []
+    header = storage.frame_columns(input_file)
+    required = list(clean_dataset.RAW_TEXT_DTYPES) + (schema["columns"] if schema else [])
+    missing = [x for x in dict.fromkeys(required) if x not in header]
+    if missing:
+        errors.append(f"Missing columns: {missing}")
+    if schema:
+        new = [x for x in header if x not in schema["columns"]]
+        if new:
+            warnings.append(f"Columns not in the reference schema: {new}")
+
+    # The columns cleaning reads, with the types it reads them as. 
+    dtype = clean_dataset.raw_read_options(input_file, clean_dataset.settlement_columns())["dtype"]
+    formats = {col: pattern for col, pattern in RAW_FORMATS.items() if col in dtype}
+    domains = {col: set(values) for col, values in (schema or {}).get("domains", {}).items() if col in dtype}
+    dtype = {col: ("float64" if t == "float64" else "object") for col, t in dtype.items()
+             if t == "float64" or col in formats or col in domains}
+
+    try:
+        bad = sample_problems(input_file, dtype, formats, domains, sample_rows, chunksize)
+    except ValueError:
+        logger.info(f"Numeric columns of {input_file} don't parse: reading them as text")
+        bad = sample_problems(input_file, dtype, formats, domains, sample_rows, chunksize, numbers_as_text = True)
+
+    for (check, col), examples in bad.items():
+        examples = list(dict.fromkeys(examples))[:N_EXAMPLES]
+        if check == "numbers":
+            errors.append(f"{col} is read as numbers, but has values {examples}")
+        elif check == "format":
+            errors.append(f"{col} doesn't match {formats[col]!r}: {examples}")
+        else:
+            warnings.append(f"{col} has values not in the reference schema: {examples}")
+    sample = f"the first {sample_rows}" if sample_rows else "all"
+    logger.info(f"Checked {len(dtype)} columns of {sample} rows of {input_file}: "
+                f"{len(errors)} errors, {len(warnings)} warnings")
+    return errors, warnings
+
+def read_schema(schema_file):
+    """
+    Reads a reference schema saved by --save-schema, or returns None if there is none.
+    """
+    if not schema_file or not os.path.exists(schema_file):
+        return None
+    with open(schema_file) as f:
+        return json.load(f)
+
+def check_raw(input_file, schema_file = DEFAULT_SCHEMA, sample_rows = DEFAULT_SAMPLE_ROWS, strict = False):
+    """
+    Validates a raw file (see validate_raw) against the reference schema at schema_file, if there is one,
+    logging the warnings.
+
+    Raises:
+    ValueError: If there are errors (or, with strict, warnings).
+    """
+    schema = read_schema(schema_file)
+    if schema is None:
+        logger.warning(f"No reference schema at {schema_file}: only checking the fields cleaning parses "
+                       "(save one with validate_dataset.py --save-schema)")
+    errors, warnings = validate_raw(input_file, schema, sample_rows)
+    for warning in warnings:
+        logger.warning(warning)
+    if errors or (strict and warnings):
+        raise ValueError(f"{input_file} failed validation: \n" + "\n".join(errors + (warnings if strict else [])))
+
+@click.command()
+@click.argument('input_file', type=click.Path(exists=True))
+@click.option('--schema', 'schema_file', type=click.Path(), default=DEFAULT_SCHEMA, help='Reference schema.')
+@click.option('--sample-rows', type=click.INT, default=DEFAULT_SAMPLE_ROWS,
+              help='Number of rows to check (0 to check every row).')
+@click.option('--strict', is_flag=True, help='Also fail on warnings (new columns or values).')
+@click.option('--save-schema', is_flag=True, help='Save the schema of input_file as the reference instead of checking it.')
+def main(input_file, schema_file, sample_rows, strict, save_schema):
+    """
+    Checks the raw file at input_file before cleaning (see validate_raw), and exits with an error if it
+    would fail to clean. With --save-schema, records its schema as the reference for later files.
+    """
+    if save_schema:
+        schema = infer_schema(input_file, sample_rows)
+        os.makedirs(os.path.dirname(schema_file) or ".", exist_ok = True)
+        with open(schema_file, "w") as f:
+            json.dump(schema, f, indent = 2)
+        logger.info(f"Saved the schema of {input_file} ({len(schema['columns'])} columns, "
+                    f"{len(schema['domains'])} with recorded values) to {schema_file}")
+        return
+    try:
+        check_raw(input_file, schema_file, sample_rows, strict)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
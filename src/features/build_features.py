@@ -7,8 +7,36 @@ from dotenv import find_dotenv, load_dotenv
 import pandas as pd
 import numpy as np
 
+from src import profiling
+from src.data import clean_dataset
+from src.data import storage
+
 logger = logging.getLogger(__name__)
-    
+
+OUTLIER_COLUMNS = ["annual_inc", "revol_bal", "tot_cur_bal", "total_bal_il", "max_bal_bc",
+                   "total_rev_hi_lim", "avg_cur_bal", "bc_open_to_buy", "delinq_amnt", "tot_hi_cred_lim",
+                   "total_bal_ex_mort", "total_bc_limit", "total_il_high_credit_limit"]
+GRADES = ["A", "B", "C", "D", "E", "F", "G"]
+# Categorical columns kept as they are: they are left out of the dense feature matrix, and encoded as a
+# sparse matrix by models trained with --sparse (see encode_features). 
+CATEGORICAL_COLUMNS = ["sub_grade", "home_ownership", "purpose", "addr_state"]
+# Numeric columns only models trained with --sparse use, so that the dense models keep the inputs they 
+# were trained on: the length of the credit history when the loan was issued. 
+SPARSE_ONLY_COLUMNS = ["credit_history_months"]
+# Columns kept for reporting (see visualize) that are never model inputs: the month each loan was issued. 
+REPORT_COLUMNS = ["issue_month"]
+
+def model_columns(columns, categorical = False):
+    """
+    Selects the feature columns of a processed dataset: every column but the target and the 
+    REPORT_COLUMNS, and but the CATEGORICAL_COLUMNS and SPARSE_ONLY_COLUMNS unless categorical is set. 
+    """
+    excluded = {"target", *REPORT_COLUMNS}
+    if not categorical:
+        excluded.update(CATEGORICAL_COLUMNS + SPARSE_ONLY_COLUMNS)
+    return [x for x in columns if x not in excluded]
+
+@profiling.profiled
 def add_features(df):
     """
     Performs feature engineering (adding new columns, numeric column scaling. 
@@ -19,51 +47,64 @@ def add_features(df):
     Returns:
     df (pandas.DataFrame): The input dataframe with added features. 
     """
-    outlier_columns = ["annual_inc", "revol_bal", "tot_cur_bal", "total_bal_il", "max_bal_bc",
-                       "total_rev_hi_lim", "avg_cur_bal", "bc_open_to_buy", "delinq_amnt", "tot_hi_cred_lim",
-                       "total_bal_ex_mort", "total_bc_limit", "total_il_high_credit_limit"]
-    for col in outlier_columns:
-        # Log scaling - add 1 to account for 0 values
-        df[col] = np.log(df[col] + 1)
-        # Alternative: remove values outside the 99th percentile
-        # df = df[df[col] <= df[col].quantile(0.99)]
+    # Log scaling - log1p adds 1 to account for 0 values. Scaling the columns as one 2-D block 
+    # rather than one at a time saves a copy of the dataframe per column. 
+    df[OUTLIER_COLUMNS] = np.log1p(df[OUTLIER_COLUMNS])
+    # Alternative: remove values outside the 99th percentile
+    # df = df[(df[OUTLIER_COLUMNS] <= df[OUTLIER_COLUMNS].quantile(0.99)).all(axis = 1)]
 
-    df["is_grade_a"] = df["grade"].isin(["A"])
-    df["is_grade_a_or_b"] = df["grade"].isin(["A", "B"])
-    df["is_grade_f_or_g"] = df["grade"].isin(["F", "G"])
-    df.grade.replace(to_replace = dict(A=1, B=2, C=3, D=4, E=5, F=6, G=7), inplace = True)
+    # Grades as codes 0 (A) to 6 (G), or -1 if missing: the flags are comparisons of the codes, 
+    # rather than a pass over the strings each. 
+    codes = pd.Categorical(df["grade"], categories = GRADES).codes
+    df["is_grade_a"] = codes == 0
+    df["is_grade_a_or_b"] = (codes >= 0) & (codes <= 1)
+    df["is_grade_f_or_g"] = codes >= 5
+    # Grade as an integer from 1 (A) to 7 (G); missing grades stay missing. 
+    df["grade"] = pd.Series(codes.astype(np.int64) + 1, index = df.index).where(codes >= 0)
     df["is_verified"] = df["verification_status"] != "Not Verified"
     df["loan:income_ratio"] = df["loan_amnt"] / df["annual_inc"]
-    df.drop(columns = ["sub_grade", "home_ownership", "verification_status", "purpose", "addr_state",
-                       "issue_d", "earliest_cr_line", "is_36_month_term"],
-            inplace = True)
+    # Length of the borrower's credit history when the loan was issued, in whole months. 
+    issued, opened = pd.to_datetime(df["issue_d"]), pd.to_datetime(df["earliest_cr_line"])
+    df["credit_history_months"] = ((issued.dt.year - opened.dt.year) * 12 
+                                   + (issued.dt.month - opened.dt.month)).astype(np.float32)
+    df["issue_month"] = issued
+    df.drop(columns = ["verification_status", "issue_d", "earliest_cr_line", "is_36_month_term"], inplace = True)
     
     return df
 
-def build_features_main(input_file, output_file):
+def build_features_main(input_file, output_file, store_dir = None):
     """ 
     Adds features to dataset. 
 
     Parameters:
-    input_file (string): Location of cleaned data as a CSV. 
-    output_file (string): Location to save resulting dataframe. 
+    input_file (string): Location of cleaned data, as Parquet or CSV. 
+    output_file (string): Location to save resulting dataframe, as Parquet or CSV. 
+    store_dir (string): If set, also save the features as a feature store here (see feature_store).
 
     Side effects:
-    Saves dataframe to output_file. 
+    Saves dataframe to output_file, and the feature store to store_dir. 
     """
     logger.info('Adding features to dataset')
-    df = pd.read_csv(input_file, low_memory = False)
-    logger.info(f"Input dataframe shape: {df.shape}")
+    df = storage.read_frame(input_file)
+    logger.info(f"Input dataframe shape: {df.shape}, {clean_dataset.memory_usage_mb(df):.1f} MB")
     df = add_features(df)
-    logger.info(f"Output dataframe shape: {df.shape}")
+    logger.info(f"Output dataframe shape: {df.shape}, {clean_dataset.memory_usage_mb(df):.1f} MB")
     logger.info(f"Saving dataframe to {output_file}")
-    df.to_csv(output_file, index = False)
+    storage.write_frame(df, output_file)
+    if store_dir:
+        # Imported here, as feature_store imports this module. 
+        from src.features import feature_store
+        del df
+        feature_store.build_feature_store(output_file, store_dir)
     
 @click.command()
 @click.argument('input_file')
 @click.argument('output_file')
-def main(input_file, output_file):
-    build_features_main(input_file, output_file)
+@click.option('--feature-store', 'store', is_flag=True, 
+              help='Also save the features as a memory-mapped feature store next to output_file.')
+def main(input_file, output_file, store):
+    from src.features import feature_store
+    build_features_main(input_file, output_file, feature_store.feature_store_path(output_file) if store else None)
     
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
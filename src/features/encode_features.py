@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from src.features import build_features
+
+logger = logging.getLogger(__name__)
+
+# Categorical columns with at most this many categories in the training data are one-hot encoded;
+# columns with more are hashed into HASH_BUCKETS columns, so that the width of the matrix is bounded
+# whatever the cardinality.
+ONE_HOT_MAX_CATEGORIES = 16
+HASH_BUCKETS = 32
+
+def category_codes(values, categories):
+    """
+    Returns the position of each value in categories, or -1 if it is missing or not one of them.
+    """
+    return pd.Categorical(values, categories = categories).codes
+
+def hash_codes(values, n_buckets):
+    """
+    Hashes each value into one of n_buckets buckets, or -1 if it is missing. Each distinct value is
+    hashed once, and the hash is the same in every process and run (unlike Python's hash).
+    """
+    values = pd.Categorical(values)
+    buckets = pd.util.hash_array(np.asarray(values.categories.astype(str), dtype = object)) % np.uint64(n_buckets)
+    codes = values.codes
+    return np.where(codes >= 0, buckets.astype(np.int64)[codes], -1)
+
+def indicator_matrix(codes, width):
+    """
+    Builds the CSR matrix with a 1 in column codes[i] of each row i, and an empty row where codes[i] is -1.
+    The CSR arrays are built directly, since each row holds at most one value.
+    """
+    present = codes >= 0
+    indptr = np.concatenate([[0], np.cumsum(present)])
+    return sparse.csr_matrix((np.ones(present.sum()), codes[present], indptr), shape = (len(codes), width))
+
+class SparseEncoder(BaseEstimator, TransformerMixin):
+    """
+    Encodes a processed dataframe (see build_features) as a sparse CSR matrix, for models that accept
+    sparse input: the numeric columns, with missing values filled with 0 and scaled to [0, 1] over the
+    training data (as MinMaxScaler does in the dense pipeline), then each of the CATEGORICAL_COLUMNS 
+    one-hot encoded or hashed (see ONE_HOT_MAX_CATEGORIES). The indicator columns are 0 or 1 already, 
+    so the matrix needs no further scaling. Categories unseen in training are left out of one-hot 
+    columns. The categoricals are never expanded to dense columns.
+
+    Parameters:
+    max_one_hot (int): Largest number of categories of a one-hot encoded column.
+    hash_buckets (int): Number of columns each hashed column is encoded as.
+    """
+    def __init__(self, max_one_hot = ONE_HOT_MAX_CATEGORIES, hash_buckets = HASH_BUCKETS):
+        self.max_one_hot = max_one_hot
+        self.hash_buckets = hash_buckets
+
+    def fit(self, X, y = None):
+        """
+        Chooses the encoding of each categorical column of X from its categories in X.
+        """
+        categorical = [x for x in X.columns if x in build_features.CATEGORICAL_COLUMNS]
+        self.numeric_columns_ = [x for x in X.columns if x not in categorical]
+        numeric = X[self.numeric_columns_].fillna(0).to_numpy(dtype = np.float64)
+        low, high = numeric.min(axis = 0), numeric.max(axis = 0)
+        # Constant columns are scaled by 1, as MinMaxScaler does. 
+        self.scale_ = 1 / np.where(high > low, high - low, 1)
+        self.offset_ = -low * self.scale_
+        # The categories of each one-hot encoded column, or None for hashed columns.
+        self.categories_ = {}
+        for col in categorical:
+            categories = sorted(X[col].dropna().astype(str).unique())
+            self.categories_[col] = categories if len(categories) <= self.max_one_hot else None
+        self.feature_names_ = list(self.numeric_columns_)
+        for col, categories in self.categories_.items():
+            self.feature_names_ += ([f"{col}={x}" for x in categories] if categories is not None
+                                    else [f"{col}#{i}" for i in range(self.hash_buckets)])
+        logger.info(f"Encoding {len(self.numeric_columns_)} numeric and {len(categorical)} categorical columns "
+                    f"as {len(self.feature_names_)} sparse columns (hashed: "
+                    f"{[x for x, c in self.categories_.items() if c is None]})")
+        return self
+
+    def transform(self, X):
+        """
+        Encodes X as a CSR matrix of len(X) rows and one column per name in feature_names_.
+        """
+        numeric = X[self.numeric_columns_].fillna(0).to_numpy(dtype = np.float64) * self.scale_ + self.offset_
+        blocks = [sparse.csr_matrix(numeric)]
+        for col, categories in self.categories_.items():
+            if categories is not None:
+                blocks.append(indicator_matrix(category_codes(X[col], categories), len(categories)))
+            else:
+                blocks.append(indicator_matrix(hash_codes(X[col], self.hash_buckets), self.hash_buckets))
+        return sparse.hstack(blocks, format = "csr")
+
+    def get_feature_names_out(self, input_features = None):
+        return np.array(self.feature_names_, dtype = object)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.data import storage
+from src.features import build_features
+
+logger = logging.getLogger(__name__)
+
+# A feature store is a directory holding the processed dataset as arrays that can be memory-mapped:
+# the dense feature matrix of the non-categorical columns (float32, missing values filled with 0, as
+# in training), the target, and the column names in matrix order. Training jobs open it without
+# parsing or copying, and jobs on the same machine share it through the page cache.
+FEATURES_FILE = "X.npy"
+TARGET_FILE = "y.npy"
+COLUMNS_FILE = "columns.json"
+FEATURE_STORE_EXTENSION = ".features"
+DEFAULT_CHUNKSIZE = 100000
+
+def feature_store_path(processed_file):
+    """
+    Location of the feature store of a processed dataset, eg. data/processed/loan.features for
+    data/processed/loan.parquet.
+    """
+    return os.path.splitext(processed_file)[0] + FEATURE_STORE_EXTENSION
+
+def is_feature_store(path):
+    """
+    Whether path is a feature store written by build_feature_store.
+    """
+    return os.path.isfile(os.path.join(path, COLUMNS_FILE))
+
+def build_feature_store(input_file, store_dir, chunksize = DEFAULT_CHUNKSIZE):
+    """
+    Writes a processed dataset as a feature store (see FEATURES_FILE). The dataset is read in chunks
+    and copied into memory-mapped arrays, so it never has to fit in memory. The store is written to a
+    temporary directory first, so that a failed run never leaves a partial store behind.
+
+    Parameters:
+    input_file (string): Location of the processed dataset (the output of build_features).
+    store_dir (string): Location of the feature store, eg. data/processed/loan.features.
+    chunksize (int): Number of rows to read per chunk.
+
+    Side effects:
+    Writes store_dir, replacing any store already there.
+    """
+    columns = build_features.model_columns(storage.frame_columns(input_file))
+    n_rows = len(storage.read_frame(input_file, columns = ["target"]))
+    logger.info(f"Writing {n_rows} x {len(columns)} feature matrix of {input_file} to {store_dir}")
+
+    tmp_dir = store_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    os.makedirs(tmp_dir)
+    X = np.lib.format.open_memmap(os.path.join(tmp_dir, FEATURES_FILE), mode = "w+", dtype = np.float32,
+                                  shape = (n_rows, len(columns)))
+    y = np.lib.format.open_memmap(os.path.join(tmp_dir, TARGET_FILE), mode = "w+", dtype = np.int8, shape = (n_rows,))
+    start = 0
+    for df in storage.iter_frame(input_file, chunksize, columns + ["target"]):
+        X[start:start + len(df)] = df[columns].fillna(0).to_numpy(dtype = np.float32)
+        y[start:start + len(df)] = df["target"].to_numpy(dtype = np.int8)
+        start += len(df)
+    X.flush()
+    y.flush()
+    del X, y
+    with open(os.path.join(tmp_dir, COLUMNS_FILE), "w") as f:
+        json.dump({"columns": columns, "rows": n_rows, "source": input_file}, f, indent = 2)
+
+    shutil.rmtree(store_dir, ignore_errors = True)
+    os.replace(tmp_dir, store_dir)
+
+def open_feature_store(store_dir):
+    """
+    Opens a feature store without reading it: the arrays are memory-mapped read-only, so only the
+    rows used are paged in.
+
+    Parameters:
+    store_dir (string): Location of the feature store.
+
+    Returns:
+    X (numpy.memmap): Feature matrix, float32.
+    y (numpy.memmap): Target, int8.
+    columns (list): Names of the columns of X.
+    """
+    logger.info(f"Opening feature store {store_dir}")
+    with open(os.path.join(store_dir, COLUMNS_FILE)) as f:
+        columns = json.load(f)["columns"]
+    X = np.load(os.path.join(store_dir, FEATURES_FILE), mmap_mode = "r")
+    y = np.load(os.path.join(store_dir, TARGET_FILE), mmap_mode = "r")
+    return X, y, columns
+
+def frame(X, columns, rows = None):
+    """
+    Gathers rows of a feature matrix into a dataframe (with one float32 block, so no further copy).
+
+    Parameters:
+    X (numpy.ndarray): Feature matrix, eg. from open_feature_store.
+    columns (list): Names of the columns of X.
+    rows (numpy.ndarray): Positions of the rows to gather, or None for all of them.
+
+    Returns:
+    df (pandas.DataFrame): The rows of X.
+    """
+    return pd.DataFrame(X[rows] if rows is not None else np.asarray(X), columns = columns, copy = False)
+
+@click.command()
+@click.argument('input_file', type=click.Path(exists=True))
+@click.argument('store_dir', type=click.Path(), required=False)
+@click.option('--chunksize', type=click.INT, default=DEFAULT_CHUNKSIZE, help='Number of rows to read per chunk.')
+def main(input_file, store_dir, chunksize):
+    """
+    Writes the processed dataset at input_file as a feature store, by default next to it (eg.
+    data/processed/loan.features), for train_model and evaluate_model to memory-map.
+    """
+    build_feature_store(input_file, store_dir or feature_store_path(input_file), chunksize)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score, confusion_matrix
+from sklearn.model_selection import StratifiedKFold
+
+from src.models import model_bundle
+
+logger = logging.getLogger(__name__)
+
+# Metrics reported for each model; the benchmark table has the mean over folds of each, and the
+# standard deviation of the AUC.
+METRICS = ["auc", "accuracy", "precision", "recall", "fit_time", "predict_time"]
+
+def undersample_indices(y, train_idx, rng):
+    """
+    Undersamples class 0 of the training rows, so there is an equal amount of 0 and 1 class entries
+    (as undersample_dataset does for dataframes).
+
+    Parameters:
+    y (numpy.ndarray): Labels of all rows.
+    train_idx (numpy.ndarray): Positions of the training rows.
+    rng (numpy.random.Generator): Random generator.
+
+    Returns:
+    train_idx (numpy.ndarray): Positions of the undersampled training rows, sorted.
+    """
+    class_0 = train_idx[y[train_idx] == 0]
+    class_1 = train_idx[y[train_idx] == 1]
+    class_0 = rng.choice(class_0, size = min(len(class_0), len(class_1)), replace = False)
+    return np.sort(np.concatenate([class_0, class_1]))
+
+def fit_and_score(model, fold, X, y, train_idx, test_idx, random_state):
+    """
+    Fits one model on one fold and scores it on the fold's test rows. Runs in a worker process.
+
+    Parameters:
+    model (string): One of model_bundle.MODELS.
+    fold (int): Index of the fold.
+    X (numpy.ndarray): Feature matrix of all rows, memory-mapped so that workers share it.
+    y (numpy.ndarray): Labels of all rows.
+    train_idx (numpy.ndarray): Positions of the fold's training rows.
+    test_idx (numpy.ndarray): Positions of the fold's test rows.
+    random_state (int): Random state for undersampling and for the model.
+
+    Returns:
+    scores (dict): The model, fold and METRICS.
+    """
+    # Imported here, as train_model imports this module. 
+    from src.models import train_model
+
+    train_idx = undersample_indices(y, train_idx, np.random.default_rng(random_state + fold))
+    pipeline = model_bundle.make_pipeline(model, random_state)
+    start = time.perf_counter()
+    pipeline.fit(X[train_idx], y[train_idx])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_preds_probs = pipeline.predict_proba(X[test_idx])[:, 1]
+    predict_time = time.perf_counter() - start
+    y_preds = pipeline.classes_[(y_preds_probs > 0.5).astype(int)]
+
+    conf_mat = confusion_matrix(y[test_idx], y_preds, labels = [1, 0])
+    scores = train_model.calc_metrics(conf_mat)
+    scores.update(model = model, fold = fold, auc = roc_auc_score(y[test_idx], y_preds_probs),
+                  fit_time = fit_time, predict_time = predict_time)
+    return scores
+
+def benchmark_models(X, y, models, cv, n_jobs = -1, random_state = None):
+    """
+    Cross-validates several models in parallel: every model/fold combination is fitted in its own
+    job. The feature matrix is written to a memory-mapped file once and shared by all the worker
+    processes, rather than pickled for each job.
+
+    Parameters:
+    X (pandas.DataFrame): Feature matrix, with missing values already filled.
+    y (pandas.Series): Labels.
+    models (list): Names of the models to compare (see model_bundle.MODELS).
+    cv (int): Number of cross-validation folds.
+    n_jobs (int): Number of worker processes, or -1 for one per CPU.
+    random_state (int): Random state for the folds, undersampling and the models.
+
+    Returns:
+    scores (pandas.DataFrame): METRICS for each model and fold.
+    summary (pandas.DataFrame): Mean of METRICS over folds (and standard deviation of the AUC) for
+                                each model, best AUC first.
+    """
+    y = np.asarray(y, dtype = int)
+    folds = list(StratifiedKFold(n_splits = cv, shuffle = True, random_state = random_state).split(X, y))
+    memmap_dir = tempfile.mkdtemp(prefix = "benchmark-")
+    try:
+        memmap_file = os.path.join(memmap_dir, "X.joblib")
+        joblib.dump(np.ascontiguousarray(X.to_numpy(dtype = np.float64)), memmap_file)
+        X_shared = joblib.load(memmap_file, mmap_mode = "r")
+        logger.info(f"Benchmarking {', '.join(models)} on {X_shared.shape} with {cv} folds")
+        scores = joblib.Parallel(n_jobs = n_jobs)(
+            joblib.delayed(fit_and_score)(model, fold, X_shared, y, train_idx, test_idx, random_state)
+            for model in models for fold, (train_idx, test_idx) in enumerate(folds))
+        del X_shared
+    finally:
+        shutil.rmtree(memmap_dir, ignore_errors = True)
+
+    scores = pd.DataFrame(scores)[["model", "fold"] + METRICS]
+    summary = scores.groupby("model")[METRICS].mean()
+    summary.insert(1, "auc_std", scores.groupby("model")["auc"].std())
+    summary = summary.sort_values("auc", ascending = False)
+    return scores, summary
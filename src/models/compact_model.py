@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The compact format holds only the arrays needed to score with a fitted MinMaxScaler and GaussianNB
+# pipeline, so that scoring needs NumPy but not sklearn (or pickle). Bump this whenever the arrays change.
+COMPACT_VERSION = 1
+COMPACT_EXTENSION = ".npz"
+
+def is_compact(filepath):
+    """
+    Whether filepath is a compact model (by its extension) rather than a pickled model bundle.
+    """
+    return str(filepath).lower().endswith(COMPACT_EXTENSION)
+
+def save_compact(bundle, filepath):
+    """
+    Saves the scaler and Gaussian naive Bayes parameters of a model bundle as an uncompressed .npz file.
+
+    Parameters:
+    bundle (dict): A model bundle (see model_bundle) whose pipeline is a MinMaxScaler and a GaussianNB.
+    filepath (string): Location to save the compact model to.
+    """
+    steps = bundle["pipeline"].named_steps
+    scaler, model = steps.get("scaler"), steps["model"]
+    if (list(steps) != ["scaler", "model"] or type(model).__name__ != "GaussianNB" 
+            or type(scaler).__name__ != "MinMaxScaler" or scaler.clip):
+        raise ValueError(f"Only MinMaxScaler and GaussianNB pipelines can be saved as compact models, "
+                         f"not {' and '.join(type(x).__name__ for x in steps.values())}")
+    logger.info(f"Saving compact model to {filepath}")
+    np.savez(filepath, version = COMPACT_VERSION, columns = np.array(bundle["columns"], dtype = str),
+             scale = scaler.scale_, offset = scaler.min_, classes = model.classes_,
+             log_prior = np.log(model.class_prior_), theta = model.theta_, var = model.var_)
+
+def load_compact(filepath):
+    """
+    Loads a compact model saved by save_compact. Everything that doesn't depend on the rows being
+    scored is worked out here, once, so that predict_proba is two matrix products per batch.
+
+    Parameters:
+    filepath (string): Location of the compact model.
+
+    Returns:
+    model (dict): The compact model: "columns", "classes", and the arrays used by predict_proba.
+    """
+    logger.info(f"Loading compact model from {filepath}")
+    with np.load(filepath, allow_pickle = False) as f:
+        arrays = dict(f)
+    if arrays.get("version") != COMPACT_VERSION:
+        raise ValueError(f"{filepath} is not a version {COMPACT_VERSION} compact model: save it again")
+
+    # The Gaussian log likelihood of x for class c is
+    #   log_prior[c] - sum(log(2 pi var[c])) / 2 - sum((x - theta[c]) ** 2 / var[c]) / 2
+    # whose last sum expands to 
+    #   x ** 2 . (1 / var[c]) - 2 x . (theta[c] / var[c]) + sum(theta[c] ** 2 / var[c]).
+    precision = 1 / arrays["var"]
+    return {"version": COMPACT_VERSION, "columns": arrays["columns"].tolist(), "classes": arrays["classes"],
+            "scale": arrays["scale"], "offset": arrays["offset"],
+            "quadratic": -0.5 * precision.T, "linear": (arrays["theta"] * precision).T,
+            "constant": (arrays["log_prior"] - 0.5 * np.log(2 * np.pi * arrays["var"]).sum(axis = 1)
+                         - 0.5 * (arrays["theta"] ** 2 * precision).sum(axis = 1))}
+
+def predict_proba(model, X):
+    """
+    Predicts class probabilities with a compact model, as the saved pipeline's predict_proba would.
+
+    Parameters:
+    model (dict): The compact model (see load_compact).
+    X (numpy.ndarray): Feature matrix, with the model's columns in order and missing values filled.
+
+    Returns:
+    probs (numpy.ndarray): Probability of each class (in the order of model["classes"]) for each row.
+    """
+    X = X * model["scale"] + model["offset"]
+    jll = (X ** 2) @ model["quadratic"] + X @ model["linear"] + model["constant"]
+    jll -= jll.max(axis = 1, keepdims = True)
+    probs = np.exp(jll)
+    probs /= probs.sum(axis = 1, keepdims = True)
+    return probs
+
+@click.command()
+@click.argument('model_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+def main(model_filepath, output_filepath):
+    """
+    Converts a model bundle saved by train_model to a compact model, which predict_model and
+    serve_model can score without importing sklearn.
+
+    Parameters:
+    model_filepath (string): Filepath of the trained model bundle.
+    output_filepath (string): Filepath of the compact model, ending in .npz.
+    """
+    # Imported here, as model_bundle imports this module. 
+    from src.models import model_bundle
+    save_compact(model_bundle.load_bundle(model_filepath), output_filepath)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from src.data import storage
+from src.features import feature_store
+from src.models import model_bundle
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_THRESHOLDS = 1001
+DEFAULT_N_BOOTSTRAP = 200
+# Bootstrap samples are drawn this many at a time, so that memory use is BOOTSTRAP_BATCH x test rows.
+BOOTSTRAP_BATCH = 20
+CONFIDENCE = 0.95
+SWEEP_METRICS = ["precision", "recall", "accuracy", "lift", "expected_loss"]
+
+def sorted_scores(y_true, probs):
+    """
+    Sorts the test rows by predicted probability, highest first: the rows predicted positive at any
+    threshold are then a prefix of the sorted rows.
+
+    Returns:
+    y (numpy.ndarray): Labels (0 or 1), sorted.
+    probs (numpy.ndarray): Probabilities, sorted.
+    """
+    order = np.argsort(-probs, kind = "stable")
+    return np.asarray(y_true, dtype = np.int8)[order], np.asarray(probs, dtype = float)[order]
+
+def n_predicted_positive(sorted_probs, thresholds):
+    """
+    Number of rows with a probability above each threshold (rows are labelled positive above it, as in
+    predict_model.predict_labels).
+    """
+    return len(sorted_probs) - np.searchsorted(sorted_probs[::-1], thresholds, side = "right")
+
+def auc_from_counts(tp, fp):
+    """
+    Area under the ROC curve from the cumulative true and false positive counts at each distinct
+    probability (last axis), as the trapezoidal rule over the ROC curve (so tied probabilities are
+    handled as in sklearn's roc_auc_score).
+    """
+    tp = np.concatenate([np.zeros(tp.shape[:-1] + (1,)), tp], axis = -1)
+    fp = np.concatenate([np.zeros(fp.shape[:-1] + (1,)), fp], axis = -1)
+    area = ((fp[..., 1:] - fp[..., :-1]) * (tp[..., 1:] + tp[..., :-1]) / 2).sum(axis = -1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return area / (tp[..., -1] * fp[..., -1])
+
+def sweep_from_counts(tp, fp, n_pos, n, cost_fp, cost_fn):
+    """
+    Metrics at each threshold from the true and false positive counts there. Counts may be weighted,
+    and may have leading (bootstrap sample) axes.
+
+    Returns:
+    metrics (dict): Each of SWEEP_METRICS at each threshold. Precision and lift are NaN where no row is
+                    predicted positive.
+    """
+    fn = n_pos[..., None] - tp
+    tn = (n - n_pos)[..., None] - fp
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        precision = tp / (tp + fp)
+        return {"precision": precision, "recall": tp / n_pos[..., None], "accuracy": (tp + tn) / n[..., None],
+                "lift": precision / (n_pos / n)[..., None],
+                "expected_loss": (cost_fp * fp + cost_fn * fn) / n[..., None]}
+
+def threshold_sweep(y_true, probs, thresholds = None, cost_fp = 1.0, cost_fn = 1.0, n_bootstrap = 0,
+                    random_state = None):
+    """
+    Evaluates a model's test predictions at many thresholds at once. The rows are sorted by probability
+    once; the confusion matrix at every threshold then comes from cumulative sums of the sorted labels,
+    rather than from a pass over the rows per threshold.
+    Confidence intervals are computed by bootstrapping: each bootstrap sample weights the sorted rows by
+    how many times they are drawn, so samples need no sorting of their own, and are computed
+    BOOTSTRAP_BATCH at a time as 2-D arrays.
+
+    Parameters:
+    y_true (numpy.ndarray): Labels of the test rows (1 for default).
+    probs (numpy.ndarray): Predicted probability of default of the test rows.
+    thresholds (numpy.ndarray): Thresholds to evaluate; DEFAULT_N_THRESHOLDS from 0 to 1 by default.
+    cost_fp (float): Cost of labelling a loan that is repaid as a default, for the expected loss.
+    cost_fn (float): Cost of labelling a loan that defaults as repaid.
+    n_bootstrap (int): Number of bootstrap samples for confidence intervals, or 0 for none.
+    random_state (int): Random state of the bootstrap samples.
+
+    Returns:
+    sweep (pandas.DataFrame): Fraction of rows predicted positive and SWEEP_METRICS at each threshold,
+                              with their lower and upper CONFIDENCE bounds (eg. recall_low, recall_high).
+    summary (dict): The AUC (and its confidence interval), the base rate, and the threshold with
+                    the lowest expected loss.
+    """
+    if thresholds is None:
+        thresholds = np.linspace(0, 1, DEFAULT_N_THRESHOLDS)
+    y, probs = sorted_scores(y_true, probs)
+    n = np.array(len(y), dtype = float)
+    k = n_predicted_positive(probs, thresholds)
+    # Counts after the last row of each group of tied probabilities, for the ROC curve.
+    distinct = np.flatnonzero(np.r_[probs[1:] != probs[:-1], True])
+
+    tp_all = np.concatenate([[0], np.cumsum(y)])
+    fp_all = np.arange(len(y) + 1) - tp_all
+    n_pos = np.array(tp_all[-1], dtype = float)
+    sweep = pd.DataFrame({"threshold": thresholds, "predicted_positive": k / n})
+    sweep = sweep.assign(**sweep_from_counts(tp_all[k], fp_all[k], n_pos, n, cost_fp, cost_fn))
+    auc = float(auc_from_counts(tp_all[distinct + 1], fp_all[distinct + 1]))
+    summary = {"n": int(n), "base_rate": float(n_pos / n), "auc": auc}
+
+    if n_bootstrap:
+        rng = np.random.default_rng(random_state)
+        samples = {x: [] for x in SWEEP_METRICS + ["auc"]}
+        for start in range(0, n_bootstrap, BOOTSTRAP_BATCH):
+            b = min(BOOTSTRAP_BATCH, n_bootstrap - start)
+            draws = rng.integers(0, len(y), size = (b, len(y))) + len(y) * np.arange(b)[:, None]
+            weights = np.bincount(draws.ravel(), minlength = b * len(y)).reshape(b, len(y))
+            tp = np.concatenate([np.zeros((b, 1)), np.cumsum(weights * y, axis = 1)], axis = 1)
+            fp = np.concatenate([np.zeros((b, 1)), np.cumsum(weights, axis = 1)], axis = 1) - tp
+            n_pos_b = tp[:, -1]
+            n_b = np.full(b, n)
+            metrics = sweep_from_counts(tp[:, k], fp[:, k], n_pos_b, n_b, cost_fp, cost_fn)
+            metrics["auc"] = auc_from_counts(tp[:, distinct + 1], fp[:, distinct + 1])
+            for metric, values in metrics.items():
+                samples[metric].append(values)
+        tails = [(1 - CONFIDENCE) / 2 * 100, (1 + CONFIDENCE) / 2 * 100]
+        with warnings.catch_warnings():
+            # Precision is NaN in every sample at thresholds above the highest probability. 
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for metric in SWEEP_METRICS:
+                low, high = np.nanpercentile(np.concatenate(samples[metric]), tails, axis = 0)
+                sweep[f"{metric}_low"], sweep[f"{metric}_high"] = low, high
+            low, high = np.nanpercentile(np.concatenate(samples["auc"]), tails)
+        summary.update(auc_low = float(low), auc_high = float(high))
+        summary["n_bootstrap"] = n_bootstrap
+
+    best = sweep["expected_loss"].idxmin()
+    summary.update(cost_fp = cost_fp, cost_fn = cost_fn, best_threshold = float(sweep.loc[best, "threshold"]),
+                   best_expected_loss = float(sweep.loc[best, "expected_loss"]))
+    return sweep, summary
+
+def evaluation_paths(model_filepath):
+    """
+    Locations of the threshold sweep (CSV) and summary (JSON) saved next to a model.
+    """
+    stem = os.path.splitext(model_filepath)[0]
+    return f"{stem}-evaluation.csv", f"{stem}-evaluation.json"
+
+def save_evaluation(sweep, summary, model_filepath):
+    """
+    Saves a threshold sweep and its summary (see threshold_sweep) next to the model they evaluate.
+
+    Side effects:
+    Writes <model>-evaluation.csv and <model>-evaluation.json.
+    """
+    sweep_path, summary_path = evaluation_paths(model_filepath)
+    sweep.to_csv(sweep_path, index = False, float_format = "%.6g")
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent = 2)
+    interval = f" ({summary['auc_low']:.3f} to {summary['auc_high']:.3f})" if "auc_low" in summary else ""
+    logger.info(f"AUC {summary['auc']:.3f}{interval}, lowest expected loss {summary['best_expected_loss']:.3f} "
+                f"at threshold {summary['best_threshold']:.3f}")
+    logger.info(f"Threshold sweep saved to {sweep_path} and {summary_path}")
+
+def test_rows(n_rows):
+    """
+    Positions of the rows train_model holds out for testing from a dataset of n_rows rows (the split
+    of train_model.data_from_dataset and data_from_feature_store), sorted.
+    """
+    # Imported here: train_model imports this module.
+    from src.models import train_model
+    _, test_idx = train_test_split(np.arange(n_rows), random_state = train_model.RANDOM_STATE,
+                                   test_size = train_model.TEST_SIZE)
+    return np.sort(test_idx)
+
+@click.command()
+@click.argument('model_filepath', type=click.Path(exists=True))
+@click.argument('data_filepath', type=click.Path(exists=True))
+@click.option('--thresholds', 'n_thresholds', type=click.INT, default=DEFAULT_N_THRESHOLDS,
+              help='Number of thresholds from 0 to 1 to evaluate.')
+@click.option('--bootstrap', 'n_bootstrap', type=click.INT, default=DEFAULT_N_BOOTSTRAP,
+              help='Number of bootstrap samples for confidence intervals (0 for none).')
+@click.option('--cost-fp', type=click.FLOAT, default=1.0, help='Cost of labelling a repaid loan as a default.')
+@click.option('--cost-fn', type=click.FLOAT, default=1.0, help='Cost of labelling a defaulted loan as repaid.')
+@click.option('--seed', type=click.INT, default=10, help='Random seed for bootstrapping.')
+@click.option('--held-out', is_flag=True, 
+              help='DATA was not used in training: evaluate every row, rather than the rows train_model tested on.')
+def main(model_filepath, data_filepath, n_thresholds, n_bootstrap, cost_fp, cost_fn, seed, held_out):
+    """
+    Evaluates a trained model on a labelled, processed dataset at many thresholds, and saves the
+    sweep next to the model.
+    By default data_filepath is taken to be the dataset the model was trained on, and only the rows 
+    train_model held out for testing are evaluated (see test_rows), so that the metrics aren't 
+    inflated by the training rows. Models trained with --chunksize split rows differently: evaluate 
+    them on held-out data only. 
+
+    Parameters:
+    model_filepath (string): Filepath of the trained model (see train_model).
+    data_filepath (string): Filepath of processed observations with a target column, or of a feature
+                            store (see feature_store).
+    held_out (bool): data_filepath holds no training rows: evaluate all of it.
+    """
+    bundle = model_bundle.load_bundle(model_filepath)
+    if feature_store.is_feature_store(data_filepath):
+        X, y, columns = feature_store.open_feature_store(data_filepath)
+        missing = sorted(set(bundle["columns"]) - set(columns))
+        if missing:
+            raise click.UsageError(f"The feature store has no {missing} columns: evaluate on the processed dataset")
+        rows = None if held_out else test_rows(len(y))
+        df, y = feature_store.frame(X, columns, rows), np.asarray(y if held_out else y[rows])
+    else:
+        df = storage.read_frame(data_filepath, columns = list(bundle["columns"]) + ["target"])
+        if not held_out:
+            df = df.iloc[test_rows(len(df))]
+        y = df["target"]
+    logger.info(f"Evaluating {len(df)} rows" + ("" if held_out else " held out from training (see --held-out)"))
+    probs = model_bundle.predict_proba(bundle, df)
+    sweep, summary = threshold_sweep(np.asarray(y, dtype = int), probs, 
+                                     np.linspace(0, 1, n_thresholds), cost_fp, cost_fn, n_bootstrap, seed)
+    save_evaluation(sweep, summary, model_filepath)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
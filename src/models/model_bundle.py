@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import importlib
+import logging
+import pickle
+
+from src.models import compact_model
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the contents of the bundle change, so that old bundles are rejected on load
+# rather than failing part way through scoring.
+BUNDLE_VERSION = 1
+
+def lazy_estimator(module, name, **params):
+    """
+    Returns a function creating the sklearn estimator module.name with params. sklearn is only imported
+    when the function is called, so that scoring a compact model (see compact_model) never imports it.
+    """
+    def make_estimator():
+        return getattr(importlib.import_module(module), name)(**params)
+    return make_estimator
+
+# Models that can be trained, by the short names used on the command line. 
+MODELS = {"lr": lazy_estimator("sklearn.linear_model", "LogisticRegression", max_iter = 1000), 
+          "dt": lazy_estimator("sklearn.tree", "DecisionTreeClassifier"), 
+          "rf": lazy_estimator("sklearn.ensemble", "RandomForestClassifier", n_jobs = 1), 
+          "gnb": lazy_estimator("sklearn.naive_bayes", "GaussianNB"), 
+          "sgd": lazy_estimator("sklearn.linear_model", "SGDClassifier", loss = "log_loss")}
+DEFAULT_MODEL = "gnb"
+# Models that can be trained on the sparse encoding of the categorical columns (see encode_features). 
+SPARSE_MODELS = ["dt", "lr", "rf"]
+# Models that can be trained out of core, with partial_fit (see train_model.train_streaming). 
+STREAMING_MODELS = ["gnb", "sgd"]
+
+def make_pipeline(model = DEFAULT_MODEL, random_state = None, sparse = False):
+    """
+    Creates the (unfitted) preprocessing and model pipeline: scale every column to [0, 1], then
+    fit the model (a Gaussian naive Bayes model by default).
+    With sparse, the categorical columns are kept: the pipeline encodes the dataframe as a sparse matrix
+    (see encode_features.SparseEncoder), which also scales the numeric columns, then fits the model. 
+
+    Parameters:
+    model (string): One of MODELS (one of SPARSE_MODELS, with sparse).
+    random_state (int): Random state of the model, for models that take one.
+    sparse (bool): Whether to encode the categorical columns as a sparse matrix.
+
+    Returns:
+    pipeline (sklearn.pipeline.Pipeline): The unfitted pipeline.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model}, expected one of {sorted(MODELS)}")
+    if sparse and model not in SPARSE_MODELS:
+        raise ValueError(f"{model} can't be trained on sparse input, expected one of {SPARSE_MODELS}")
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import MinMaxScaler
+    estimator = MODELS[model]()
+    if "random_state" in estimator.get_params():
+        estimator.set_params(random_state = random_state)
+    if sparse:
+        from src.features import encode_features
+        return Pipeline([("encoder", encode_features.SparseEncoder()), ("model", estimator)])
+    return Pipeline([("scaler", MinMaxScaler()), ("model", estimator)])
+
+def make_bundle(pipeline, columns):
+    """
+    Packages a fitted pipeline with the column order it was trained on.
+
+    Parameters:
+    pipeline (sklearn.pipeline.Pipeline): The fitted pipeline.
+    columns (list): Names of the feature columns, in training order.
+
+    Returns:
+    bundle (dict): The model bundle.
+    """
+    return {"version": BUNDLE_VERSION, "columns": list(columns), "pipeline": pipeline}
+
+def save_bundle(bundle, filepath):
+    """
+    Saves a model bundle to filepath: as a compact model (see compact_model) if filepath ends in .npz,
+    otherwise pickled.
+    """
+    if compact_model.is_compact(filepath):
+        compact_model.save_compact(bundle, filepath)
+        return
+    logger.info(f"Saving model bundle to {filepath}")
+    with open(filepath, 'wb') as f:
+        pickle.dump(bundle, f)
+
+def load_bundle(filepath):
+    """
+    Loads a model bundle saved by save_bundle.
+
+    Parameters:
+    filepath (string): Location of the saved bundle.
+
+    Returns:
+    bundle (dict): The model bundle, or the compact model (see compact_model.load_compact) if filepath
+                   ends in .npz. Both can be passed to predict_proba.
+    """
+    if compact_model.is_compact(filepath):
+        return compact_model.load_compact(filepath)
+    logger.info(f"Loading model bundle from {filepath}")
+    with open(filepath, 'rb') as f:
+        bundle = pickle.load(f)
+    if not isinstance(bundle, dict) or bundle.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"{filepath} is not a version {BUNDLE_VERSION} model bundle: retrain with train_model")
+    return bundle
+
+def features_from_frame(df, bundle):
+    """
+    Selects the bundle's feature columns from df, in training order, and fills missing values
+    the same way as in training.
+
+    Parameters:
+    df (pandas.DataFrame): Processed observations (the output of build_features).
+    bundle (dict): The model bundle.
+
+    Returns:
+    X (pandas.DataFrame): The feature matrix to pass to the pipeline.
+    """
+    X = df[bundle["columns"]]
+    if "pipeline" in bundle and "encoder" in bundle["pipeline"].named_steps:
+        # The encoder fills missing values itself (categorical columns can't be filled with 0).
+        return X
+    return X.fillna(0)
+
+def predict_proba(bundle, df):
+    """
+    Predicts the probability of default for each row of df.
+
+    Parameters:
+    bundle (dict): The model bundle, or a compact model.
+    df (pandas.DataFrame): Processed observations (the output of build_features).
+
+    Returns:
+    probs (numpy.ndarray): Probability of the positive (default) class for each row.
+    """
+    if "pipeline" not in bundle:
+        return compact_model.predict_proba(bundle, features_from_frame(df, bundle).to_numpy(dtype = float))[:, 1]
+    return bundle["pipeline"].predict_proba(features_from_frame(df, bundle))[:, 1]
+
+def classes(bundle):
+    """
+    Returns the classes predicted by a model bundle (or compact model), in the order of predict_proba.
+    """
+    return bundle["classes"] if "pipeline" not in bundle else bundle["pipeline"].classes_
@@ -4,48 +4,205 @@ import logging
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 import os
-import subprocess
-from sklearn.metrics import roc_auc_score, confusion_matrix
-from sklearn.naive_bayes import GaussianNB
-from sklearn.preprocessing import MinMaxScaler
-import pickle
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 
+from src import profiling
+from src.data import storage
+from src.models import model_bundle
+from src.models import validate_features
+
 logger = logging.getLogger(__name__)
 
-def normalize_df(df):
+# Formats of bulk prediction output (see score_batches), keyed by file extension.
+PREDICTION_FORMATS = {".csv": "csv", ".parquet": "parquet", ".npy": "npy"}
+PREDICTION_COLUMNS = ["id", "probability", "label"]
+
+def predict_labels(bundle, probs, threshold = 0.5):
+    """
+    Labels observations from their predicted probability of default.
+
+    Parameters:
+    bundle (dict): The model bundle.
+    probs (numpy.ndarray): Probability of the positive (default) class, see model_bundle.predict_proba.
+    threshold (float): Observations with a probability above this are labelled positive. At 0.5 the 
+                       labels are those of pipeline.predict.
+
+    Returns:
+    labels (numpy.ndarray): Class of each observation.
+    """
+    return model_bundle.classes(bundle)[(probs > threshold).astype(int)]
+
+def score_batch(bundle, df, start, threshold, id_column):
+    """
+    Predicts one batch of observations. Runs in a worker thread.
+
+    Parameters:
+    bundle (dict): The model bundle.
+    df (pandas.DataFrame): Processed observations.
+    start (int): Position of the batch's first row in the input, used as the id if there is no id_column.
+    threshold (float): Probability threshold for the labels (see predict_labels).
+    id_column (string): Column of df identifying each observation.
+
+    Returns:
+    predictions (pandas.DataFrame): PREDICTION_COLUMNS for each row of df.
+    """
+    ids = df[id_column].to_numpy() if id_column in df else np.arange(start, start + len(df))
+    probs = model_bundle.predict_proba(bundle, df)
+    return pd.DataFrame({"id": ids, "probability": probs, "label": predict_labels(bundle, probs, threshold)})
+
+@contextmanager
+def npy_writer(path):
     """
-    Normalize all numeric columns in the dataframe to be between 0 and 1. 
+    Opens path for writing a NumPy .npy file of records in chunks. The total number of rows, which 
+    goes in the file's header, is only known at the end, so the records are first written to a 
+    temporary file, then copied after the header.
+
+    Returns:
+    write (function): Context manager yielding a function that appends a dataframe chunk to path.
+    """
+    state = {"dtype": None, "n_rows": 0}
+    data_path = path + ".part"
+    try:
+        with open(data_path, "wb") as data:
+            def write(df):
+                records = df.to_records(index = False)
+                if state["dtype"] is None:
+                    state["dtype"] = records.dtype
+                data.write(records.astype(state["dtype"], copy = False).tobytes())
+                state["n_rows"] += len(records)
+            yield write
+
+        dtype = state["dtype"] if state["dtype"] is not None else np.dtype([(x, "f8") for x in PREDICTION_COLUMNS])
+        header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (state["n_rows"],)}
+        with open(path, "wb") as f, open(data_path, "rb") as data:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(data, f, 16 * 1024 ** 2)
+    finally:
+        if os.path.exists(data_path):
+            os.remove(data_path)
+
+def prediction_writer(path):
+    """
+    Opens path for writing predictions in chunks, as CSV, Parquet or .npy (see PREDICTION_FORMATS).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in PREDICTION_FORMATS:
+        raise ValueError(f"Unknown prediction format for {path}: expected one of {', '.join(PREDICTION_FORMATS)}")
+    if PREDICTION_FORMATS[ext] == "npy":
+        return npy_writer(path)
+    return storage.frame_writer(path)
+
+def score_batches(bundle, input_file, output_file, batch_size, threshold = 0.5, jobs = 1, id_column = "id"):
+    """
+    Predicts a file of observations in batches, so that it never has to fit in memory, and writes
+    the id, probability of default and label of each row to output_file as the batches complete.
+    With several jobs, batches are predicted in a thread pool while the next ones are read; at most 
+    two batches per thread are held in memory at once, and the output keeps the order of the input.
+
+    Parameters:
+    bundle (dict): The model bundle.
+    input_file (string): Location of the processed observations, as Parquet or CSV.
+    output_file (string): Location to write the predictions, as CSV, Parquet or .npy.
+    batch_size (int): Number of rows per batch.
+    threshold (float): Probability threshold for the labels (see predict_labels).
+    jobs (int): Number of threads to predict with.
+    id_column (string): Column of the input identifying each observation. If the input doesn't have
+                        it, rows are identified by their position in the input, from 0.
+
+    Returns:
+    n_rows (int): Number of rows predicted.
+
+    Side effects:
+    Writes output_file.
     """
-    scaler = MinMaxScaler()
-    df = pd.DataFrame(scaler.fit_transform(df.values), 
-                       columns=df.columns, index=df.index)
-    return df
+    columns = list(bundle["columns"])
+    if id_column in storage.frame_columns(input_file) and id_column not in columns:
+        columns.append(id_column)
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok = True)
+    n_rows = 0
+    with prediction_writer(output_file) as write, ThreadPoolExecutor(max_workers = jobs) as pool:
+        pending = deque()
+        for df in storage.iter_frame(input_file, batch_size, columns):
+            pending.append(pool.submit(score_batch, bundle, df, n_rows, threshold, id_column))
+            n_rows += len(df)
+            if len(pending) >= 2 * jobs:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    logger.info(f"Predicted {n_rows} rows in batches of {batch_size}")
+    return n_rows
 
 @click.command()
 @click.argument('model_filepath', type=click.Path(exists = True))
 @click.argument('data_to_predict', type=click.Path(exists = True))
 @click.argument('predictions_output', type=click.Path())
-def main(model_filepath, data_to_predict, predictions_output):
+@click.option('--batch-size', type=click.INT, default=None, 
+              help='Predict in batches of this many rows, and write the id, probability and label of each row.')
+@click.option('--jobs', type=click.INT, default=1, help='Number of threads to predict batches with.')
+@click.option('--threshold', type=click.FLOAT, default=0.5, 
+              help='Label observations with a probability of default above this as defaults.')
+@click.option('--id-column', default='id', help='Column identifying each observation, for --batch-size.')
+@click.option('--drift/--no-drift', default=True, 
+              help='Measure how far each feature has drifted from the training data before scoring.')
+@click.option('--max-psi', type=click.FLOAT, default=None, 
+              help='Refuse to score if any feature has drifted beyond this population stability index.')
+@click.option('--profile', is_flag=True, 
+              help='Record the time and memory of each step, and write a report to reports/profiles.')
+@click.option('--profile-stage', default=None, 
+              help='With --profile, also run this step (eg. fix_dtypes) under a profiler.')
+@click.option('--profiler', type=click.Choice(profiling.PROFILERS), default='cprofile', 
+              help='Profiler for --profile-stage.')
+def main(model_filepath, data_to_predict, predictions_output, batch_size, jobs, threshold, id_column, drift, max_psi, 
+         profile, profile_stage, profiler):
     """ 
     Predicts class of new observations using trained model, and saves predictions to predictions_output. 
 
     Parameters:
-    model_filepath (string): Filepath of trained model. 
+    model_filepath (string): Filepath of trained model bundle (see train_model). 
     data_to_predict (string): Filepath of new observations. 
-    predictions_output (string): Filepath to save predictions. 
+    predictions_output (string): Filepath to save predictions. With batch_size, this may be CSV, 
+                                 Parquet or .npy.
+    batch_size (int): If set, predict in batches (see score_batches) rather than all at once.
+    jobs (int): Number of threads to predict batches with.
+    threshold (float): Probability threshold for the labels (see predict_labels).
+    id_column (string): Column identifying each observation in the batch output.
+    drift (bool): Measure the drift of each feature on a sample of the input first (see validate_features).
+    max_psi (float): If set, fail without scoring if any feature's PSI is above this.
+    profile (bool): Record the time and memory of each step (see profiling).
+    profile_stage (string): Step to run under a profiler, eg. predict.
+    profiler (string): Profiler for profile_stage.
 
     Side effects:
     Saves predictions to predictions_output. 
     """
     logger.info(f"Predicting file {data_to_predict} from model at {model_filepath}")
-    model = pickle.load(open(model_filepath, 'rb'))
-    df_to_predict = pd.read_csv(data_to_predict, low_memory = False)
-    normalized = normalize_df(df_to_predict)
-    predictions = model.predict(normalize_df(df_to_predict))
+    if profile:
+        profiling.enable(profile_stage = profile_stage, profiler = profiler)
+    bundle = model_bundle.load_bundle(model_filepath)
+    # The columns, types and drift are checked on a sample, so a bad batch fails before it is scored. 
+    with profiling.stage("validate"):
+        try:
+            validate_features.check_input(bundle, model_filepath, data_to_predict, max_psi, drift)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    if batch_size:
+        with profiling.stage("predict"):
+            score_batches(bundle, data_to_predict, predictions_output, batch_size, threshold, jobs, id_column)
+        profiling.write_report("predict_model")
+        return
+    # Only the columns the model was trained on are read; the scaler fitted in training is reused,
+    # so predictions don't depend on what else is in the file. 
+    df_to_predict = storage.read_frame(data_to_predict, columns = bundle["columns"])
+    with profiling.stage("predict", df_to_predict):
+        predictions = predict_labels(bundle, model_bundle.predict_proba(bundle, df_to_predict), threshold)
     logger.info(f"Saving predictions to {predictions_output}")
     np.savetxt(predictions_output, predictions, delimiter = ',', fmt="%i")
+    profiling.write_report("predict_model")
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
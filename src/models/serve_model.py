@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+import pandas as pd
+
+from src.features import build_features
+from src.models import model_bundle
+
+logger = logging.getLogger(__name__)
+
+def score_records(bundle, records):
+    """
+    Scores cleaned loan records (ie. rows as output by clean_dataset) with the model bundle.
+
+    Parameters:
+    bundle (dict): The model bundle (see model_bundle).
+    records (list): List of dicts, one per loan.
+
+    Returns:
+    probs (numpy.ndarray): Probability of default for each record.
+    """
+    df = build_features.add_features(pd.DataFrame.from_records(records))
+    return model_bundle.predict_proba(bundle, df)
+
+def batch_worker(bundle, pending, max_batch_size, max_wait):
+    """
+    Collects concurrent scoring requests into micro-batches, so that one predict_proba call
+    serves many requests. Runs forever; start it in a daemon thread.
+
+    Parameters:
+    bundle (dict): The model bundle.
+    pending (queue.Queue): Queue of (records, future) pairs put there by the request handlers.
+    max_batch_size (int): Maximum number of records to score in one call.
+    max_wait (float): Maximum time in seconds to wait for more requests once one has arrived.
+    """
+    while True:
+        batch = [pending.get()]
+        n_records = len(batch[0][0])
+        deadline = time.monotonic() + max_wait
+        while n_records < max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout = timeout))
+            except queue.Empty:
+                break
+            n_records += len(batch[-1][0])
+
+        try:
+            probs = score_records(bundle, [record for records, _ in batch for record in records])
+        except Exception:
+            # Score requests one at a time, so that one bad request doesn't fail the whole batch.
+            for records, future in batch:
+                try:
+                    future.set_result(score_records(bundle, records))
+                except Exception as e:
+                    future.set_exception(e)
+            continue
+        start = 0
+        for records, future in batch:
+            future.set_result(probs[start:start + len(records)])
+            start += len(records)
+
+class ScoringServer(ThreadingHTTPServer):
+    # The default listen backlog (5) resets connections under bursts of concurrent requests. 
+    request_queue_size = 128
+    daemon_threads = True
+
+def make_handler(pending, timeout):
+    """
+    Creates the HTTP request handler class, bound to the queue of pending requests.
+
+    Endpoints:
+    GET /health: Returns {"status": "ok"}.
+    POST /predict: Takes a cleaned loan record, or a list of them (optionally as {"loans": [...]}),
+                   and returns {"probabilities": [...]} with one probability of default per loan.
+    """
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path != "/health":
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            self.send_json(200, {"status": "ok"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError as e:
+                self.send_json(400, {"error": f"Invalid JSON: {e}"})
+                return
+            records = body.get("loans", body) if isinstance(body, dict) else body
+            records = [records] if isinstance(records, dict) else records
+            if not records:
+                self.send_json(200, {"probabilities": []})
+                return
+
+            future = Future()
+            pending.put((records, future))
+            try:
+                probs = future.result(timeout = timeout)
+            except Exception as e:
+                self.send_json(400, {"error": f"{type(e).__name__}: {e}"})
+                return
+            self.send_json(200, {"probabilities": probs.tolist()})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ScoringHandler
+
+@click.command()
+@click.argument('model_filepath', type=click.Path(exists = True))
+@click.option('--host', default='127.0.0.1', help='Address to listen on.')
+@click.option('--port', type=click.INT, default=8080, help='Port to listen on.')
+@click.option('--max-batch-size', type=click.INT, default=256,
+              help='Maximum number of loans to score in one call to the model.')
+@click.option('--max-wait-ms', type=click.FLOAT, default=2.0,
+              help='How long to wait for more requests to batch together, in milliseconds.')
+@click.option('--timeout', type=click.FLOAT, default=10.0, help='Request timeout, in seconds.')
+def main(model_filepath, host, port, max_batch_size, max_wait_ms, timeout):
+    """
+    Serves predictions from a trained model over HTTP.
+    The model bundle is loaded once at startup, and concurrent requests are scored together in
+    micro-batches.
+
+    Parameters:
+    model_filepath (string): Filepath of trained model bundle (see train_model).
+    host (string): Address to listen on.
+    port (int): Port to listen on.
+    max_batch_size (int): Maximum number of loans to score in one call to the model.
+    max_wait_ms (float): How long to wait for more requests to batch together.
+    timeout (float): How long a request waits for its predictions before failing.
+    """
+    bundle = model_bundle.load_bundle(model_filepath)
+    pending = queue.Queue()
+    worker = threading.Thread(target = batch_worker, 
+                              args = (bundle, pending, max_batch_size, max_wait_ms / 1000), daemon = True)
+    worker.start()
+
+    server = ScoringServer((host, port), make_handler(pending, timeout))
+    logger.info(f"Serving predictions from {model_filepath} on http://{host}:{port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
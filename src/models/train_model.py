@@ -6,39 +6,58 @@ from dotenv import find_dotenv, load_dotenv
 import os
 import subprocess
 from sklearn.metrics import roc_auc_score, confusion_matrix
-from sklearn.naive_bayes import GaussianNB
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler
-import pickle
+import numpy as np
 import pandas as pd
 
+from src import profiling
+from src.data import storage
+from src.features import build_features
+from src.features import feature_store
+from src.models import benchmark_models
+from src.models import evaluate_model
+from src.models import model_bundle
+from src.models import validate_features
+
 logger = logging.getLogger(__name__)
 
 RANDOM_STATE = 10
+TEST_SIZE = 0.1
 
-def data_from_dataset(filename):
+def data_from_dataset(filename, categorical = False):
     """
-    Reads data from CSV and split to train/test. 
+    Reads data from Parquet or CSV and split to train/test. 
+    The categorical columns (see build_features.CATEGORICAL_COLUMNS) are only read if categorical is set. 
     """
-    df = pd.read_csv(filename, 
-                low_memory = False)
+    columns = build_features.model_columns(storage.frame_columns(filename), categorical)
+    df = storage.read_frame(filename, columns = columns + ["target"])
     
     y = (df["target"]).astype(int)
     X = df.drop(columns = ["target"])
     X_train_orig, X_test_orig, y_train, y_test = train_test_split(X, y, 
                                                                   random_state = RANDOM_STATE,
-                                                                  train_size = 0.9)
+                                                                  test_size = TEST_SIZE)
     logger.info(f"Train size: {X_train_orig.shape}\nTest size: {X_test_orig.shape}")
     return X_train_orig, X_test_orig, y_train, y_test
 
-def normalize_df(df):
+def data_from_feature_store(store_dir):
     """
-    Normalize numerical colums in dataframe to be between 0 and 1. 
+    Opens a feature store (see feature_store) and splits its rows to train/test, as the same split 
+    data_from_dataset makes. The split is kept as positions into the memory-mapped matrix, so no rows 
+    are read until they're used. 
+
+    Returns:
+    X (numpy.memmap): Feature matrix of all rows.
+    y (numpy.ndarray): Labels of all rows.
+    columns (list): Names of the columns of X.
+    train_idx (numpy.ndarray): Positions of the training rows, sorted.
+    test_idx (numpy.ndarray): Positions of the test rows, sorted.
     """
-    scaler = MinMaxScaler()
-    df = pd.DataFrame(scaler.fit_transform(df.values), 
-                       columns=df.columns, index=df.index)
-    return df
+    X, y, columns = feature_store.open_feature_store(store_dir)
+    y = np.asarray(y, dtype = int)
+    train_idx, test_idx = train_test_split(np.arange(len(y)), random_state = RANDOM_STATE, test_size = TEST_SIZE)
+    logger.info(f"Train size: {(len(train_idx), len(columns))}\nTest size: {(len(test_idx), len(columns))}")
+    return X, y, columns, np.sort(train_idx), np.sort(test_idx)
 
 def undersample_dataset(X_train_orig, y_train):
     """
@@ -57,11 +76,109 @@ def undersample_dataset(X_train_orig, y_train):
 
     return X_train_under, y_train_under
 
+def iter_training_chunks(filename, chunksize, class_0_rate):
+    """
+    Reads the processed dataset in chunks, assigning each row to the test set with probability TEST_SIZE
+    and keeping each class 0 training row with probability class_0_rate (Bernoulli undersampling). 
+    Every call makes the same assignments, so the data can be streamed more than once. 
+
+    Parameters:
+    filename (string): Location of the processed dataset.
+    chunksize (int): Number of rows per chunk.
+    class_0_rate (float): Fraction of the class 0 training rows to keep.
+
+    Returns:
+    chunks (generator): Generator of (X, y, is_test, is_train) tuples, where is_test and is_train are 
+                        boolean masks of the rows of X in the test set and in the undersampled training set.
+    """
+    rng = np.random.default_rng(RANDOM_STATE)
+    columns = build_features.model_columns(storage.frame_columns(filename))
+    for df in storage.iter_frame(filename, chunksize, columns + ["target"]):
+        y = df["target"].astype(int).to_numpy()
+        X = df.drop(columns = ["target"]).fillna(0)
+        is_test = rng.random(len(df)) < TEST_SIZE
+        is_train = ~is_test & ((y == 1) | (rng.random(len(df)) < class_0_rate))
+        yield X, y, is_test, is_train
+
+def train_streaming(filename, chunksize, model = model_bundle.DEFAULT_MODEL, random_state = None):
+    """
+    Trains the pipeline out of core, so that the processed dataset never has to fit in memory: 
+    the scaler is fitted on a first pass over the undersampled training rows, the model (with 
+    partial_fit) on a second, and the test rows are scored on a third. The first pass also keeps a
+    random sample of the training rows (before undersampling) to profile (see validate_features). 
+
+    Parameters:
+    filename (string): Location of the processed dataset.
+    chunksize (int): Number of rows to read at a time.
+    model (string): One of model_bundle.STREAMING_MODELS.
+    random_state (int): Random state of the model, for models that take one.
+
+    Returns:
+    pipeline (sklearn.pipeline.Pipeline): The fitted pipeline.
+    columns (list): Names of the feature columns, in training order.
+    y_test (numpy.ndarray): Labels of the test rows.
+    y_preds (numpy.ndarray): Predicted labels of the test rows.
+    y_preds_probs (numpy.ndarray): Predicted class probabilities of the test rows.
+    feature_profile (dict): Profile of the training data (see validate_features.fit_profile).
+    """
+    # The target column alone fits in memory: count the classes to set the undersampling rate. 
+    counts = storage.read_frame(filename, columns = ["target"])["target"].astype(int).value_counts()
+    class_0_rate = min(counts.get(1, 0) / counts.get(0, 1), 1.0)
+    logger.info(f"Streaming {filename} in chunks of {chunksize} rows, keeping {class_0_rate:.3f} of class 0")
+
+    if model not in model_bundle.STREAMING_MODELS:
+        raise ValueError(f"{model} can't be trained out of core, expected one of {model_bundle.STREAMING_MODELS}")
+    pipeline = model_bundle.make_pipeline(model, random_state)
+    scaler, estimator = pipeline.named_steps["scaler"], pipeline.named_steps["model"]
+    sample, rng = None, np.random.default_rng(RANDOM_STATE)
+    with profiling.stage("fit_scaler"):
+        for X, y, is_test, is_train in iter_training_chunks(filename, chunksize, class_0_rate):
+            sample = validate_features.reservoir_sample(sample, X[~is_test], rng)
+            if is_train.any():
+                scaler.partial_fit(X[is_train])
+    feature_profile = validate_features.fit_profile(sample[0])
+
+    n_train = 0
+    with profiling.stage("fit"):
+        for X, y, is_test, is_train in iter_training_chunks(filename, chunksize, class_0_rate):
+            if is_train.any():
+                estimator.partial_fit(scaler.transform(X[is_train]), y[is_train], classes = [0, 1])
+                n_train += int(is_train.sum())
+    logger.info(f"Trained on {n_train} rows")
+
+    y_test, y_preds, y_preds_probs = [], [], []
+    with profiling.stage("predict"):
+        for X, y, is_test, is_train in iter_training_chunks(filename, chunksize, class_0_rate):
+            if is_test.any():
+                y_test.append(y[is_test])
+                y_preds.append(pipeline.predict(X[is_test]))
+                y_preds_probs.append(pipeline.predict_proba(X[is_test]))
+    logger.info(f"Tested on {sum(len(y) for y in y_test)} rows")
+    return (pipeline, list(X.columns), np.concatenate(y_test), np.concatenate(y_preds), np.vstack(y_preds_probs), 
+            feature_profile)
+
+def select_model(X_train, y_train, models, cv, jobs, report):
+    """
+    Cross-validates models on the training data (see benchmark_models), writes the comparison to
+    report, and returns the best model by AUC. 
+    """
+    models = [x.strip() for x in models.split(",") if x.strip()]
+    unknown = set(models) - set(model_bundle.MODELS)
+    if unknown:
+        raise click.BadParameter(f"Unknown models {sorted(unknown)}, expected some of {sorted(model_bundle.MODELS)}")
+    scores, summary = benchmark_models.benchmark_models(X_train, y_train, models, cv, jobs, RANDOM_STATE)
+    logger.info(f"Cross-validation results: \n{summary.to_string(float_format = '%.3f')}")
+    os.makedirs(os.path.dirname(report) or ".", exist_ok = True)
+    summary.to_csv(report, float_format = "%.4f")
+    logger.info(f"Benchmark table saved to {report}")
+    logger.info(f"Training {summary.index[0]}, the best model by AUC")
+    return summary.index[0]
+
 def calc_metrics(conf_mat):
     """
-    Calculates metrics based on confusion matrix. 
+    Calculates metrics based on confusion matrix (with labels [1, 0], as in main). 
     """
-    tn, fp, fn, tp = conf_mat.ravel()
+    tp, fn, fp, tn = conf_mat.ravel()
     accuracy = (tp + tn) / (tn + fp + fn + tp)
     precision = tp / (tp + fp)
     recall = tp / (tp + fn)
@@ -70,39 +187,143 @@ def calc_metrics(conf_mat):
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--chunksize', type=click.INT, default=None, 
+              help=f'Train out of core, reading the data in chunks of this many rows ({", ".join(model_bundle.STREAMING_MODELS)}).')
+@click.option('--model', type=click.Choice(sorted(model_bundle.MODELS)), default=model_bundle.DEFAULT_MODEL,
+              help='Model to train.')
+@click.option('--sparse', is_flag=True, 
+              help=f'Also train on the categorical columns, encoded as a sparse matrix ({", ".join(model_bundle.SPARSE_MODELS)}).')
+@click.option('--models', default=None, 
+              help='Comma-separated models to cross-validate (eg. lr,dt,rf,gnb); the best by AUC is trained.')
+@click.option('--cv', type=click.INT, default=5, help='Number of cross-validation folds for --models.')
+@click.option('--jobs', type=click.INT, default=-1, help='Number of processes for --models (-1: one per CPU).')
+@click.option('--report', type=click.Path(), default='reports/model_benchmark.csv', 
+              help='Where to write the --models benchmark table.')
+@click.option('--thresholds', 'n_thresholds', type=click.INT, default=evaluate_model.DEFAULT_N_THRESHOLDS,
+              help='Number of thresholds from 0 to 1 to evaluate the model at on the test set.')
+@click.option('--bootstrap', 'n_bootstrap', type=click.INT, default=evaluate_model.DEFAULT_N_BOOTSTRAP,
+              help='Number of bootstrap samples for confidence intervals of the test metrics (0 for none).')
+@click.option('--cost-fp', type=click.FLOAT, default=1.0, help='Cost of labelling a repaid loan as a default.')
+@click.option('--cost-fn', type=click.FLOAT, default=1.0, help='Cost of labelling a defaulted loan as repaid.')
+@click.option('--profile', is_flag=True, 
+              help='Record the time and memory of each step, and write a report to reports/profiles.')
+@click.option('--profile-stage', default=None, 
+              help='With --profile, also run this step (eg. fix_dtypes) under a profiler.')
+@click.option('--profiler', type=click.Choice(profiling.PROFILERS), default='cprofile', 
+              help='Profiler for --profile-stage.')
+def main(input_filepath, output_filepath, chunksize, model, sparse, models, cv, jobs, report, n_thresholds, n_bootstrap, 
+         cost_fp, cost_fn, profile, profile_stage, profiler):
     """ 
     Trains and saves model. 
+    The saved model is a bundle (see model_bundle) holding the fitted scaler and model together with
+    the training column order, so that predict_model never refits the scaler. The distribution of 
+    each feature in the training data is profiled and saved next to it (see validate_features), for 
+    predict_model to measure drift against. 
     
     Parameters:
-    input_filepath (string): Location of data to use to train and test the model.
-    output_filepath (string): Location to save trained model. 
+    input_filepath (string): Location of data to use to train and test the model: a processed dataset, 
+                            or a feature store (see feature_store), which is memory-mapped rather than read.
+    output_filepath (string): Location to save trained model bundle. 
+    chunksize (int): If set, train incrementally (see train_streaming) rather than in memory, with a model
+                     that has partial_fit.
+    model (string): Model to train (see model_bundle.MODELS).
+    sparse (bool): If set, also train on the categorical columns, encoded as a sparse matrix (see 
+                   encode_features), with a model that accepts sparse input.
+    models (string): If set, cross-validate these models on the training data first (see 
+                     benchmark_models), write the comparison to report, and train the best one.
+    cv (int): Number of cross-validation folds.
+    jobs (int): Number of processes to cross-validate with.
+    report (string): Location of the benchmark table.
+    n_thresholds (int): Number of thresholds to evaluate the model at on the test set (see evaluate_model).
+    n_bootstrap (int): Number of bootstrap samples for confidence intervals of the test metrics.
+    cost_fp (float): Cost of a false positive, for the expected loss.
+    cost_fn (float): Cost of a false negative, for the expected loss.
+    profile (bool): Record the time and memory of each step (see profiling).
+    profile_stage (string): Step to run under a profiler, eg. fit.
+    profiler (string): Profiler for profile_stage.
     """
     logger.info(f"Training model on data at {input_filepath}")
+    if profile:
+        profiling.enable(profile_stage = profile_stage, profiler = profiler)
     
-    (X_train_orig, X_test_orig, y_train, y_test) = data_from_dataset(input_filepath)
-    X_train_orig.fillna(0, inplace = True)
-    X_test_orig.fillna(0, inplace = True)
-    (X_train_under, y_train_under) = undersample_dataset(X_train_orig, y_train)
-    X_train = normalize_df(X_train_under)
-    X_test = normalize_df(X_test_orig)
-    
-    model = GaussianNB()
-    model.fit(X_train, y_train_under)
+    store = feature_store.is_feature_store(input_filepath)
+    if sparse:
+        if chunksize or store or models:
+            raise click.UsageError("--sparse trains one --model in memory, without --chunksize, --models or a feature store")
+        if model not in model_bundle.SPARSE_MODELS:
+            raise click.UsageError(f"--sparse needs a model that accepts sparse input: one of {model_bundle.SPARSE_MODELS}")
+    if chunksize:
+        if store:
+            raise click.UsageError("--chunksize streams a processed dataset: a feature store is memory-mapped instead")
+        if models:
+            raise click.UsageError("--chunksize trains one --model, without --models")
+        if model not in model_bundle.STREAMING_MODELS:
+            raise click.UsageError(f"--chunksize needs a model with partial_fit: one of {model_bundle.STREAMING_MODELS}")
+        pipeline, columns, y_test, y_preds, y_preds_probs, feature_profile = train_streaming(input_filepath, chunksize, 
+                                                                                             model, RANDOM_STATE)
+    elif store:
+        # Only the rows used are gathered from the memory-mapped matrix, already float32 and filled. 
+        X, y, columns, train_idx, test_idx = data_from_feature_store(input_filepath)
+        if models:
+            model = select_model(feature_store.frame(X, columns, train_idx), y[train_idx], models, cv, jobs, report)
+        profile_idx = validate_features.profile_positions(train_idx, np.random.default_rng(RANDOM_STATE))
+        feature_profile = validate_features.fit_profile(feature_store.frame(X, columns, profile_idx))
 
-    y_preds = model.predict(X_test)
-    y_preds_probs = model.predict_proba(X_test)
+        train_idx = benchmark_models.undersample_indices(y, train_idx, np.random.default_rng(RANDOM_STATE))
+        X_train_under, y_train_under = feature_store.frame(X, columns, train_idx), y[train_idx]
+        X_test_orig, y_test = feature_store.frame(X, columns, test_idx), y[test_idx]
+        logger.info(f"Undersampled training set: {np.bincount(y_train_under).tolist()} rows of class 0 and 1")
+
+        pipeline = model_bundle.make_pipeline(model, RANDOM_STATE)
+        with profiling.stage("fit", X_train_under):
+            pipeline.fit(X_train_under, y_train_under)
+
+        with profiling.stage("predict", X_test_orig):
+            y_preds = pipeline.predict(X_test_orig)
+            y_preds_probs = pipeline.predict_proba(X_test_orig)
+    else:
+        (X_train_orig, X_test_orig, y_train, y_test) = data_from_dataset(input_filepath, sparse)
+        if not sparse:
+            # With sparse, the encoder fills missing values. 
+            X_train_orig.fillna(0, inplace = True)
+            X_test_orig.fillna(0, inplace = True)
+
+        if models:
+            model = select_model(X_train_orig, y_train, models, cv, jobs, report)
+        feature_profile = validate_features.fit_profile(X_train_orig, np.random.default_rng(RANDOM_STATE))
+
+        (X_train_under, y_train_under) = undersample_dataset(X_train_orig, y_train)
+        
+        # The scaler is fitted on the training data only, and reused as-is on the test data. 
+        pipeline = model_bundle.make_pipeline(model, RANDOM_STATE, sparse)
+        with profiling.stage("fit", X_train_under):
+            pipeline.fit(X_train_under, y_train_under)
+        columns = X_train_under.columns
+
+        with profiling.stage("predict", X_test_orig):
+            y_preds = pipeline.predict(X_test_orig)
+            y_preds_probs = pipeline.predict_proba(X_test_orig)
     
     auc = roc_auc_score(y_test, y_preds_probs[:, 1])
-    conf_mat = confusion_matrix(y_test, y_preds, [1, 0])
+    conf_mat = confusion_matrix(y_test, y_preds, labels = [1, 0])
     metrics = calc_metrics(conf_mat)
+    logger.info(f"AUC      : {auc:.2f}")
     logger.info(f"Accuracy : {metrics['accuracy']:.2f}")
     logger.info(f"Precision: {metrics['precision']:.2f}")
     logger.info(f"Recall   : {metrics['recall']:.2f}")
     logger.info(f"Confusion matrix: \n{conf_mat}")
 
-    logger.info(f"Saving model to {output_filepath}")
-    pickle.dump(model, open(output_filepath, 'wb'))
+    bundle = model_bundle.make_bundle(pipeline, columns)
+    model_bundle.save_bundle(bundle, output_filepath)
+    validate_features.save_profile(feature_profile, output_filepath)
+
+    # The test set is scored once; every threshold is evaluated from those probabilities. 
+    with profiling.stage("evaluate"):
+        sweep, summary = evaluate_model.threshold_sweep(np.asarray(y_test), y_preds_probs[:, 1], 
+                                                        np.linspace(0, 1, n_thresholds), cost_fp, cost_fn, 
+                                                        n_bootstrap, RANDOM_STATE)
+    evaluate_model.save_evaluation(sweep, summary, output_filepath)
+    profiling.write_report("train_model")
     
     return
 
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.data import storage
+from src.features import build_features
+from src.models import model_bundle
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+# Number of training rows the distribution of each feature is profiled on, and number of rows of a
+# batch its drift is measured on.
+PROFILE_ROWS = 100000
+DRIFT_SAMPLE_ROWS = 100000
+# Each feature's training distribution is kept as its value at these quantiles, and the fraction of
+# training rows at or below each of those values (which differs from the quantile for discrete features).
+QUANTILES = np.linspace(0, 1, 101)
+# Population stability index is computed over the deciles of the training data.
+PSI_BIN_EDGES = slice(10, 100, 10)
+PSI_EPSILON = 1e-4
+# Usual rules of thumb: a PSI below 0.1 is no meaningful shift, above 0.25 a major one.
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+
+def profile_path(model_filepath):
+    """
+    Location of the training profile (see fit_profile) saved next to a model.
+    """
+    return f"{os.path.splitext(model_filepath)[0]}-profile.json"
+
+def numeric_columns(columns):
+    """
+    Returns the columns of a model's input that are profiled: all but the categorical columns.
+    """
+    return [x for x in columns if x not in build_features.CATEGORICAL_COLUMNS]
+
+def profile_positions(positions, rng):
+    """
+    Chooses at most PROFILE_ROWS of positions to profile, so a feature store's rows are only gathered
+    for the sample.
+
+    Returns:
+    positions (numpy.ndarray): The chosen positions, sorted.
+    """
+    if len(positions) <= PROFILE_ROWS:
+        return np.asarray(positions)
+    return np.sort(rng.choice(positions, size = PROFILE_ROWS, replace = False))
+
+def reservoir_sample(sample, df, rng):
+    """
+    Adds the rows of df to a uniform random sample of at most PROFILE_ROWS rows of a stream of dataframes,
+    so the training data can be profiled while it's streamed: every row gets a random key, and the rows
+    with the smallest keys are kept.
+
+    Parameters:
+    sample (tuple): The (rows, keys) sample of the dataframes so far, or None before the first.
+    df (pandas.DataFrame): The next dataframe of the stream.
+    rng (numpy.random.Generator): Random generator for the keys.
+
+    Returns:
+    sample (tuple): The (rows, keys) sample of the dataframes so far, including df.
+    """
+    keys = rng.random(len(df))
+    if sample is not None:
+        rows, sample_keys = sample
+        if len(sample_keys) >= PROFILE_ROWS:
+            # Only rows with a smaller key than the largest kept one can enter the sample. 
+            smaller = keys < sample_keys.max()
+            df, keys = df[smaller], keys[smaller]
+        df, keys = pd.concat([rows, df], ignore_index = True), np.concatenate([sample_keys, keys])
+    if len(keys) > PROFILE_ROWS:
+        keep = np.sort(np.argpartition(keys, PROFILE_ROWS)[:PROFILE_ROWS])
+        df, keys = df.iloc[keep], keys[keep]
+    return df.reset_index(drop = True), keys
+
+def column_cdf(sorted_values, points):
+    """
+    Evaluates the empirical CDF of each column of sorted_values at the matching column of points.
+
+    Parameters:
+    sorted_values (numpy.ndarray): Rows x columns, each column sorted.
+    points (numpy.ndarray): Points x columns.
+
+    Returns:
+    cdf (numpy.ndarray): Points x columns, the fraction of rows at or below each point.
+    """
+    cdf = np.empty(points.shape)
+    for j in range(points.shape[1]):
+        cdf[:, j] = np.searchsorted(sorted_values[:, j], points[:, j], side = "right")
+    return cdf / max(len(sorted_values), 1)
+
+def model_input(df, columns):
+    """
+    Returns the profiled columns of df as the model sees them: missing values filled with 0 (see
+    model_bundle.features_from_frame), as a float64 matrix with each column sorted.
+    """
+    return np.sort(df[columns].fillna(0).to_numpy(dtype = np.float64), axis = 0)
+
+def fit_profile(df, rng = None):
+    """
+    Profiles the distribution of each numeric feature of the training data, to measure drift against
+    (see feature_drift). At most PROFILE_ROWS rows are used.
+
+    Parameters:
+    df (pandas.DataFrame): Training features, eg. before undersampling.
+    rng (numpy.random.Generator): Random generator for sampling rows.
+
+    Returns:
+    profile (dict): The profiled columns, the number of rows, and for each column its value at each of
+                    QUANTILES ("quantiles") and the fraction of rows at or below that value ("cdf").
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    df = df.iloc[profile_positions(np.arange(len(df)), rng)]
+    columns = numeric_columns(df.columns)
+    values = model_input(df, columns)
+    quantiles = np.quantile(values, QUANTILES, axis = 0)
+    return {"version": PROFILE_VERSION, "columns": columns, "rows": len(values),
+            "quantiles": quantiles.tolist(), "cdf": column_cdf(values, quantiles).tolist()}
+
+def save_profile(profile, model_filepath):
+    """
+    Saves a training profile next to the model it was trained for.
+
+    Side effects:
+    Writes <model>-profile.json.
+    """
+    path = profile_path(model_filepath)
+    with open(path, "w") as f:
+        json.dump(profile, f)
+    logger.info(f"Profiled {len(profile['columns'])} features on {profile['rows']} training rows: saved to {path}")
+
+def load_profile(model_filepath):
+    """
+    Loads the training profile saved next to a model, or returns None if there isn't one.
+    """
+    path = profile_path(model_filepath)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    if profile.get("version") != PROFILE_VERSION:
+        logger.warning(f"{path} is not a version {PROFILE_VERSION} profile: retrain to check drift")
+        return None
+    return profile
+
+def feature_drift(profile, df):
+    """
+    Measures how far the distribution of each profiled feature in df has moved from training, from
+    the training profile alone: both statistics come from the CDF of df at the profiled quantiles,
+    found by binary search in each sorted column.
+
+    Parameters:
+    profile (dict): Training profile (see fit_profile).
+    df (pandas.DataFrame): New observations (eg. a sample of a batch to score).
+
+    Returns:
+    drift (pandas.DataFrame): For each feature, the population stability index over the training
+                              deciles ("psi") and the Kolmogorov-Smirnov statistic at the profiled
+                              quantiles ("ks"), sorted by PSI, largest first.
+    """
+    columns = profile["columns"]
+    quantiles, train_cdf = np.asarray(profile["quantiles"]), np.asarray(profile["cdf"])
+    new_cdf = column_cdf(model_input(df, columns), quantiles)
+    ks = np.abs(new_cdf - train_cdf).max(axis = 0)
+
+    # Share of rows in each decile bin of the training data (bins that collapse on ties are empty in both).
+    def bin_shares(cdf):
+        n_columns = cdf.shape[1]
+        edges = np.vstack([np.zeros((1, n_columns)), cdf[PSI_BIN_EDGES], np.ones((1, n_columns))])
+        return np.clip(np.diff(edges, axis = 0), PSI_EPSILON, None)
+    expected, actual = bin_shares(train_cdf), bin_shares(new_cdf)
+    psi = ((actual - expected) * np.log(actual / expected)).sum(axis = 0)
+    return pd.DataFrame({"psi": psi, "ks": ks}, index = pd.Index(columns, name = "feature")).sort_values(
+        "psi", ascending = False)
+
+def check_input(bundle, model_filepath, input_file, max_psi = None, drift = True):
+    """
+    Checks a batch before it is scored: that it has the model's columns, that the numeric ones are
+    numbers, and (if the model has a training profile) how far their distribution has drifted, on its
+    first DRIFT_SAMPLE_ROWS rows. Only the header and the sample are read.
+
+    Parameters:
+    bundle (dict): The model bundle (or compact model).
+    model_filepath (string): Location of the model, next to which its profile is saved.
+    input_file (string): Location of the processed observations.
+    max_psi (float): If set, fail if any feature's PSI is above this.
+    drift (bool): Measure drift; otherwise, only check the columns and types.
+
+    Returns:
+    drift (pandas.DataFrame): Drift of each feature (see feature_drift), or None if it wasn't measured.
+
+    Raises:
+    ValueError: If columns are missing or not numeric, or the drift is above max_psi.
+    """
+    missing = [x for x in bundle["columns"] if x not in storage.frame_columns(input_file)]
+    if missing:
+        raise ValueError(f"{input_file} is missing columns the model was trained on: {missing}")
+    sample = next(storage.iter_frame(input_file, DRIFT_SAMPLE_ROWS, list(bundle["columns"])), None)
+    if sample is None:
+        return None
+    not_numeric = [x for x in numeric_columns(bundle["columns"])
+                   if not pd.api.types.is_numeric_dtype(sample[x]) and not pd.api.types.is_bool_dtype(sample[x])]
+    if not_numeric:
+        raise ValueError(f"Columns of {input_file} are not numeric: "
+                         f"{ {x: str(sample[x].dtype) for x in not_numeric} }")
+
+    profile = load_profile(model_filepath) if drift else None
+    if profile is None:
+        if drift:
+            logger.warning(f"No training profile at {profile_path(model_filepath)}: not checking drift")
+        return None
+    result = feature_drift(profile, sample)
+    logger.info(f"Drift of {input_file} on {len(sample)} rows: largest PSI "
+                f"{result['psi'].iloc[0]:.3f} ({result.index[0]}), largest KS {result['ks'].max():.3f}")
+    shifted = result[result["psi"] > PSI_WARN]
+    for feature, row in shifted.iterrows():
+        level = "major" if row["psi"] > PSI_ALERT else "moderate"
+        logger.warning(f"{feature} has shifted ({level}): PSI {row['psi']:.3f}, KS {row['ks']:.3f}")
+    if max_psi is not None and (result["psi"] > max_psi).any():
+        raise ValueError(f"Features of {input_file} have drifted beyond PSI {max_psi}: "
+                         f"{list(result.index[result['psi'] > max_psi])}")
+    return result
+
+@click.command()
+@click.argument('model_filepath', type=click.Path(exists=True))
+@click.argument('data_filepath', type=click.Path(exists=True))
+@click.option('--max-psi', type=click.FLOAT, default=None, help='Fail if any feature has drifted beyond this PSI.')
+@click.option('--output', type=click.Path(), default=None, help='Save the drift of each feature to this CSV file.')
+def main(model_filepath, data_filepath, max_psi, output):
+    """
+    Checks a processed dataset against a model before scoring it: its columns and types, and the drift
+    of each feature from the model's training data (see check_input).
+
+    Parameters:
+    model_filepath (string): Location of the trained model bundle, with its profile next to it.
+    data_filepath (string): Location of the processed observations.
+    """
+    bundle = model_bundle.load_bundle(model_filepath)
+    try:
+        result = check_input(bundle, model_filepath, data_filepath, max_psi)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if result is not None and output:
+        result.to_csv(output, float_format = "%.6g")
+        logger.info(f"Drift saved to {output}")
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import functools
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ["cprofile", "pyinstrument"]
+DEFAULT_REPORT_DIR = os.path.join("reports", "profiles")
+REPORT_COLUMNS = ["stage", "depth", "wall_time", "cpu_time", "peak_rss_mb", "rows_in", "rows_out", "memory_in_mb",
+                  "memory_out_mb"]
+
+# Profiling is off until enable() is called: stages then only cost a function call.
+_state = {"enabled": False, "records": [], "stack": [], "profile_stage": None, "profiler": "cprofile",
+          "report_dir": DEFAULT_REPORT_DIR}
+
+def enable(report_dir = DEFAULT_REPORT_DIR, profile_stage = None, profiler = "cprofile"):
+    """
+    Starts recording pipeline stages (see stage) in this process.
+
+    Parameters:
+    report_dir (string): Directory to write reports (see write_report) and stage profiles to.
+    profile_stage (string): If set, the name of one stage to run under a profiler, eg. fix_dtypes.
+    profiler (string): One of PROFILERS. pyinstrument must be installed separately.
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}")
+    _state.update(enabled = True, records = [], stack = [], profile_stage = profile_stage, profiler = profiler,
+                  report_dir = report_dir)
+
+def peak_rss_mb(reset = False):
+    """
+    Returns the peak resident memory of this process in MB. On Linux, reset = True starts a new
+    peak from the current memory use, so that each stage reports its own peak; elsewhere the peak is
+    for the life of the process.
+    """
+    try:
+        if reset:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux, and in bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+def frame_stats(df, prefix):
+    """
+    Returns the number of rows and memory use of df (if it is a dataframe), keyed by prefix.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return {}
+    return {f"rows_{prefix}": len(df), f"memory_{prefix}_mb": df.memory_usage(deep = True).sum() / 1024 ** 2}
+
+@contextmanager
+def run_profiler(name):
+    """
+    Runs the body under the configured profiler, and saves the profile to the report directory.
+    """
+    os.makedirs(_state["report_dir"], exist_ok = True)
+    if _state["profiler"] == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = os.path.join(_state["report_dir"], f"{name}.html")
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+            logger.info(f"Saved pyinstrument profile of {name} to {path}")
+        return
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(_state["report_dir"], f"{name}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream = summary).sort_stats("cumulative").print_stats(20)
+        logger.info(f"Saved cProfile profile of {name} to {path}: \n{summary.getvalue()}")
+
+@contextmanager
+def stage(name, df = None):
+    """
+    Records one pipeline stage: its wall time, CPU time, peak resident memory, and the rows and
+    memory of its input and output dataframes. Stages may be nested, eg. read_frame in build_features.
+
+    Parameters:
+    name (string): Name of the stage.
+    df (pandas.DataFrame): Input of the stage, if any.
+
+    Returns:
+    record (dict): Context manager yielding the stage's record. Set record["output"] to the output
+                   dataframe of the stage to record its rows and memory.
+    """
+    if not _state["enabled"]:
+        yield {}
+        return
+
+    record = {"stage": name, "depth": len(_state["stack"]), **frame_stats(df, "in")}
+    if _state["stack"]:
+        parent = _state["stack"][-1]
+        parent["peak_rss_mb"] = max(parent.get("peak_rss_mb", 0), peak_rss_mb())
+    _state["stack"].append(record)
+    _state["records"].append(record)
+    record["peak_rss_mb"] = 0
+    peak_rss_mb(reset = True)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        if name == _state["profile_stage"]:
+            with run_profiler(name):
+                yield record
+        else:
+            yield record
+    finally:
+        record["wall_time"] = time.perf_counter() - wall
+        record["cpu_time"] = time.process_time() - cpu
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], peak_rss_mb())
+        record.update(frame_stats(record.pop("output", None), "out"))
+        _state["stack"].pop()
+        if _state["stack"]:
+            parent = _state["stack"][-1]
+            parent["peak_rss_mb"] = max(parent["peak_rss_mb"], record["peak_rss_mb"])
+
+def profiled(func):
+    """
+    Decorator recording each call of func as a stage (see stage). The first argument and the return
+    value are recorded as the stage's input and output, if they are dataframes.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__, args[0] if args else None) as record:
+            result = func(*args, **kwargs)
+            record["output"] = result
+        return result
+    return wrapper
+
+def write_report(name):
+    """
+    Writes the stages recorded since enable() as a JSON file and an HTML table.
+
+    Parameters:
+    name (string): Name of the run, eg. make_dataset. The reports are named after it and the time.
+
+    Returns:
+    path (string): Location of the JSON report, or None if profiling isn't enabled.
+
+    Side effects:
+    Writes <name>-<time>.json and <name>-<time>.html to the report directory.
+    """
+    if not _state["enabled"]:
+        return None
+    os.makedirs(_state["report_dir"], exist_ok = True)
+    path = os.path.join(_state["report_dir"], f"{name}-{time.strftime('%Y%m%d-%H%M%S')}")
+    report = {"run": name, "argv": sys.argv, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "stages": _state["records"]}
+    with open(path + ".json", "w") as f:
+        json.dump(report, f, indent = 2)
+
+    df = pd.DataFrame(_state["records"], columns = REPORT_COLUMNS)
+    df["stage"] = [". " * depth + stage for stage, depth in zip(df["stage"], df["depth"])]
+    with open(path + ".html", "w") as f:
+        f.write(f"<html><head><title>{name} profile</title></head><body>\n<h1>{name}</h1>\n"
+                f"<p>{' '.join(sys.argv)}<br>{report['created']}</p>\n")
+        f.write(df.drop(columns = ["depth"]).to_html(index = False, float_format = "%.2f", na_rep = ""))
+        f.write("\n</body></html>\n")
+    logger.info(f"Profile of {name} saved to {path}.json and {path}.html")
+    return path + ".json"
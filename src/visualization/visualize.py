@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from src.data import stage_cache
+from src.data import storage
+from src.features import build_features
+
+logger = logging.getLogger(__name__)
+
+# Kept apart from the stage cache (data/interim/cache), whose eviction would treat it as one entry.
+DEFAULT_CACHE_DIR = os.path.join("data", "interim", "aggregates")
+DEFAULT_FIGURES_DIR = os.path.join("reports", "figures")
+# Aggregate key each figure was last drawn from, so unchanged figures aren't redrawn.
+FIGURES_MANIFEST = "_figures.json"
+# Columns of the processed dataset to show the default rate by. build_features keeps grade as a code
+# from 1 (A) to 7 (G), shown as its letter, and the issue month as a report column.
+GROUP_COLUMNS = {"grade": "grade", "purpose": "purpose", "state": "addr_state", "issue_month": "issue_month"}
+# The log-scaled columns are counted in fixed bins (rather than bins fitted to the data), so that the
+# counts of each file of a dataset add up to the counts of the whole dataset.
+HISTOGRAM_BIN_WIDTH = 0.1
+HISTOGRAM_BINS = 200
+
+# Each aggregate, by name: the column of the processed dataset it is computed from, and whether it is a
+# default rate by group or a histogram.
+AGGREGATES = {f"default_rate_by_{name}": (column, "group") for name, column in GROUP_COLUMNS.items()}
+AGGREGATES.update({f"distribution_{column}": (column, "histogram") for column in build_features.OUTLIER_COLUMNS})
+
+def dataset_files(path):
+    """
+    Returns the files of a dataset: the part files of a partitioned dataset, or the file itself.
+    """
+    return storage.part_files(path) if os.path.isdir(path) else [path]
+
+def partial_aggregate(df, column, kind):
+    """
+    Counts the rows and defaults in each group of column, or in each histogram bin of column.
+
+    Parameters:
+    df (pandas.DataFrame): One file of a dataset, with column and a target column.
+    column (string): Column to group by.
+    kind (string): "group" to group by the values of column (by month, for issue_month; by letter, for
+                   grade), or "histogram" to group by HISTOGRAM_BINS bins of HISTOGRAM_BIN_WIDTH.
+
+    Returns:
+    counts (pandas.DataFrame): Number of rows ("count") and defaults ("defaults") in each group (index);
+                               rows where column is missing are left out.
+    """
+    values = df[column]
+    if kind == "histogram":
+        values = values.astype(float)
+        bins = np.clip(np.floor(values.to_numpy() / HISTOGRAM_BIN_WIDTH), 0, HISTOGRAM_BINS - 1)
+        values = pd.Series(bins, index = df.index).where(values.notna()).astype("Int64")
+    elif column == "issue_month":
+        values = pd.to_datetime(values, errors = "coerce").dt.strftime("%Y-%m")
+    elif column == "grade":
+        values = values.map(dict(enumerate(build_features.GRADES, start = 1)))
+    else:
+        values = values.astype(str).where(values.notna())
+    counts = (pd.DataFrame({"group": values, "count": 1, "defaults": df["target"].astype(int)})
+              .groupby("group").sum())
+    return counts
+
+def file_aggregates(path, cache_files):
+    """
+    Computes the partial aggregates of one file of a dataset, reading only the columns they need, and
+    saves each to the cache. Runs in a worker process.
+
+    Parameters:
+    path (string): Location of the file.
+    cache_files (dict): Cache file to save each aggregate (see AGGREGATES) to, by name.
+    """
+    columns = sorted({AGGREGATES[name][0] for name in cache_files} | {"target"})
+    df = storage.read_frame(path, columns = columns)
+    for name, cache_file in cache_files.items():
+        counts = partial_aggregate(df, *AGGREGATES[name])
+        counts.to_parquet(cache_file + ".tmp")
+        os.replace(cache_file + ".tmp", cache_file)
+
+def compute_aggregates(dataset, cache_dir = DEFAULT_CACHE_DIR, workers = 1):
+    """
+    Computes every aggregate in AGGREGATES from the processed dataset, reusing cached ones. Each file
+    of the dataset is aggregated on its own, and cached by the hash of its contents, and the counts of
+    the files are added up: after a data refresh, only the files that changed (eg. the new part files of
+    an appended dataset) are read.
+
+    Parameters:
+    dataset (string): Location of the processed dataset. Aggregates of columns it doesn't have (eg. 
+                      issue_month, in a dataset processed before it was added) are skipped.
+    cache_dir (string): Directory of cached aggregates of each file.
+    workers (int): Number of processes to aggregate files in.
+
+    Returns:
+    aggregates (dict): By name, the number of rows, defaults and the default rate in each group.
+    keys (dict): By name, a hash of the files each aggregate was computed from.
+    """
+    os.makedirs(cache_dir, exist_ok = True)
+    code_digest = stage_cache.file_digest(__file__) + stage_cache.file_digest(build_features.__file__)
+    columns = set(storage.frame_columns(dataset))
+    missing = sorted({column for column, _ in AGGREGATES.values()} - columns)
+    if missing:
+        logger.warning(f"{dataset} has no {', '.join(missing)} columns: skipping their aggregates "
+                       "(rebuild the processed dataset to draw them)")
+
+    digests = {}
+    part_files, keys, tasks = {}, {}, {}
+    for name, (column, kind) in AGGREGATES.items():
+        if column in missing:
+            continue
+        part_files[name] = []
+        h = hashlib.blake2b(digest_size = 16)
+        for path in dataset_files(dataset):
+            if path not in digests:
+                digests[path] = stage_cache.file_digest(path, cache_dir)
+            key = hashlib.blake2b(f"{digests[path]}:{code_digest}:{name}".encode(), digest_size = 16).hexdigest()
+            cache_file = os.path.join(cache_dir, f"{key}.parquet")
+            part_files[name].append(cache_file)
+            h.update(key.encode())
+            if not os.path.exists(cache_file):
+                tasks.setdefault(path, {})[name] = cache_file
+        keys[name] = h.hexdigest()
+
+    n_parts = sum(len(x) for x in part_files.values())
+    n_new = sum(len(x) for x in tasks.values())
+    logger.info(f"Aggregating {len(tasks)} files ({n_new} of {n_parts} file aggregates not cached) "
+                f"with {workers} workers")
+    if tasks:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for _ in pool.map(file_aggregates, tasks.keys(), tasks.values()):
+                pass
+
+    aggregates = {}
+    for name, files in part_files.items():
+        counts = pd.concat([pd.read_parquet(x) for x in files]).groupby(level = 0).sum().sort_index()
+        counts["default_rate"] = counts["defaults"] / counts["count"]
+        aggregates[name] = counts
+    return aggregates, keys
+
+def plot_default_rate(ax, counts, column):
+    """
+    Plots the default rate in each group of column, with the overall default rate for reference.
+    """
+    overall = counts["defaults"].sum() / counts["count"].sum()
+    if column == "issue_month":
+        ax.plot(pd.to_datetime(counts.index), counts["default_rate"])
+    else:
+        if column != "grade":
+            counts = counts.sort_values("default_rate", ascending = False)
+        ax.bar(counts.index.astype(str), counts["default_rate"])
+        ax.tick_params(axis = "x", labelrotation = 90 if len(counts) > 10 else 0)
+    ax.axhline(overall, color = "grey", linestyle = "--", label = f"Overall ({overall:.1%})")
+    ax.set_ylabel("Default rate")
+    ax.legend()
+
+def plot_distribution(ax, counts, column):
+    """
+    Plots the distribution of a log-scaled column, with the default rate in each bin.
+    """
+    edges = counts.index.to_numpy(dtype = float) * HISTOGRAM_BIN_WIDTH
+    ax.bar(edges, counts["count"], width = HISTOGRAM_BIN_WIDTH, align = "edge", alpha = 0.6)
+    ax.set_xlabel(f"log(1 + {column})")
+    ax.set_ylabel("Loans")
+    rate_ax = ax.twinx()
+    rate_ax.plot(edges + HISTOGRAM_BIN_WIDTH / 2, counts["default_rate"], color = "tab:red")
+    rate_ax.set_ylabel("Default rate", color = "tab:red")
+
+def render_figure(name, counts, output_file):
+    """
+    Draws the figure of one aggregate and saves it as a PNG file. Runs in a worker process.
+
+    Parameters:
+    name (string): Name of the aggregate (see AGGREGATES).
+    counts (pandas.DataFrame): The aggregate (see compute_aggregates).
+    output_file (string): Location of the figure.
+    """
+    column, kind = AGGREGATES[name]
+    fig, ax = plt.subplots(figsize = (10, 5))
+    if kind == "histogram":
+        plot_distribution(ax, counts, column)
+        title = f"Distribution of {column}"
+    else:
+        plot_default_rate(ax, counts, column)
+        title = name.replace("_", " ").capitalize()
+    ax.set_title(f"{title} ({counts['count'].sum():,} loans)")
+    fig.tight_layout()
+    fig.savefig(output_file, dpi = 100)
+    plt.close(fig)
+
+def render_figures(aggregates, keys, figures_dir = DEFAULT_FIGURES_DIR, workers = 1):
+    """
+    Draws the figure of each aggregate in parallel, skipping figures whose aggregate is unchanged since
+    they were last drawn.
+
+    Parameters:
+    aggregates (dict): Aggregates by name (see compute_aggregates).
+    keys (dict): Hash of each aggregate's input files (see compute_aggregates).
+    figures_dir (string): Directory of the figures, eg. reports/figures.
+    workers (int): Number of processes to draw figures in.
+
+    Side effects:
+    Writes <name>.png for each changed aggregate to figures_dir, and updates its FIGURES_MANIFEST.
+    """
+    os.makedirs(figures_dir, exist_ok = True)
+    manifest_file = os.path.join(figures_dir, FIGURES_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    output_files = {name: os.path.join(figures_dir, f"{name}.png") for name in aggregates}
+    changed = [name for name in aggregates
+               if manifest.get(name) != keys[name] or not os.path.exists(output_files[name])]
+    logger.info(f"Drawing {len(changed)} of {len(aggregates)} figures in {figures_dir} with {workers} workers")
+    if changed:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for _ in pool.map(render_figure, changed, [aggregates[x] for x in changed],
+                              [output_files[x] for x in changed]):
+                pass
+
+    manifest.update({name: keys[name] for name in changed})
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent = 2)
+
+@click.command()
+@click.argument('processed_file', type=click.Path(exists=True))
+@click.option('--figures-dir', type=click.Path(), default=DEFAULT_FIGURES_DIR, help='Directory to save figures to.')
+@click.option('--cache-dir', type=click.Path(), default=DEFAULT_CACHE_DIR, help='Directory of cached aggregates.')
+@click.option('--workers', type=click.INT, default=os.cpu_count(),
+              help='Number of processes to aggregate files and draw figures in.')
+def main(processed_file, figures_dir, cache_dir, workers):
+    """
+    Draws the report figures from the processed dataset: the default rate by grade, purpose, state and
+    issue month, and the distributions of the log-scaled columns. Aggregates are cached by the contents
+    of each file they are computed from, and figures are only redrawn when their aggregate changes.
+
+    Parameters:
+    processed_file (string): Location of the processed dataset (the output of build_features, or of
+                             make_dataset with --append or several workers).
+    """
+    aggregates, keys = compute_aggregates(processed_file, cache_dir, workers)
+    render_figures(aggregates, keys, figures_dir, workers)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # not used in this stub but often useful for finding various files
+    project_dir = Path(__file__).resolve().parents[2]
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+import pytest
+
+from src.data import clean_dataset
+from src.data import data_dictionary
+from src.data import make_synthetic_dataset
+from src.features import build_features
+
+SYNTHETIC_ROWS = 3000
+
+@pytest.fixture(scope = "session")
+def synthetic_project(tmp_path_factory):
+    """
+    A project directory holding a synthetic raw file (data/raw/loan.csv) and its data dictionary.
+    """
+    path = tmp_path_factory.mktemp("synthetic")
+    make_synthetic_dataset.make_synthetic_dataset(str(path / "data" / "raw" / "loan.csv"), SYNTHETIC_ROWS, seed = 0,
+                                                  data_dictionary_file = str(path / data_dictionary.DATA_DICTIONARY))
+    return path
+
+@pytest.fixture
+def project_dir(synthetic_project, tmp_path, monkeypatch):
+    """
+    A fresh copy of the synthetic project, made the working directory, as the pipeline scripts expect.
+    """
+    shutil.copytree(synthetic_project, tmp_path, dirs_exist_ok = True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def raw_file(project_dir):
+    """
+    Location of the synthetic raw file, relative to the working directory.
+    """
+    return os.path.join("data", "raw", "loan.csv")
+
+@pytest.fixture
+def processed_file(raw_file):
+    """
+    Location of the synthetic raw file, cleaned and with its features added (see build_features).
+    """
+    interim, path = os.path.join("data", "interim", "loan.parquet"), os.path.join("data", "processed", "loan.parquet")
+    for x in [interim, path]:
+        os.makedirs(os.path.dirname(x), exist_ok = True)
+    clean_dataset.clean_dataset_main(raw_file, interim)
+    build_features.build_features_main(interim, path)
+    return path
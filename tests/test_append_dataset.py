@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pandas as pd
+
+from src.data import append_dataset
+
+def read_sorted(path):
+    """
+    Reads a processed dataset, with its rows in a canonical order.
+    """
+    df = pd.read_parquet(path)
+    return df.sort_values(list(df.columns)).reset_index(drop = True)
+
+def read_manifest(path):
+    with open(append_dataset.manifest_path(path)) as f:
+        return json.load(f)
+
+def test_second_append_of_the_same_file_writes_nothing(raw_file):
+    first = append_dataset.append_dataset(raw_file, "loan.parquet", chunksize = 1000)
+    rows = read_sorted("loan.parquet")
+
+    assert first == len(rows)
+    assert append_dataset.append_dataset(raw_file, "loan.parquet", chunksize = 1000) == 0
+    pd.testing.assert_frame_equal(read_sorted("loan.parquet"), rows)
+
+def test_only_months_that_changed_are_rewritten(raw_file):
+    raw = pd.read_csv(raw_file, low_memory = False)
+    months = append_dataset.issue_months(raw)
+    # Every loan issued before 2016 has a final status, and those of 2017-03 get one later.
+    old = (months < "2016-01") & ~raw["loan_status"].isin(append_dataset.FINAL_STATUSES)
+    raw.loc[old, "loan_status"] = "Fully Paid"
+    raw.to_csv(raw_file, index = False)
+    append_dataset.append_dataset(raw_file, "loan.parquet", chunksize = 1000)
+    before = read_manifest("loan.parquet")["months"]
+    assert all(x["complete"] for month, x in before.items() if month < "2016-01")
+    assert not before["2017-03"]["complete"]
+
+    raw.loc[(months == "2017-03") & (raw["loan_status"] == "Current"), "loan_status"] = "Fully Paid"
+    raw.to_csv(raw_file, index = False)
+    append_dataset.append_dataset(raw_file, "loan.parquet", chunksize = 1000)
+
+    after = read_manifest("loan.parquet")["months"]
+    assert [month for month in after if after[month] != before[month]] == ["2017-03"]
+    assert after["2017-03"]["rows"] > before["2017-03"]["rows"]
+    assert not os.path.exists(os.path.join("loan.parquet", before["2017-03"]["file"]))
+    append_dataset.append_dataset(raw_file, "fresh.parquet", chunksize = 1000)
+    pd.testing.assert_frame_equal(read_sorted("loan.parquet"), read_sorted("fresh.parquet"), check_categorical = False)
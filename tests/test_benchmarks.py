@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of each step of the pipeline on the synthetic raw file, as pytest-benchmark tests. Run them
+on their own with `pytest tests/test_benchmarks.py --benchmark-only`; make benchmark times the same
+steps on a larger file against a stored baseline (see run_benchmarks).
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from src.data import clean_dataset
+from src.features import build_features
+
+ROUNDS = 3
+
+@pytest.fixture
+def steps(raw_file):
+    """
+    The input of each step, as the output of the step before it, with the steps in pipeline order.
+    """
+    settlement_cols = clean_dataset.settlement_columns()
+    options = clean_dataset.raw_read_options(raw_file, settlement_cols)
+    funcs = {"read_raw": lambda x: clean_dataset.read_raw(raw_file, options),
+             "add_target_variable": clean_dataset.add_target_variable,
+             "fix_missing_values": lambda x: clean_dataset.fix_missing_values(x, settlement_cols),
+             "remove_future_columns": clean_dataset.remove_future_columns,
+             "fix_dtypes": clean_dataset.fix_dtypes,
+             "add_features": build_features.add_features}
+    inputs, df = {}, None
+    for name, func in funcs.items():
+        inputs[name] = (func, df)
+        df = func(df.copy() if df is not None else None)
+    return inputs
+
+@pytest.mark.parametrize("step", ["read_raw", "add_target_variable", "fix_missing_values",
+                                  "remove_future_columns", "fix_dtypes", "add_features"])
+def test_step(benchmark, steps, step):
+    func, df = steps[step]
+    # Each round gets a fresh copy of the input, as some steps modify it in place. 
+    result = benchmark.pedantic(func, setup = lambda: ((df.copy() if df is not None else None,), {}), 
+                                rounds = ROUNDS)
+    assert len(result)
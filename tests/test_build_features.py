@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+
+from src.features import build_features
+
+def test_dense_models_dont_see_the_sparse_only_columns(processed_file):
+    columns = list(pd.read_parquet(processed_file).columns)
+
+    dense = build_features.model_columns(columns)
+    sparse = build_features.model_columns(columns, categorical = True)
+
+    assert "credit_history_months" in columns
+    assert not set(dense) & set(build_features.CATEGORICAL_COLUMNS + build_features.SPARSE_ONLY_COLUMNS)
+    assert set(sparse) - set(dense) == set(build_features.CATEGORICAL_COLUMNS + build_features.SPARSE_ONLY_COLUMNS)
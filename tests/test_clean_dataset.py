@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import clean_dataset
+
+def cleaned_chunk(annual_inc, dti, num_sats):
+    """
+    A small dataframe shaped like a cleaned chunk: an amount, a rate and a zero-filled count column.
+    """
+    return pd.DataFrame({"annual_inc": annual_inc, "dti": dti, "num_sats": num_sats})
+
+def test_types_dont_depend_on_the_first_chunk():
+    first = clean_dataset.downcast_dtypes(cleaned_chunk([50000.0, 60000.0], [10.0, 20.0], [1.0, 2.0]))
+    later = clean_dataset.downcast_dtypes(cleaned_chunk([150000.35, 250000.35], [10.25, 99.99], [300.0, 4000.0]))
+    assert first.dtypes.to_dict() == later.dtypes.to_dict()
+    assert first.dtypes.to_dict() == {"annual_inc": np.float64, "dti": np.float32, "num_sats": clean_dataset.INTEGER_DTYPE}
+
+def test_later_chunk_out_of_range_of_the_first_is_cast():
+    schema = clean_dataset.freeze_schema(clean_dataset.downcast_dtypes(cleaned_chunk([50000.0], [10.0], [1.0])))
+    later = cleaned_chunk([150000.35], [10.25], [4000.0])
+
+    df = clean_dataset.apply_schema(clean_dataset.downcast_dtypes(later), schema)
+
+    assert df.dtypes.to_dict() == schema["dtypes"]
+    assert df["annual_inc"].iloc[0] == 150000.35
+    assert df["num_sats"].iloc[0] == 4000
+
+@pytest.mark.parametrize("later", [cleaned_chunk([50000.0], [1000000.35], [1.0]),
+                                   cleaned_chunk([50000.0], [10.0], [1.5]),
+                                   cleaned_chunk([50000.0], [10.0], [40000.0])])
+def test_values_that_dont_fit_their_type_are_rejected(later):
+    # Too precise for float32, not a whole number, and out of the integer range: rejected whether the
+    # file is cleaned in one pass or in chunks.
+    schema = clean_dataset.freeze_schema(clean_dataset.downcast_dtypes(cleaned_chunk([50000.0], [10.0], [1.0])))
+    with pytest.raises(ValueError):
+        clean_dataset.downcast_dtypes(later.copy())
+    with pytest.raises(ValueError):
+        clean_dataset.apply_schema(later, schema)
+
+def test_chunked_clean_matches_single_pass(raw_file):
+    clean_dataset.clean_dataset_main(raw_file, "single.parquet")
+    clean_dataset.clean_dataset_main(raw_file, "chunked.parquet", chunksize = 700)
+
+    single, chunked = pd.read_parquet("single.parquet"), pd.read_parquet("chunked.parquet")
+    pd.testing.assert_frame_equal(single, chunked, check_categorical = False)
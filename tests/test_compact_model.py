@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from src.models import compact_model
+from src.models import model_bundle
+from src.models import train_model
+
+def test_compact_model_scores_as_the_pickled_bundle(processed_file):
+    runner = CliRunner()
+    result = runner.invoke(train_model.main, [processed_file, "model.pickle", "--thresholds", "11", "--bootstrap", "0"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(compact_model.main, ["model.pickle", "model.npz"])
+    assert result.exit_code == 0, result.output
+
+    bundle, compact = model_bundle.load_bundle("model.pickle"), model_bundle.load_bundle("model.npz")
+
+    df = pd.read_parquet(processed_file)
+    assert compact["columns"] == bundle["columns"]
+    np.testing.assert_array_equal(model_bundle.classes(compact), model_bundle.classes(bundle))
+    np.testing.assert_allclose(model_bundle.predict_proba(compact, df), model_bundle.predict_proba(bundle, df),
+                               rtol = 1e-9, atol = 1e-12)
+
+def test_only_gaussian_naive_bayes_is_saved_compact(processed_file, tmp_path):
+    X, X_test, y, y_test = train_model.data_from_dataset(processed_file)
+    pipeline = model_bundle.make_pipeline("dt", train_model.RANDOM_STATE).fit(X.fillna(0), y)
+
+    with pytest.raises(ValueError):
+        model_bundle.save_bundle(model_bundle.make_bundle(pipeline, X.columns), str(tmp_path / "model.npz"))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from sklearn.metrics import accuracy_score, confusion_matrix, precision_score, recall_score, roc_auc_score
+
+from src.models import evaluate_model
+
+@pytest.fixture
+def scores():
+    """
+    Labels and probabilities of 2000 test rows, with many tied probabilities, as a naive Bayes model gives.
+    """
+    rng = np.random.default_rng(0)
+    y = (rng.random(2000) < 0.2).astype(int)
+    probs = np.clip(np.round(rng.normal(0.3 + 0.3 * y, 0.2), 2), 0, 1)
+    return y, probs
+
+def test_sweep_matches_sklearn_at_every_threshold(scores):
+    y, probs = scores
+    thresholds = np.linspace(0, 1, 101)
+
+    sweep, summary = evaluate_model.threshold_sweep(y, probs, thresholds, cost_fp = 1.0, cost_fn = 5.0)
+
+    assert summary["auc"] == pytest.approx(roc_auc_score(y, probs))
+    for row in sweep.itertuples():
+        y_pred = (probs > row.threshold).astype(int)
+        tn, fp, fn, tp = confusion_matrix(y, y_pred, labels = [0, 1]).ravel()
+        assert row.predicted_positive == pytest.approx(y_pred.mean())
+        assert row.recall == pytest.approx(recall_score(y, y_pred))
+        assert row.accuracy == pytest.approx(accuracy_score(y, y_pred))
+        assert row.expected_loss == pytest.approx((fp + 5.0 * fn) / len(y))
+        if y_pred.any():
+            assert row.precision == pytest.approx(precision_score(y, y_pred))
+            assert row.lift == pytest.approx(precision_score(y, y_pred) / y.mean())
+        else:
+            assert np.isnan(row.precision)
+    best = sweep["expected_loss"].idxmin()
+    assert summary["best_threshold"] == sweep.loc[best, "threshold"]
+
+def test_bootstrap_intervals_contain_the_estimate_and_are_reproducible(scores):
+    y, probs = scores
+    thresholds = np.linspace(0, 1, 11)
+
+    sweep, summary = evaluate_model.threshold_sweep(y, probs, thresholds, n_bootstrap = 50, random_state = 1)
+    again, _ = evaluate_model.threshold_sweep(y, probs, thresholds, n_bootstrap = 50, random_state = 1)
+
+    assert summary["auc_low"] < summary["auc"] < summary["auc_high"]
+    assert (sweep["recall_low"] <= sweep["recall"]).all() and (sweep["recall"] <= sweep["recall_high"]).all()
+    assert (sweep["expected_loss_low"] <= sweep["expected_loss_high"]).all()
+    assert sweep.equals(again)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.features import build_features
+from src.features import feature_store
+from src.models import train_model
+
+def test_store_holds_the_model_columns_of_the_dataset(processed_file):
+    # A chunksize that doesn't divide the rows, so the last chunk is a partial one.
+    feature_store.build_feature_store(processed_file, "loan.features", chunksize = 700)
+
+    X, y, columns = feature_store.open_feature_store("loan.features")
+
+    df = pd.read_parquet(processed_file)
+    assert columns == build_features.model_columns(df.columns)
+    expected = df[columns].fillna(0).astype(np.float32).reset_index(drop = True)
+    pd.testing.assert_frame_equal(feature_store.frame(X, columns), expected)
+    np.testing.assert_array_equal(y, df["target"].to_numpy(dtype = np.int8))
+    rows = np.array([0, 5, len(df) - 1])
+    pd.testing.assert_frame_equal(feature_store.frame(X, columns, rows), expected.iloc[rows].reset_index(drop = True))
+
+def test_store_is_split_as_the_dataset(processed_file):
+    feature_store.build_feature_store(processed_file, "loan.features")
+
+    X, y, columns, train_idx, test_idx = train_model.data_from_feature_store("loan.features")
+    X_train, X_test, y_train, y_test = train_model.data_from_dataset(processed_file)
+
+    np.testing.assert_array_equal(train_idx, np.sort(X_train.index))
+    np.testing.assert_array_equal(test_idx, np.sort(X_test.index))
+    np.testing.assert_array_equal(y[test_idx], y_test.sort_index().to_numpy())
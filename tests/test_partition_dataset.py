@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pytest
+
+from src.data import partition_dataset
+
+@pytest.mark.parametrize("n_partitions", [2, 7, 50])
+def test_byte_ranges_dont_split_multi_line_fields(tmp_path, n_partitions):
+    # Free text with line breaks, quotes and commas, as in the desc column of the raw file.
+    desc = ['Borrower added on 01/01/13 > line one\nline two, "quoted"\nline three' if i % 3 else ""
+            for i in range(200)]
+    df = pd.DataFrame({"id": range(200), "desc": desc, "loan_amnt": [1000.0 + i for i in range(200)]})
+    path = str(tmp_path / "loan.csv")
+    df.to_csv(path, index = False)
+
+    ranges = partition_dataset.byte_ranges(path, n_partitions)
+    parts = [partition_dataset.read_byte_range(path, start, end, {"dtype": {"desc": "object"}})
+             for start, end in ranges]
+
+    pd.testing.assert_frame_equal(pd.concat(parts, ignore_index = True), pd.read_csv(path, dtype = {"desc": "object"}))
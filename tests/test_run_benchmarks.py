@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from click.testing import CliRunner
+
+from src.benchmarks import run_benchmarks
+
+def test_missing_baseline_fails_before_benchmarking(tmp_path, monkeypatch):
+    def run(*args, **kwargs):
+        raise AssertionError("benchmarks ran without a baseline")
+    monkeypatch.setattr(run_benchmarks, "run_benchmarks", run)
+
+    result = CliRunner().invoke(run_benchmarks.main, ["--baseline", str(tmp_path / "baseline.json")])
+
+    assert result.exit_code == 1
+    assert "--save-baseline" in result.output
+
+def test_regression_is_flagged_only_above_tolerance():
+    def results(fit, predict):
+        return {"rows": 1000, "benchmarks": {"fit": {"min": fit, "median": fit, "rows": 100},
+                                             "predict": {"min": predict, "median": predict, "rows": 100}}}
+
+    comparison = run_benchmarks.compare_to_baseline(results(1.3, 1.2), results(1.0, 1.0), tolerance = 0.25)
+
+    assert comparison["regressed"].to_dict() == {"fit": True, "predict": False}
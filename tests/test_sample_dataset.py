@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import sample_dataset
+
+def write_raw(path, statuses):
+    """
+    Writes a small raw CSV file with one row per loan_status in statuses.
+    """
+    pd.DataFrame({"id": np.arange(len(statuses)), "loan_status": statuses}).to_csv(path, index = False)
+
+@pytest.mark.parametrize("method", sample_dataset.SAMPLE_METHODS)
+def test_stratified_sample_has_n_samples_rows(tmp_path, method):
+    # A rare stratum needs rows on top of its proportional share to reach MIN_STRATUM_ROWS.
+    statuses = ["Fully Paid"] * 8000 + ["Charged Off"] * 1900 + ["Default"] * 150
+    raw_file = str(tmp_path / "loan.csv")
+    write_raw(raw_file, statuses)
+    sample_file = str(tmp_path / "sample.csv")
+
+    sample_dataset.sample_dataset(raw_file, sample_file, n_samples = 1000, method = method, stratify = "loan_status")
+
+    sample = pd.read_csv(sample_file)
+    assert len(sample) == 1000
+    counts = sample["loan_status"].value_counts()
+    assert counts["Default"] == sample_dataset.MIN_STRATUM_ROWS
+
+def test_stratum_sizes_add_up_to_n_samples():
+    counts = pd.Series({"a": 10000, "b": 500, "c": 20, "d": 3})
+    sizes = sample_dataset.stratum_sizes(counts, 1000)
+    assert sizes.sum() == 1000
+    assert (sizes >= np.minimum(counts, sample_dataset.MIN_STRATUM_ROWS)).all()
+    assert (sizes <= counts).all()
+
+def test_stratum_sizes_keep_every_row_of_a_small_file():
+    counts = pd.Series({"a": 300, "b": 50})
+    assert sample_dataset.stratum_sizes(counts, 1000).tolist() == [300, 50]
+
+def test_stratum_sizes_reject_n_samples_below_the_floor():
+    counts = pd.Series({"a": 10000, "b": 5000, "c": 1000})
+    with pytest.raises(ValueError):
+        sample_dataset.stratum_sizes(counts, 250)
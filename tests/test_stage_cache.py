@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from src.data import stage_cache
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+class Stage:
+    """
+    A stage that writes its input, upper-cased, to its output, and counts how often it runs.
+    """
+    def __init__(self, input_path, output_path):
+        self.input_path, self.output_path, self.runs = input_path, output_path, 0
+
+    def __call__(self):
+        self.runs += 1
+        write(self.output_path, read(self.input_path).upper())
+
+def run_stage(stage, code_file, params, cache_dir, **limits):
+    stage_cache.cached_stage("upper", stage, stage.input_path, stage.output_path, [code_file], params,
+                             cache_dir = cache_dir, **limits)
+
+def test_hit_restores_the_output(tmp_path):
+    write(tmp_path / "in.txt", "loans")
+    write(tmp_path / "code.py", "v1")
+    stage = Stage(str(tmp_path / "in.txt"), str(tmp_path / "out.txt"))
+    run_stage(stage, tmp_path / "code.py", {"n": 1}, str(tmp_path / "cache"))
+    os.remove(stage.output_path)
+
+    run_stage(stage, tmp_path / "code.py", {"n": 1}, str(tmp_path / "cache"))
+
+    assert stage.runs == 1
+    assert read(stage.output_path) == "LOANS"
+
+def test_changed_input_code_or_params_miss(tmp_path):
+    write(tmp_path / "in.txt", "loans")
+    write(tmp_path / "code.py", "v1")
+    stage = Stage(str(tmp_path / "in.txt"), str(tmp_path / "out.txt"))
+    run_stage(stage, tmp_path / "code.py", {"n": 1}, str(tmp_path / "cache"))
+
+    write(tmp_path / "code.py", "v2")
+    run_stage(stage, tmp_path / "code.py", {"n": 1}, str(tmp_path / "cache"))
+    run_stage(stage, tmp_path / "code.py", {"n": 2}, str(tmp_path / "cache"))
+    write(tmp_path / "in.txt", "more loans")
+    run_stage(stage, tmp_path / "code.py", {"n": 2}, str(tmp_path / "cache"))
+
+    assert stage.runs == 4
+    assert read(stage.output_path) == "MORE LOANS"
+
+def test_partial_copies_and_memo_are_not_reused(tmp_path):
+    write(tmp_path / "in.txt", "loans")
+    write(tmp_path / "code.py", "v1")
+    cache_dir = tmp_path / "cache"
+    stage = Stage(str(tmp_path / "in.txt"), str(tmp_path / "out.txt"))
+    run_stage(stage, tmp_path / "code.py", {}, str(cache_dir))
+    # As if a run had been interrupted while copying its output into the cache and writing the memo.
+    (entry,) = [x for x in os.listdir(cache_dir) if x.startswith("upper-")]
+    os.rename(cache_dir / entry, cache_dir / (entry + stage_cache.TMP_SUFFIX + "1"))
+    write(cache_dir / stage_cache.DIGESTS_FILE, '{"torn')
+
+    run_stage(stage, tmp_path / "code.py", {}, str(cache_dir))
+
+    assert stage.runs == 2
+    assert os.path.exists(cache_dir / entry)
+
+def test_evicts_old_and_least_recently_used_entries(tmp_path):
+    cache_dir = tmp_path / "cache"
+    os.makedirs(cache_dir)
+    now = time.time()
+    for name, age_days in [("old.txt", 40), ("used.txt", 1), ("recent.txt", 0), ("stale.txt.tmp-1", 40)]:
+        write(cache_dir / name, "x" * 100)
+        os.utime(cache_dir / name, (now - age_days * 24 * 3600,) * 2)
+
+    stage_cache.evict(str(cache_dir), max_bytes = 150, max_age_days = 30)
+
+    assert sorted(os.listdir(cache_dir)) == ["recent.txt"]
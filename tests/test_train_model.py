@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from src.models import model_bundle
+from src.models import train_model
+from src.models import validate_features
+
+def test_reservoir_sample_of_chunks_matches_sample_of_the_whole(monkeypatch):
+    monkeypatch.setattr(validate_features, "PROFILE_ROWS", 100)
+    df = pd.DataFrame({"x": np.arange(10000.0)})
+
+    sample, rng = None, np.random.default_rng(0)
+    for start in range(0, len(df), 700):
+        sample = validate_features.reservoir_sample(sample, df.iloc[start:start + 700], rng)
+    whole = validate_features.reservoir_sample(None, df, np.random.default_rng(0))
+
+    assert len(sample[0]) == 100
+    pd.testing.assert_frame_equal(sample[0], whole[0])
+
+def test_streaming_saves_a_profile_of_the_training_data(processed_file):
+    result = CliRunner().invoke(train_model.main, [processed_file, "model.pickle", "--chunksize", "500"])
+
+    assert result.exit_code == 0, result.output
+    profile = validate_features.load_profile("model.pickle")
+    columns = model_bundle.load_bundle("model.pickle")["columns"]
+    assert profile["columns"] == validate_features.numeric_columns(columns)
+    # The training rows, before undersampling: about 1 - TEST_SIZE of the rows.
+    assert abs(profile["rows"] / len(pd.read_parquet(processed_file)) - (1 - train_model.TEST_SIZE)) < 0.05
+
+def test_streaming_trains_the_chosen_model(processed_file):
+    pipeline = train_model.train_streaming(processed_file, 500, "sgd", train_model.RANDOM_STATE)[0]
+
+    model = pipeline.named_steps["model"]
+    assert type(model).__name__ == "SGDClassifier"
+    assert model.random_state == train_model.RANDOM_STATE
+
+def test_streaming_rejects_models_without_partial_fit(processed_file):
+    result = CliRunner().invoke(train_model.main, [processed_file, "model.pickle", "--chunksize", "500", "--model", "rf"])
+
+    assert result.exit_code != 0
+    assert "partial_fit" in result.output